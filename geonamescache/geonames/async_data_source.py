@@ -0,0 +1,102 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from data_source import DataSource
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
+
+class AsyncDataSource(object):
+
+    """
+    Wraps a DataSource so that it can be used from an event loop without blocking it.
+
+    Single name and id lookups are cheap dictionary reads, so they (and batches of at most
+    `inline_batch_size` names) run inline and return an already completed future. Larger batches
+    run on a thread pool of at most `max_workers` threads. Since those threads give up the GIL
+    every few milliseconds, the event loop keeps running while a batch is being resolved. If no
+    data source is given, the initial (slow) data load also runs on the thread pool, and lookups
+    made before it finishes wait for it there.
+
+    All methods return a `concurrent.futures.Future`. If an asyncio event loop is given, they
+    return asyncio futures instead, so that results can be awaited directly:
+
+        async_data_source = AsyncDataSource(loop=loop)
+        lebanons = await async_data_source.search('Lebanon')
+    """
+
+    def __init__(self, data_source=None, max_workers=4, inline_batch_size=32, loop=None):
+        if loop is not None and asyncio is None:
+            raise ValueError('An event loop was given, but asyncio is not available')
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._inline_batch_size = inline_batch_size
+        self._loop = loop
+
+        self._data_source = data_source
+        if data_source is None:
+            self._loading = self._executor.submit(DataSource)
+        else:
+            self._loading = None
+
+    def load(self):
+        """
+        Returns a future that resolves to the wrapped DataSource once its data is loaded.
+        """
+        if self._data_source is not None:
+            return self._completed(lambda: self._data_source)
+        return self._wrap(self._executor.submit(self._get_data_source))
+
+    def search(self, name, resolution=None):
+        return self._run(True, '_name_search', name, resolution)
+
+    def bulk_search(self, names, resolution=None):
+        names = list(names)
+        inline = len(names) <= self._inline_batch_size
+        return self._run(inline, 'bulk_search', names, resolution)
+
+    def get_location_by_id(self, id_):
+        return self._run(True, 'get_location_by_id', id_)
+
+    def locations_in_box(self, south, west, north, east, resolution=None):
+        # A box can hold any number of locations, and the index is built on the first query.
+        return self._run(False, 'locations_in_box', south, west, north, east, resolution)
+
+    def reverse_geocode(self, latitude, longitude, max_distance_km=50.):
+        return self._run(True, 'reverse_geocode', latitude, longitude, max_distance_km)
+
+    def distance(self, id_a, id_b):
+        return self._run(True, 'distance', id_a, id_b)
+
+    def close(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def _get_data_source(self):
+        if self._data_source is None:
+            self._data_source = self._loading.result()
+        return self._data_source
+
+    def _run(self, inline, method_name, *args):
+        if self._data_source is None and self._loading.done():
+            self._get_data_source()
+
+        if inline and self._data_source is not None:
+            return self._completed(lambda: getattr(self._data_source, method_name)(*args))
+        return self._wrap(self._executor.submit(
+            lambda: getattr(self._get_data_source(), method_name)(*args)
+        ))
+
+    def _completed(self, func):
+        future = Future()
+        try:
+            future.set_result(func())
+        except Exception as e:
+            future.set_exception(e)
+        return self._wrap(future)
+
+    def _wrap(self, future):
+        if self._loop is None:
+            return future
+        return asyncio.wrap_future(future, loop=self._loop)
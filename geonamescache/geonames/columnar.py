@@ -0,0 +1,182 @@
+import json
+import os
+
+import numpy as np
+
+from utils import ResolutionTypes
+
+
+"""
+Reads and writes the gazetteer as typed columns, so that analytics code can load it straight into
+NumPy arrays (and from there into pandas) instead of converting location dicts row by row.
+
+An export is a directory with a schema.json and one .npy file per column of two tables:
+
+    locations   id, resolution, name, country_id, admin_level_1_id, admin_level_2_id,
+                population, estimated_importance, latitude, longitude
+    aliases     name, location_id (one row per searchable name of each location)
+
+Numeric columns are plain arrays. Missing country and admin ids are 0, and missing importances and
+coordinates are NaN. Resolutions are stored as uint8 codes, indexing RESOLUTIONS. String columns
+are stored as in Arrow, as a UTF-8 buffer (<column>.data.npy) and the int64 offsets of each value
+in it (<column>.offsets.npy), so that no Python object is created per row when reading them.
+"""
+
+SCHEMA_VERSION = 1
+
+RESOLUTIONS = (
+    ResolutionTypes.COUNTRY, ResolutionTypes.ADMIN_1, ResolutionTypes.ADMIN_2, ResolutionTypes.CITY,
+)
+
+_LOCATION_COLUMNS = (
+    ('id', 'int64'),
+    ('resolution', 'uint8'),
+    ('name', 'string'),
+    ('country_id', 'int64'),
+    ('admin_level_1_id', 'int64'),
+    ('admin_level_2_id', 'int64'),
+    ('population', 'int64'),
+    ('estimated_importance', 'float64'),
+    ('latitude', 'float64'),
+    ('longitude', 'float64'),
+)
+
+_ALIAS_COLUMNS = (
+    ('name', 'string'),
+    ('location_id', 'int64'),
+)
+
+
+class StringColumn(object):
+
+    """
+    A column of strings, where value i is data[offsets[i]:offsets[i + 1]] decoded from UTF-8.
+    """
+
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tostring().decode('utf-8')
+
+    def to_numpy(self):
+        """
+        Returns the strings as a fixed-width unicode array.
+        """
+        return np.array([self[i] for i in xrange(len(self))], dtype=np.unicode_)
+
+
+def write_columns(directory, locations_by_name, locations_by_id):
+    """
+    Writes the locations and their names (as returned by load_data) to the given directory.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    locations = [locations_by_id[id_] for id_ in sorted(locations_by_id)]
+    location_columns = {
+        'id': [location['id'] for location in locations],
+        'resolution': [RESOLUTIONS.index(location['resolution']) for location in locations],
+        'name': [location['name'] for location in locations],
+        'country_id': [location['country_id'] or 0 for location in locations],
+        'admin_level_1_id': [location.get('admin_level_1_id') or 0 for location in locations],
+        'admin_level_2_id': [location.get('admin_level_2_id') or 0 for location in locations],
+        'population': [location['population'] for location in locations],
+    }
+    for field in ('estimated_importance', 'latitude', 'longitude'):
+        location_columns[field] = [_float_or_nan(location.get(field)) for location in locations]
+
+    aliases = sorted(
+        (name, id_) for name, ids in locations_by_name.iteritems() for id_ in ids
+    )
+    alias_columns = {
+        'name': [name for name, _ in aliases],
+        'location_id': [id_ for _, id_ in aliases],
+    }
+
+    schema = {
+        'version': SCHEMA_VERSION,
+        'resolutions': list(RESOLUTIONS),
+        'tables': {},
+    }
+    for table, columns, values_by_column in (
+        ('locations', _LOCATION_COLUMNS, location_columns),
+        ('aliases', _ALIAS_COLUMNS, alias_columns),
+    ):
+        for column, type_ in columns:
+            _write_column(
+                os.path.join(directory, '%s.%s' % (table, column)), type_, values_by_column[column]
+            )
+        schema['tables'][table] = {
+            'n_rows': len(values_by_column[columns[0][0]]),
+            'columns': [{'name': column, 'type': type_} for column, type_ in columns],
+        }
+
+    with open(os.path.join(directory, 'schema.json'), 'w') as schema_file:
+        json.dump(schema, schema_file, indent=2, sort_keys=True)
+
+def read_columns(directory, mmap=False):
+    """
+    Reads an export written by write_columns. Returns a dictionary of each table name
+    ('locations', 'aliases') to a dictionary of its column names to NumPy arrays, or to
+    StringColumns for string columns. If mmap is True, the arrays are memory-mapped instead of
+    read into memory.
+    """
+    with open(os.path.join(directory, 'schema.json')) as schema_file:
+        schema = json.load(schema_file)
+    if schema['version'] != SCHEMA_VERSION:
+        raise ValueError('Unsupported columnar schema version %r' % schema['version'])
+
+    mmap_mode = 'r' if mmap else None
+    tables = {}
+    for table, table_schema in schema['tables'].iteritems():
+        tables[table] = {}
+        for column in table_schema['columns']:
+            path = os.path.join(directory, '%s.%s' % (table, column['name']))
+            if column['type'] == 'string':
+                values = StringColumn(
+                    np.load(path + '.offsets.npy', mmap_mode=mmap_mode),
+                    np.load(path + '.data.npy', mmap_mode=mmap_mode),
+                )
+            else:
+                values = np.load(path + '.npy', mmap_mode=mmap_mode)
+            if len(values) != table_schema['n_rows']:
+                raise ValueError('Column %s.%s has the wrong length' % (table, column['name']))
+            tables[table][column['name']] = values
+
+    return tables
+
+def find_indexes(ids, query_ids, sorter=None):
+    """
+    Returns the index in ids of each of query_ids as an int64 array, with -1 for the ids that are
+    not in ids (including when ids is empty). ids must be sorted, unless sorter is given, as the
+    indexes that sort them (see np.argsort).
+    """
+    query_ids = np.asarray(query_ids)
+    indexes = np.full(len(query_ids), -1, dtype=np.int64)
+    if not len(ids):
+        return indexes
+
+    positions = np.minimum(np.searchsorted(ids, query_ids, sorter=sorter), len(ids) - 1)
+    if sorter is not None:
+        positions = sorter[positions]
+    found = ids[positions] == query_ids
+    indexes[found] = positions[found]
+    return indexes
+
+def _write_column(path, type_, values):
+    if type_ == 'string':
+        encoded = [value.encode('utf-8') for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        np.save(path + '.offsets.npy', offsets)
+        np.save(path + '.data.npy', np.frombuffer(''.join(encoded), dtype=np.uint8))
+    else:
+        np.save(path + '.npy', np.array(values, dtype=type_))
+
+def _float_or_nan(value):
+    return float('nan') if value is None else float(value)
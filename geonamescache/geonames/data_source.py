@@ -1,30 +1,182 @@
 import json
 import os
+import re
+from array import array
+from timeit import default_timer
 
-from utils import ResolutionTypes, standardize_loc_name
+try:
+    import numpy as np
+    from columnar import find_indexes
+except ImportError:
+    np = None
 
+from metrics import timer
+from spatial import build_index, haversine_km, haversine_km_matrix
+from utils import BloomFilter, LRUCache, ResolutionTypes, standardize_loc_name
+
+
+_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+_SHARDS_DIR = os.path.join(_DATA_DIR, 'shards')
 
 _LOCATIONS_BY_NAME = None
 _LOCATIONS_BY_ID = None
+# country code -> (locations by name, locations by id) of the country's shard
+_SHARDS = {}
 
-def _get_locations_data():
+def _get_locations_data(metrics=None):
     global _LOCATIONS_BY_NAME
     global _LOCATIONS_BY_ID
 
     if _LOCATIONS_BY_NAME is None:
-        data_filepath = os.path.join(
-            os.path.dirname(os.path.abspath(__file__)), 'data', 'geonames_all.json'
-        )
-        with open(data_filepath) as f:
-            _LOCATIONS_BY_NAME = json.load(f)
+        with timer(metrics, 'geonames_load_seconds', source='snapshot', phase='read'):
+            with open(os.path.join(_DATA_DIR, 'geonames_all.json')) as f:
+                snapshot = _load_snapshot(f)
 
-        _LOCATIONS_BY_ID = {}
-        for locations_with_name in _LOCATIONS_BY_NAME.itervalues():
-            for id_, location in locations_with_name.iteritems():
-                _LOCATIONS_BY_ID[id_] = location
+        with timer(metrics, 'geonames_load_seconds', source='snapshot', phase='index'):
+            _LOCATIONS_BY_NAME, _LOCATIONS_BY_ID = _index_snapshot(snapshot)
 
     return _LOCATIONS_BY_NAME, _LOCATIONS_BY_ID
 
+def _get_shards_data(country_codes, metrics=None):
+    """
+    Returns the locations by name and by id of the shards of the given countries, merged.
+    """
+    shards = [_get_shard_data(country_code.upper(), metrics) for country_code in country_codes]
+    if len(shards) == 1:
+        return shards[0]
+
+    locations_by_name = {}
+    locations_by_id = {}
+    for shard_locations_by_name, shard_locations_by_id in shards:
+        locations_by_id.update(shard_locations_by_id)
+        for name, ids in shard_locations_by_name.iteritems():
+            if name in locations_by_name:
+                locations_by_name[name] = locations_by_name[name] + ids
+            else:
+                locations_by_name[name] = ids
+
+    return locations_by_name, locations_by_id
+
+def _get_shard_data(country_code, metrics=None):
+    if country_code not in _SHARDS:
+        shard_filepath = os.path.join(_SHARDS_DIR, '%s.json' % country_code)
+        if not os.path.isfile(shard_filepath):
+            raise ValueError('There is no shard for the country code %r' % country_code)
+
+        with timer(metrics, 'geonames_load_seconds', source='shard', phase='read'):
+            with open(shard_filepath) as f:
+                shard = _load_snapshot(f)
+
+        with timer(metrics, 'geonames_load_seconds', source='shard', phase='index'):
+            locations_by_name, locations_by_id = _index_snapshot(shard)
+            # Neighboring countries can be looked up by id, but are not searchable by name.
+            for neighbor in shard['neighbors']:
+                locations_by_id.setdefault(neighbor['id'], neighbor)
+            _SHARDS[country_code] = locations_by_name, locations_by_id
+
+    return _SHARDS[country_code]
+
+def _index_snapshot(snapshot):
+    """
+    Takes a snapshot of the form {'locations': [location], 'names': {name: [id]}}, where each
+    location is stored once no matter how many names it has. Returns the locations by name (as
+    arrays of ids) and by id.
+    """
+    locations_by_id = {location['id']: location for location in snapshot['locations']}
+    locations_by_name = {name: array('i', ids) for name, ids in snapshot['names'].iteritems()}
+    return locations_by_name, locations_by_id
+
+_NON_ASCII_RE = re.compile(r'[^\x00-\x7f]')
+
+# Fields whose values repeat across many locations.
+_REPEATED_VALUE_FIELDS = frozenset((
+    'resolution', 'country_code', 'country', 'admin_level_1', 'admin_level_2'
+))
+
+def _load_snapshot(snapshot_file):
+    """
+    Reads a snapshot, sharing a single copy of each repeated string between the locations. JSON
+    decoding otherwise creates a new copy of every string, so that each location would have its own
+    copy of its keys, resolution, country code, and the names of its country and admins.
+    """
+    strings = {resolution: resolution for resolution in (
+        ResolutionTypes.COUNTRY, ResolutionTypes.ADMIN_1, ResolutionTypes.ADMIN_2,
+        ResolutionTypes.CITY,
+    )}
+
+    shared = strings.setdefault
+
+    def share_strings(pairs):
+        obj = {}
+        for key, value in pairs:
+            key = shared(key, key)
+            if key in _REPEATED_VALUE_FIELDS and value is not None:
+                value = shared(value, value)
+            obj[key] = value
+        return obj
+
+    return json.load(snapshot_file, object_pairs_hook=share_strings)
+
+
+class _ReadOnlyDict(dict):
+
+    """
+    A dict that can not be modified, for results that are shared between callers. Copies
+    (copy(), dict(...), copy.deepcopy) are plain dicts, but only copy.deepcopy also copies the
+    read-only lists and dicts in it into plain ones.
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('Cached search results are read-only; copy.deepcopy them to modify them')
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+
+class _ReadOnlyList(list):
+
+    """
+    A list that can not be modified, for results that are shared between callers.
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('Cached search results are read-only; copy.deepcopy them to modify them')
+
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = __iadd__ = __imul__ = _read_only
+    append = extend = insert = pop = remove = reverse = sort = _read_only
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+
+def _freeze(value):
+    """
+    Returns a read-only copy of the dicts and lists in the value.
+    """
+    if isinstance(value, dict):
+        return _ReadOnlyDict((key, _freeze(item)) for key, item in value.iteritems())
+    if isinstance(value, list):
+        return _ReadOnlyList(_freeze(item) for item in value)
+    return value
+
+def _to_id(id_):
+    """
+    Returns the id as an int, or None if it is not an int or a string of an int.
+    """
+    try:
+        return int(id_)
+    except (TypeError, ValueError):
+        return None
+
+def _build_prefilter(locations_by_name, error_rate):
+    lowercase_names = set(name.lower() for name in locations_by_name)
+    prefilter = BloomFilter(len(lowercase_names), error_rate)
+    for name in lowercase_names:
+        prefilter.add(name)
+    return prefilter
+
 
 class DataSource(object):
 
@@ -40,22 +192,22 @@ class DataSource(object):
 
     {
         id: {
-            id: unicode,                            # Globally unique ID
+            id: int,                                # Globally unique ID
             resolution: str,                        # One of ResolutionTypes.
                                                     # {CITY, ADMIN_1, ADMIN_2, COUNTRY}
             name: unicode,                          # Main name
             
             country: unicode,                       # Country name
             country_code: unicode,                  # 2 letter country code
-            country_id: unicode,                    # Country ID 
+            country_id: int,                        # Country ID
             
             admin_level_1: Optional[unicode],       # Admin 1 name
                                                     # (only if this is a city or admin_level_2)
-            admin_level_1_id: Optional[unicode],    # Admin 1 ID
+            admin_level_1_id: Optional[int],        # Admin 1 ID
                                                     # (only if this is a city or admin_level_2)
                                                     
             admin_level_2: Optional[unicode],       # Admin 2 name (only if this is a city)
-            admin_level_2_id: Optional[unicode],    # Admin 2 ID (only if this is a city)
+            admin_level_2_id: Optional[int],        # Admin 2 ID (only if this is a city)
             
             population: int,                        # Population. This is provided for cities and
                                                     # countries (although it can be 0 for small
@@ -66,10 +218,18 @@ class DataSource(object):
             estimated_importance: float,            # Estimated importance score for a location
                                                     # The scale is [0 - 1].
                                                 
-            latitude: Optional[float],              # Only available for cities right now
-            longitude: Optional[float],             # Only available for cities right now
+            latitude: Optional[float],              # For countries and admin districts, the
+            longitude: Optional[float],             # centroid of their cities (None if they
+                                                    # have no cities)
+
+            bounding_box: Optional[List[float]],    # [south, west, north, east] of the cities
+                                                    # of a country or admin district, with
+                                                    # west > east across the antimeridian
+            bounding_box_area: Optional[float],     # Area of the bounding box in km^2, a rough
+                                                    # measure of size. Neither is available for
+                                                    # cities.
             
-            neighbor_country_ids: Optional[List[unicode]],
+            neighbor_country_ids: Optional[List[int]],
                                                     # IDs of neighboring countries
                                                     # Only available for countries
         }
@@ -92,15 +252,134 @@ class DataSource(object):
         
     """
 
-    def __init__(self):
-        self._locations_by_name, self._locations_by_id = _get_locations_data()
+    def __init__(
+        self, metrics=None, countries=None, cache_size=0, prefilter_error_rate=None,
+        distance_cache_size=0,
+    ):
+        """
+        If a metrics.Metrics instance is given, lookup counts and latencies are recorded to it.
+
+        If a list of country codes is given, only the shards of those countries are loaded
+        (see snapshot.write_shards), and only locations in those countries are searched. Raises
+        ValueError if a country has no shard.
+
+        If cache_size is positive, the results of up to that many (standardized name, resolution)
+        searches are cached, evicting the least recently used. Cached results are shared between
+        calls, so they are read-only, down to the lists in their locations; copy a location with
+        copy.deepcopy to modify it (location.copy() is shallow, so its lists stay read-only).
+
+        If prefilter_error_rate is given, searches first check a Bloom filter of the searchable
+        names (see might_contain), so that most names of no location are rejected without being
+        standardized. About that fraction of such names still pass the filter.
+
+        If distance_cache_size is positive, the distances between up to that many pairs of ids are
+        cached (see distance), evicting the least recently used.
+        """
+        if countries is None:
+            self._locations_by_name, self._locations_by_id = _get_locations_data(metrics)
+        else:
+            self._locations_by_name, self._locations_by_id = _get_shards_data(countries, metrics)
+        self._country_codes = countries and set(code.upper() for code in countries)
+        # Built on the first spatial query.
+        self._spatial_index = None
+        # Built on the first distance_matrix call.
+        self._coordinates = None
+
+        self._prefilter = None
+        if prefilter_error_rate is not None:
+            self._prefilter = _build_prefilter(self._locations_by_name, prefilter_error_rate)
+            self._name_search = self._prefiltered_name_search
+
+        self._metrics = metrics
+        if metrics is not None:
+            self._name_search = self._instrumented_name_search
+
+        self._cache = None
+        if cache_size > 0:
+            self._cache = LRUCache(cache_size)
+            self._lookup = self._cached_lookup
+
+        self._distance_cache = None
+        if distance_cache_size > 0:
+            self._distance_cache = LRUCache(distance_cache_size)
+            self.distance = self._cached_distance
 
     def _name_search(self, name, resolution=None):
-        name = standardize_loc_name(name)
-        return {
-            id_: loc.copy() for id_, loc in self._locations_by_name.get(name, {}).iteritems()
-            if not resolution or loc['resolution'] == resolution
-        }
+        return self._lookup(standardize_loc_name(name), resolution)
+
+    def _prefiltered_name_search(self, name, resolution=None):
+        if not self.might_contain(name):
+            return {}
+        return self._lookup(standardize_loc_name(name), resolution)
+
+    def _instrumented_name_search(self, name, resolution=None):
+        start = default_timer()
+        if self._prefilter is not None and not self.might_contain(name):
+            standard_name = None
+            standardized = default_timer()
+            results = {}
+        else:
+            standard_name = standardize_loc_name(name)
+            standardized = default_timer()
+            results = self._lookup(standard_name, resolution)
+        end = default_timer()
+
+        if results:
+            result = 'hit'
+        elif standard_name in self._locations_by_name:
+            result = 'empty'
+        else:
+            result = 'miss'
+
+        resolution_label = resolution or 'ALL'
+        self._metrics.increment(
+            'geonames_lookups_total', resolution=resolution_label, result=result
+        )
+        self._metrics.observe('geonames_standardize_seconds', standardized - start)
+        self._metrics.observe('geonames_search_seconds', end - start, resolution=resolution_label)
+
+        return results
+
+    def _find_locations(self, standard_name, resolution):
+        results = {}
+        for id_ in self._locations_by_name.get(standard_name, ()):
+            location = self._locations_by_id[id_]
+            if not resolution or location['resolution'] == resolution:
+                results[id_] = location.copy()
+        return results
+
+    # Replaced by _cached_lookup when results are cached.
+    _lookup = _find_locations
+
+    def _cached_lookup(self, standard_name, resolution):
+        key = (standard_name, resolution)
+        results = self._cache.get(key)
+        if results is None:
+            results = _freeze(self._find_locations(standard_name, resolution))
+            self._cache.put(key, results)
+        return results
+
+    def cache_info(self):
+        """
+        Returns the hits, misses, evictions, size and max_size of the result cache, or None if
+        results are not cached.
+        """
+        if self._cache is not None:
+            return self._cache.info()
+
+    def might_contain(self, name):
+        """
+        Returns whether some location may have the given name. False answers are always right,
+        but with a prefilter (see __init__), some True answers are wrong. Without a prefilter, the
+        answer is exact.
+        """
+        if name is None:
+            return False
+        if self._prefilter is None:
+            return standardize_loc_name(name) in self._locations_by_name
+        # For ASCII names, standardization only changes the case. Other names could become any
+        # name once transliterated, so they are not filtered.
+        return name.lower() in self._prefilter or bool(_NON_ASCII_RE.search(name))
 
     def city_search(self, city_name):
         return self._name_search(city_name, ResolutionTypes.CITY)
@@ -117,7 +396,158 @@ class DataSource(object):
     def all_locations_search(self, name):
         return self._name_search(name)
 
+    def bulk_search(self, names, resolution=None):
+        """
+        Searches for many names at once. Returns a dictionary of each name to its search results.
+        """
+        return {name: self._name_search(name, resolution) for name in names}
+
     def get_location_by_id(self, id_):
+        """
+        Returns the location with the given id, which may be an int or a string of an int.
+        """
+        id_ = _to_id(id_)
         if id_ in self._locations_by_id:
             return self._locations_by_id[id_].copy()
 
+    def _get_spatial_index(self):
+        if self._spatial_index is None:
+            locations_by_id = self._locations_by_id
+            if self._country_codes:
+                # Neighbors in the shards are not searchable, by location either.
+                locations_by_id = {
+                    id_: location for id_, location in locations_by_id.iteritems()
+                    if location['country_code'] in self._country_codes
+                }
+            self._spatial_index = build_index(locations_by_id)
+        return self._spatial_index
+
+    def locations_in_box(self, south, west, north, east, resolution=None):
+        """
+        Returns the cities in the box, and the countries and admins whose bounding boxes intersect
+        it, of the given resolution (if any), as search results. The box is in degrees, and crosses
+        the antimeridian if west > east.
+        """
+        box = [south, west, north, east]
+        index = self._get_spatial_index()
+        ids = set()
+        if resolution in (None, ResolutionTypes.CITY):
+            ids.update(index.points_in_box(box))
+        if resolution != ResolutionTypes.CITY:
+            ids.update(index.boxes_intersecting(box))
+
+        results = {}
+        for id_ in ids:
+            location = self._locations_by_id[id_]
+            if not resolution or location['resolution'] == resolution:
+                results[id_] = location.copy()
+        return results
+
+    def reverse_geocode(self, latitude, longitude, max_distance_km=50.):
+        """
+        Returns the nearest city to the coordinates, within max_distance_km, along with its admins
+        and country, as a dictionary of each resolution to its location. Returns an empty
+        dictionary if no city is that close.
+        """
+        nearest = self._get_spatial_index().nearest_point(latitude, longitude, max_distance_km)
+        if nearest is None:
+            return {}
+
+        city = self._locations_by_id[nearest[1]]
+        results = {ResolutionTypes.CITY: city.copy()}
+        for resolution, id_field in (
+            (ResolutionTypes.ADMIN_2, 'admin_level_2_id'),
+            (ResolutionTypes.ADMIN_1, 'admin_level_1_id'),
+            (ResolutionTypes.COUNTRY, 'country_id'),
+        ):
+            region = self._locations_by_id.get(city[id_field])
+            if region is not None:
+                results[resolution] = region.copy()
+        return results
+
+    def distance(self, id_a, id_b):
+        """
+        Returns the great-circle distance in kilometers between the locations with the given ids
+        (ints or strings of ints, as in get_location_by_id), or None if either has no coordinates
+        (or does not exist). Countries and admins are at the centroid of their cities.
+        """
+        location_a = self._locations_by_id.get(_to_id(id_a))
+        location_b = self._locations_by_id.get(_to_id(id_b))
+        if location_a is None or location_b is None:
+            return None
+
+        latitude_a = location_a.get('latitude')
+        latitude_b = location_b.get('latitude')
+        if latitude_a is None or latitude_b is None:
+            return None
+        return haversine_km(
+            latitude_a, location_a['longitude'], latitude_b, location_b['longitude']
+        )
+
+    # Replaces distance when distances are cached.
+    def _cached_distance(self, id_a, id_b):
+        id_a = _to_id(id_a)
+        id_b = _to_id(id_b)
+        # The distance is symmetric, so both orders of a pair share an entry.
+        key = (id_a, id_b) if id_a <= id_b else (id_b, id_a)
+        distance = self._distance_cache.get(key, key)
+        if distance is key:
+            distance = DataSource.distance(self, id_a, id_b)
+            self._distance_cache.put(key, distance)
+        return distance
+
+    def distance_cache_info(self):
+        """
+        Returns the hits, misses, evictions, size and max_size of the distance cache, or None if
+        distances are not cached.
+        """
+        if self._distance_cache is not None:
+            return self._distance_cache.info()
+
+    def _get_coordinates(self):
+        # Sorted ids, with the latitudes and longitudes of their locations (NaN when missing),
+        # packed into numpy arrays.
+        if self._coordinates is None:
+            ids = array('i', sorted(self._locations_by_id))
+            latitudes = array('d')
+            longitudes = array('d')
+            for id_ in ids:
+                location = self._locations_by_id[id_]
+                latitude = location.get('latitude')
+                latitudes.append(np.nan if latitude is None else latitude)
+                longitudes.append(np.nan if latitude is None else location['longitude'])
+            self._coordinates = (
+                np.frombuffer(ids, dtype=np.int32),
+                np.frombuffer(latitudes, dtype=np.float64),
+                np.frombuffer(longitudes, dtype=np.float64),
+            )
+        return self._coordinates
+
+    def _find_coordinates(self, ids):
+        # Returns the latitudes and longitudes of the locations with the given ids, NaN for ids
+        # without coordinates or locations.
+        all_ids, latitudes, longitudes = self._get_coordinates()
+        # Ids that are not ints or strings of ints are -1, the id of no location.
+        ids = np.array(
+            [-1 if id_ is None else id_ for id_ in (_to_id(id_) for id_ in ids)], dtype=np.int64
+        )
+        indexes = find_indexes(all_ids, ids)
+        found = indexes >= 0
+        found_latitudes = np.full(len(ids), np.nan)
+        found_latitudes[found] = latitudes[indexes[found]]
+        found_longitudes = np.full(len(ids), np.nan)
+        found_longitudes[found] = longitudes[indexes[found]]
+        return found_latitudes, found_longitudes
+
+    def distance_matrix(self, ids_a, ids_b):
+        """
+        Returns a numpy array of the distances in kilometers (see distance) between each of ids_a
+        (rows) and each of ids_b (columns), with NaN where a location has no coordinates. Requires
+        numpy.
+        """
+        if np is None:
+            raise ImportError('distance_matrix requires numpy')
+
+        latitudes_a, longitudes_a = self._find_coordinates(ids_a)
+        latitudes_b, longitudes_b = self._find_coordinates(ids_b)
+        return haversine_km_matrix(latitudes_a, longitudes_a, latitudes_b, longitudes_b)
@@ -1,9 +1,15 @@
 import csv
 import json
+import math
 import os
-from collections import defaultdict
+from array import array
+from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
+from itertools import chain
 
 from manual_alternate_names import FIXED_ALTERNATE_NAMES
+from metrics import timer
+from spatial import get_box_area, get_longitude_interval, get_mean_longitude
 from utils import (
     get_alt_punc_names,
     ResolutionTypes,
@@ -29,39 +35,252 @@ _KEEP_FEATURE_CODES = {
 
 _MIN_POPULATION_FOR_ALT_WIKI_NAMES = 10 ** 5
 
-_LOCATIONS_BY_NAME = defaultdict(dict)
+# Names map to the ids of the locations with that name, and ids map to the locations themselves.
+_LOCATIONS_BY_NAME = defaultdict(list)
 _LOCATIONS_BY_ID = {}
 
-def load_data():
+def load_data(metrics=None, profiler=None):
     """
     Reads in data from geonames, as well as our own computed alternative names from wikipedia and
     estimated importance scores based off of OSM data.
     
-    Returns two dictionaries with data of the format described in data_source.py.
+    Returns a dictionary of names to the ids of locations with that name (including alternate
+    names), and a dictionary of ids to locations of the format described in data_source.py. If a
+    metrics.Metrics instance is given, the time spent in each loading phase is recorded to it. If
+    a metrics.LoadProfiler is given, it records a report of each loading phase (see
+    LoadProfiler.report). Nothing is recorded if the data was already loaded.
     """
     if _LOCATIONS_BY_ID:
         return _LOCATIONS_BY_NAME, _LOCATIONS_BY_ID
 
+    def phase(name):
+        return _load_phase(name, metrics, profiler)
+
     # We need to read the locations in order of country -> admin level 1 -> admin level 2 -> city.
     # This is so that the higher resolution locations can look up the lower resolution locations
     # that they belong to, and compute the necessary fields.
-    countries_by_code = _load_country_data(_DATA_FILES['country'])
-    admin1_by_code = _load_admin1_data(_DATA_FILES['admin_1'], countries_by_code)
-    admin2_by_code = _load_admin2_data(_DATA_FILES['admin_2'], countries_by_code, admin1_by_code)
-    _load_city_data(_DATA_FILES['city'], countries_by_code, admin1_by_code, admin2_by_code)
-    _add_alternate_names(_DATA_FILES['alt_wiki_names'])
-    _add_estimated_importances(_DATA_FILES['estimated_importance'])
+    with phase('country') as stats:
+        countries_by_code = _load_country_data(_DATA_FILES['country'], stats)
+    with phase('admin_1') as stats:
+        admin1_by_code = _load_admin1_data(_DATA_FILES['admin_1'], countries_by_code, stats)
+    with phase('admin_2') as stats:
+        admin2_by_code = _load_admin2_data(
+            _DATA_FILES['admin_2'], countries_by_code, admin1_by_code, stats
+        )
+    with phase('city') as stats:
+        _load_city_data(
+            _DATA_FILES['city'], countries_by_code, admin1_by_code, admin2_by_code, stats
+        )
+    with phase('alt_names') as stats:
+        _add_alternate_names(_DATA_FILES['alt_wiki_names'], stats)
+    with phase('importances') as stats:
+        _add_estimated_importances(_DATA_FILES['estimated_importance'], stats)
+
+    # Nothing is added after loading, so pack the ids into arrays.
+    for name, ids in _LOCATIONS_BY_NAME.iteritems():
+        _LOCATIONS_BY_NAME[name] = array('i', ids)
 
     return _LOCATIONS_BY_NAME, _LOCATIONS_BY_ID
 
-def _load_country_data(filepath):
-    countries_by_code = {}
+@contextmanager
+def _load_phase(name, metrics, profiler):
+    """
+    Times a loading phase, and yields a dictionary for the phase to count what it did in.
+    """
+    with timer(metrics, 'geonames_load_seconds', source='geonames', phase=name):
+        if profiler is None:
+            yield defaultdict(int)
+        else:
+            with profiler.phase(name) as stats:
+                yield stats
+
+def _add_location(data, stats):
+    """
+    Adds a new location to the data, searchable by its name and alternative punctuations of it.
+    """
+    _add_name(data['name'], data, stats)
+    for alt_name in get_alt_punc_names(data['name']):
+        _add_name(alt_name, data, stats)
+
+    assert data['id'] not in _LOCATIONS_BY_ID
+    _LOCATIONS_BY_ID[data['id']] = data
+
+def _add_name(name, location, stats):
+    ids_with_name = _LOCATIONS_BY_NAME[name]
+    if location['id'] not in ids_with_name:
+        ids_with_name.append(location['id'])
+        if name != location['name']:
+            stats['aliases'] += 1
+
+def iter_locations(resolution=None, min_population=0):
+    """
+    Yields Geonames locations one at a time, in order of countries -> admin level 1s -> admin
+    level 2s -> cities, without loading all of them into memory. Locations have the format
+    described in data_source.py, except that they have no estimated importance. Only locations of
+    the given resolution (if any) and with at least min_population population are yielded.
+
+    Only the countries and admins are kept in memory, so that cities can be matched to their
+    admins. Admin populations and the coordinates of countries and admins come from their cities,
+    so unless only cities are needed, the city data is read twice.
+    """
+    stats = defaultdict(int)
+    countries_by_code = _read_country_data(_DATA_FILES['country'], stats)
+    admin1_by_code = OrderedDict(
+        _iter_admin1_data(_DATA_FILES['admin_1'], countries_by_code, stats)
+    )
+    admin2_by_code = OrderedDict(
+        _iter_admin2_data(_DATA_FILES['admin_2'], countries_by_code, admin1_by_code, stats)
+    )
+
+    def iter_cities():
+        return _iter_city_data(
+            _DATA_FILES['city'], countries_by_code, admin1_by_code, admin2_by_code, stats
+        )
+
+    if resolution != ResolutionTypes.CITY:
+        regions_by_id = {
+            region['id']: region for region in chain(
+                countries_by_code.itervalues(), admin1_by_code.itervalues(),
+                admin2_by_code.itervalues(),
+            )
+        }
+        extents = {}
+        for city in iter_cities():
+            _add_city_to_regions(city, regions_by_id, extents)
+        _set_region_extents(regions_by_id.itervalues(), extents)
+
+    locations = chain(
+        countries_by_code.itervalues(), admin1_by_code.itervalues(), admin2_by_code.itervalues()
+    )
+    if resolution in (None, ResolutionTypes.CITY):
+        locations = chain(locations, iter_cities())
+
+    for location in locations:
+        if resolution and location['resolution'] != resolution:
+            continue
+        if location['population'] >= min_population:
+            yield location
+
+def _load_country_data(filepath, stats):
+    countries_by_code = _read_country_data(filepath, stats)
+    for country in countries_by_code.itervalues():
+        _add_location(country, stats)
+
+    return countries_by_code
+
+def _load_admin1_data(filepath, countries_by_code, stats):
+    admin1_by_code = {}
+    for full_admin1_code, admin1 in _iter_admin1_data(filepath, countries_by_code, stats):
+        _add_location(admin1, stats)
+        admin1_by_code[full_admin1_code] = admin1
+
+    return admin1_by_code
+
+def _load_admin2_data(filepath, countries_by_code, admin1_by_code, stats):
+    admin2_by_code = {}
+    for full_admin2_code, admin2 in _iter_admin2_data(
+        filepath, countries_by_code, admin1_by_code, stats
+    ):
+        _add_location(admin2, stats)
+        admin2_by_code[full_admin2_code] = admin2
+
+    return admin2_by_code
+
+def _load_city_data(filepath, countries_by_code, admin1_by_code, admin2_by_code, stats):
+    extents = {}
+    for city in _iter_city_data(
+        filepath, countries_by_code, admin1_by_code, admin2_by_code, stats
+    ):
+        _add_location(city, stats)
+        _add_city_to_regions(city, _LOCATIONS_BY_ID, extents)
+
+    _set_region_extents(chain(
+        countries_by_code.itervalues(), admin1_by_code.itervalues(), admin2_by_code.itervalues()
+    ), extents)
+
+def _add_city_to_regions(city, regions_by_id, extents):
+    """
+    Adds the city's population to its admins, and its coordinates to the extents of its admins
+    and country. An extent is a list of [number of cities, sum of latitudes, sum of the sines of
+    longitudes, sum of the cosines of longitudes, south, north, longitudes].
+    """
+    for admin_id_field in ('admin_level_1_id', 'admin_level_2_id'):
+        if city[admin_id_field] is not None:
+            regions_by_id[city[admin_id_field]]['population'] += city['population']
+
+    latitude = city['latitude']
+    longitude = city['longitude']
+    longitude_sin = math.sin(math.radians(longitude))
+    longitude_cos = math.cos(math.radians(longitude))
+    for region_id_field in ('country_id', 'admin_level_1_id', 'admin_level_2_id'):
+        region_id = city[region_id_field]
+        if region_id is None:
+            continue
+
+        extent = extents.get(region_id)
+        if extent is None:
+            extents[region_id] = [
+                1, latitude, longitude_sin, longitude_cos, latitude, latitude,
+                array('d', [longitude]),
+            ]
+            continue
+
+        extent[0] += 1
+        extent[1] += latitude
+        extent[2] += longitude_sin
+        extent[3] += longitude_cos
+        if latitude < extent[4]:
+            extent[4] = latitude
+        elif latitude > extent[5]:
+            extent[5] = latitude
+        extent[6].append(longitude)
+
+def _set_region_extents(regions, extents):
+    """
+    Sets the latitude and longitude of each region to the centroid of its cities, along with the
+    bounding box of its cities and an estimate of the area of the box in square kilometers, as a
+    rough measure of the region's size. Regions without cities have None for all of them.
+
+    The longitude of the centroid is the circular mean of the cities' longitudes, and the box
+    spans the smallest interval of longitudes around the cities, so both of them are sensible for
+    regions with cities on both sides of the antimeridian. Their boxes have west > east.
+    """
+    for region in regions:
+        extent = extents.get(region['id'])
+        if extent is None:
+            region.update(
+                latitude=None, longitude=None, bounding_box=None, bounding_box_area=None
+            )
+            continue
+
+        n_cities, latitude_sum, longitude_sin_sum, longitude_cos_sum, south, north, longitudes = (
+            extent
+        )
+        west, east = get_longitude_interval(longitudes)
+        if west == east:
+            # The mean would only differ by rounding errors.
+            longitude = west
+        else:
+            longitude = get_mean_longitude(longitude_sin_sum, longitude_cos_sum)
+        region.update(
+            latitude=latitude_sum / n_cities,
+            longitude=longitude,
+            bounding_box=[south, west, north, east],
+            bounding_box_area=get_box_area(south, west, north, east),
+        )
+
+def _read_country_data(filepath, stats):
+    """
+    Returns an ordered dictionary of country codes to countries.
+    """
+    countries_by_code = OrderedDict()
 
     with open(filepath) as country_file:
         reader = csv.reader(country_file, dialect='excel-tab', quoting=csv.QUOTE_NONE)
         for row in reader:
             if row[0].startswith('#'):
                 continue
+            stats['rows_processed'] += 1
 
             (
                 iso, iso3, isonumeric, fips, name, capital, areakm2, population, continent_code,
@@ -70,28 +289,21 @@ def _load_country_data(filepath):
             ) = row
             standard_name = standardize_loc_name(name)
             if not geoname_id or not standard_name:
+                stats['rows_skipped_invalid'] += 1
                 continue
 
-            data = {
-                'id': geoname_id,
+            countries_by_code[iso] = {
+                'id': int(geoname_id),
                 'resolution': ResolutionTypes.COUNTRY,
                 'name': standard_name,
                 'country_code': iso,
                 'country': standard_name,
-                'country_id': geoname_id,
+                'country_id': int(geoname_id),
                 'population': int(population),
                 'neighbor_country_codes': neighbors.split(','),
             }
 
-            _LOCATIONS_BY_NAME[standard_name][geoname_id] = data
-            for alt_name in set(get_alt_punc_names(standard_name)):
-                _LOCATIONS_BY_NAME[alt_name][geoname_id] = data
-
-            assert geoname_id not in _LOCATIONS_BY_ID
-            _LOCATIONS_BY_ID[geoname_id] = data
-            countries_by_code[iso] = data
-
-    for country in _LOCATIONS_BY_ID.itervalues():
+    for country in countries_by_code.itervalues():
         country['neighbor_country_ids'] = [
             countries_by_code[code]['country_id'] for code in country['neighbor_country_codes']
             if code in countries_by_code
@@ -100,56 +312,52 @@ def _load_country_data(filepath):
 
     return countries_by_code
 
-def _load_admin1_data(filepath, countries_by_code):
-    admin1_by_code = {}
-
+def _iter_admin1_data(filepath, countries_by_code, stats):
+    """
+    Yields (full admin 1 code, admin 1) pairs.
+    """
     with open(filepath) as admin1_file:
         reader = csv.reader(admin1_file, dialect='excel-tab', quoting=csv.QUOTE_NONE)
         for (full_admin1_code, name, ascii_name, geoname_id) in reader:
+            stats['rows_processed'] += 1
             standard_name = standardize_loc_name(name)
             if not geoname_id or not standard_name:
+                stats['rows_skipped_invalid'] += 1
                 continue
 
             country_code, admin1_code = full_admin1_code.split('.')
             country = countries_by_code[country_code]
-            data = {
-                'id': geoname_id,
+            yield full_admin1_code, {
+                'id': int(geoname_id),
                 'resolution': ResolutionTypes.ADMIN_1,
                 'name': standard_name,
-                'country_code': country_code,
+                'country_code': country['country_code'],
                 'country': country['name'],
                 'country_id': country['id'],
                 'population': 0,
             }
 
-            _LOCATIONS_BY_NAME[standard_name][geoname_id] = data
-            for alt_name in set(get_alt_punc_names(standard_name)):
-                _LOCATIONS_BY_NAME[alt_name][geoname_id] = data
-
-            assert geoname_id not in _LOCATIONS_BY_ID
-            _LOCATIONS_BY_ID[geoname_id] = data
-            admin1_by_code[full_admin1_code] = data
-
-    return admin1_by_code
-
-def _load_admin2_data(filepath, countries_by_code, admin1_by_code):
-    admin2_by_code = {}
-
+def _iter_admin2_data(filepath, countries_by_code, admin1_by_code, stats):
+    """
+    Yields (full admin 2 code, admin 2) pairs.
+    """
     with open(filepath) as admin2_file:
         reader = csv.reader(admin2_file, dialect='excel-tab', quoting=csv.QUOTE_NONE)
         for (full_admin2_code, name, ascii_name, geoname_id) in reader:
+            stats['rows_processed'] += 1
             standard_name = standardize_loc_name(name)
             if not geoname_id or not standard_name:
+                stats['rows_skipped_invalid'] += 1
                 continue
 
             country_code, admin1_code, admin2_code = full_admin2_code.split('.')
             admin1 = admin1_by_code.get('%s.%s' % (country_code, admin1_code))
             country = countries_by_code[country_code]
-            data = {
-                'id': geoname_id,
+            yield full_admin2_code, {
+                'id': int(geoname_id),
                 'resolution': ResolutionTypes.ADMIN_2,
                 'name': standard_name,
-                'country_code': country_code,
+                'country_code': country['country_code'],
                 'country': country['name'],
                 'country_id': country['id'],
                 'admin_level_1': admin1['name'] if admin1 else None,
@@ -157,17 +365,7 @@ def _load_admin2_data(filepath, countries_by_code, admin1_by_code):
                 'population': 0,
             }
 
-            _LOCATIONS_BY_NAME[standard_name][geoname_id] = data
-            for alt_name in set(get_alt_punc_names(standard_name)):
-                _LOCATIONS_BY_NAME[alt_name][geoname_id] = data
-
-            assert geoname_id not in _LOCATIONS_BY_ID
-            _LOCATIONS_BY_ID[geoname_id] = data
-            admin2_by_code[full_admin2_code] = data
-
-    return admin2_by_code
-
-def _load_city_data(filepath, countries_by_code, admin1_by_code, admin2_by_code):
+def _iter_city_data(filepath, countries_by_code, admin1_by_code, admin2_by_code, stats):
     with open(filepath) as city_file:
         reader = csv.reader(city_file, dialect='excel-tab', quoting=csv.QUOTE_NONE)
         for (
@@ -175,21 +373,24 @@ def _load_city_data(filepath, countries_by_code, admin1_by_code, admin2_by_code)
             feature_code, country_code, cc2, admin1_code, admin2_code, admin3_code, admin4_code,
             population, elevation, dem, timezone, modification_date
         ) in reader:
+            stats['rows_processed'] += 1
             if feature_code.upper() not in _KEEP_FEATURE_CODES:
+                stats['rows_skipped_feature_code'] += 1
                 continue
 
             standard_name = standardize_loc_name(name)
             if not geoname_id or not standard_name:
+                stats['rows_skipped_invalid'] += 1
                 continue
 
             admin1 = admin1_by_code.get('%s.%s' % (country_code, admin1_code))
             admin2 = admin2_by_code.get('%s.%s.%s' % (country_code, admin1_code, admin2_code))
             country = countries_by_code[country_code]
-            data = {
-                'id': geoname_id,
+            yield {
+                'id': int(geoname_id),
                 'resolution': ResolutionTypes.CITY,
                 'name': standard_name,
-                'country_code': country_code,
+                'country_code': country['country_code'],
                 'country': country['name'],
                 'country_id': country['id'],
                 'admin_level_1': admin1['name'] if admin1 else None,
@@ -201,20 +402,8 @@ def _load_city_data(filepath, countries_by_code, admin1_by_code, admin2_by_code)
                 'longitude': float(longitude),
             }
 
-            _LOCATIONS_BY_NAME[standard_name][geoname_id] = data
-            for alt_name in set(get_alt_punc_names(standard_name)):
-                _LOCATIONS_BY_NAME[alt_name][geoname_id] = data
-
-            assert geoname_id not in _LOCATIONS_BY_ID
-            _LOCATIONS_BY_ID[geoname_id] = data
-
-            if admin1:
-                admin1['population'] += int(population)
-            if admin2:
-                admin2['population'] += int(population)
-
-def _add_alternate_names(filepath):
-    _add_fixed_alt_names()
+def _add_alternate_names(filepath, stats):
+    _add_fixed_alt_names(stats)
 
     if not os.path.isfile(filepath):
         return
@@ -223,15 +412,16 @@ def _add_alternate_names(filepath):
         alt_names_by_id = json.load(alt_names_file)
 
     for id_, alt_names in alt_names_by_id.iteritems():
-        location = _LOCATIONS_BY_ID[id_]
+        stats['rows_processed'] += 1
+        location = _LOCATIONS_BY_ID[int(id_)]
         if location['population'] >= _MIN_POPULATION_FOR_ALT_WIKI_NAMES:
             for alt_name in alt_names:
-                _LOCATIONS_BY_NAME[standardize_loc_name(alt_name)][id_] = location
+                _add_name(standardize_loc_name(alt_name), location, stats)
 
 def _find_single_location(name, country, resolution):
     name = standardize_loc_name(name)
     matches = [
-        loc for loc in _LOCATIONS_BY_NAME[name].itervalues()
+        loc for loc in (_LOCATIONS_BY_ID[id_] for id_ in _LOCATIONS_BY_NAME[name])
         if (
             loc['name'] == name and
             loc['country'] == standardize_loc_name(country) and
@@ -241,21 +431,26 @@ def _find_single_location(name, country, resolution):
     assert len(matches) == 1
     return matches[0]
 
-def _add_fixed_alt_names():
+def _add_fixed_alt_names(stats):
     for (real_name, country, resolution), alt_names in FIXED_ALTERNATE_NAMES.iteritems():
         location = _find_single_location(real_name, country, resolution)
         for alt_name in alt_names:
-            _LOCATIONS_BY_NAME[standardize_loc_name(alt_name)][location['id']] = location
+            _add_name(standardize_loc_name(alt_name), location, stats)
 
-def _add_estimated_importances(filepath):
+def _add_estimated_importances(filepath, stats):
     if not os.path.isfile(filepath):
         return
 
     with open(filepath) as importance_file:
-        estimated_importances = json.load(importance_file)
+        # JSON keys are strings, but our ids are integers.
+        estimated_importances = {
+            int(id_): importance
+            for id_, importance in json.load(importance_file).iteritems()
+        }
 
     for id_, location in _LOCATIONS_BY_ID.iteritems():
-        location['estimated_importance'] = estimated_importances[str(id_)]
+        stats['rows_processed'] += 1
+        location['estimated_importance'] = estimated_importances[id_]
 
     washington_dc = _find_single_location(
         'Washington, D.C.', 'United States', ResolutionTypes.CITY
@@ -0,0 +1,138 @@
+import Queue
+import socket
+import threading
+
+from lookup_server import DEFAULT_CODEC, JSON_CODEC, read_message, send_message
+
+
+class LookupServerError(Exception):
+    pass
+
+
+class DataSourceClient(object):
+
+    """
+    Client for a LookupServer with the same lookup methods as DataSource. distance_matrix is only
+    available locally, on a DataSource, since it returns a NumPy array.
+
+    `address` is either a (host, port) pair or the path of a unix socket. Connections are kept
+    open and reused between calls, with at most `max_connections` open at once; when they are all
+    in use, a call waits for one to be released. The client is safe to share between threads.
+    """
+
+    def __init__(self, address, max_connections=8, timeout=10., codec=DEFAULT_CODEC):
+        self._address = address
+        self._timeout = timeout
+        self._codec = codec
+        self._idle_connections = Queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_connections)
+
+    def city_search(self, city_name):
+        return self._search_results(self._call('city_search', city_name))
+
+    def admin_level_1_search(self, admin1_name):
+        return self._search_results(self._call('admin_level_1_search', admin1_name))
+
+    def admin_level_2_search(self, admin2_name):
+        return self._search_results(self._call('admin_level_2_search', admin2_name))
+
+    def country_search(self, country_name):
+        return self._search_results(self._call('country_search', country_name))
+
+    def all_locations_search(self, name):
+        return self._search_results(self._call('all_locations_search', name))
+
+    def bulk_search(self, names, resolution=None):
+        return {
+            name: self._search_results(results)
+            for name, results in self._call('bulk_search', list(names), resolution).iteritems()
+        }
+
+    def get_location_by_id(self, id_):
+        return self._call('get_location_by_id', id_)
+
+    def locations_in_box(self, south, west, north, east, resolution=None):
+        return self._search_results(
+            self._call('locations_in_box', south, west, north, east, resolution)
+        )
+
+    def reverse_geocode(self, latitude, longitude, max_distance_km=50.):
+        return self._call('reverse_geocode', latitude, longitude, max_distance_km)
+
+    def distance(self, id_a, id_b):
+        return self._call('distance', id_a, id_b)
+
+    def close(self):
+        while True:
+            try:
+                sock, in_file = self._idle_connections.get_nowait()
+            except Queue.Empty:
+                return
+            in_file.close()
+            sock.close()
+
+    def _call(self, method_name, *args):
+        with self._slots:
+            try:
+                connection = self._idle_connections.get_nowait()
+                reused = True
+            except Queue.Empty:
+                connection = self._connect()
+                reused = False
+
+            try:
+                response = self._request(connection, method_name, args)
+            except socket.error:
+                self._discard(connection)
+                if not reused:
+                    raise
+                # The server may have closed an idle connection; retry once on a new one.
+                connection = self._connect()
+                try:
+                    response = self._request(connection, method_name, args)
+                except:
+                    self._discard(connection)
+                    raise
+            except:
+                self._discard(connection)
+                raise
+
+            self._idle_connections.put(connection)
+
+        ok, result = response
+        if not ok:
+            raise LookupServerError(result)
+        return result
+
+    def _search_results(self, results):
+        if self._codec == JSON_CODEC:
+            # JSON turns the integer id keys into strings.
+            return {int(id_): location for id_, location in results.iteritems()}
+        return results
+
+    def _request(self, connection, method_name, args):
+        sock, in_file = connection
+        send_message(sock, [method_name, args], self._codec)
+        response, _ = read_message(in_file)
+        if response is None:
+            raise socket.error('Connection closed by the lookup server')
+        return response
+
+    def _connect(self):
+        if isinstance(self._address, basestring):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            # A unix socket with a timeout fails at once with EAGAIN when the server's queue of
+            # connections is full, while a blocking one waits for a place in the queue.
+            sock.connect(self._address)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.settimeout(self._timeout)
+            sock.connect(self._address)
+        sock.settimeout(self._timeout)
+        return sock, sock.makefile('rb')
+
+    def _discard(self, connection):
+        sock, in_file = connection
+        in_file.close()
+        sock.close()
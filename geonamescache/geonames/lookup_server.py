@@ -0,0 +1,152 @@
+import json
+import os
+import SocketServer
+import struct
+from argparse import ArgumentParser
+
+from data_source import DataSource
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+"""
+A small server that hosts a single DataSource, so that many processes on a machine can share one
+copy of the data instead of each loading their own. See lookup_client.py for the client.
+
+Each message is framed as a 4 byte big-endian payload length, a 1 byte codec tag ('m' for msgpack,
+'j' for JSON), and the encoded payload. Requests are [method_name, args] and responses are
+[True, result] or [False, error message]. The server answers in the codec of the request, and
+connections stay open for any number of requests.
+"""
+
+MSGPACK_CODEC = 'm'
+JSON_CODEC = 'j'
+DEFAULT_CODEC = MSGPACK_CODEC if msgpack else JSON_CODEC
+
+LOOKUP_METHODS = (
+    'city_search', 'admin_level_1_search', 'admin_level_2_search', 'country_search',
+    'all_locations_search', 'bulk_search', 'get_location_by_id', 'locations_in_box',
+    'reverse_geocode', 'distance',
+)
+
+# Connections waiting to be accepted. The default of 5 is too few for a burst of new clients; a unix
+# socket refuses connections beyond it instead of waiting.
+REQUEST_QUEUE_SIZE = 128
+
+_HEADER = struct.Struct('>Ic')
+
+
+def _encode(message, codec):
+    if codec == MSGPACK_CODEC:
+        return msgpack.packb(message, use_bin_type=True)
+    return json.dumps(message)
+
+def _decode(payload, codec):
+    if codec == MSGPACK_CODEC:
+        return msgpack.unpackb(payload, raw=False, strict_map_key=False)
+    return json.loads(payload)
+
+def send_message(sock, message, codec=DEFAULT_CODEC):
+    payload = _encode(message, codec)
+    sock.sendall(_HEADER.pack(len(payload), codec) + payload)
+
+def read_message(in_file):
+    """
+    Reads one message from a file-like object. Returns (message, codec), or (None, None) if the
+    connection was closed.
+    """
+    header = in_file.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return None, None
+
+    length, codec = _HEADER.unpack(header)
+    if codec not in (MSGPACK_CODEC, JSON_CODEC) or (codec == MSGPACK_CODEC and not msgpack):
+        raise ValueError('Unsupported codec %r' % codec)
+    payload = in_file.read(length)
+    if len(payload) < length:
+        return None, None
+
+    return _decode(payload, codec), codec
+
+
+class _LookupHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        while True:
+            try:
+                request, codec = read_message(self.rfile)
+            except ValueError:
+                return
+            if request is None:
+                return
+
+            try:
+                method_name, args = request
+                if method_name not in LOOKUP_METHODS:
+                    raise ValueError('Unknown method %r' % method_name)
+                response = [True, getattr(self.server.data_source, method_name)(*args)]
+            except Exception as e:
+                response = [False, '%s: %s' % (type(e).__name__, e)]
+
+            send_message(self.request, response, codec)
+
+
+class LookupServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+
+    """
+    Serves lookups for a DataSource over TCP. The data source is loaded when the server is created.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+    request_queue_size = REQUEST_QUEUE_SIZE
+
+    def __init__(self, address, data_source=None):
+        self.data_source = data_source or DataSource()
+        SocketServer.TCPServer.__init__(self, address, _LookupHandler)
+
+
+class UnixLookupServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+
+    """
+    Serves lookups for a DataSource over a unix domain socket at the given path.
+    """
+
+    daemon_threads = True
+    request_queue_size = REQUEST_QUEUE_SIZE
+
+    def __init__(self, socket_path, data_source=None):
+        self.data_source = data_source or DataSource()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        SocketServer.UnixStreamServer.__init__(self, socket_path, _LookupHandler)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7439)
+    parser.add_argument('--unix-socket', help='serve on this unix socket path instead of TCP')
+    parser.add_argument(
+        '--countries', nargs='+', help='only load the shards of these country codes'
+    )
+    parser.add_argument(
+        '--cache-size', type=int, default=0, help='cache the results of this many searches'
+    )
+    args = parser.parse_args()
+
+    data_source = DataSource(countries=args.countries, cache_size=args.cache_size)
+    if args.unix_socket:
+        server = UnixLookupServer(args.unix_socket, data_source)
+    else:
+        server = LookupServer((args.host, args.port), data_source)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,227 @@
+import os
+import resource
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from timeit import default_timer
+
+
+# Upper bounds (in seconds) of the latency histogram buckets. Lookups take microseconds, while
+# loading the data takes seconds.
+DEFAULT_BUCKETS = (
+    .000005, .00001, .000025, .00005, .0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1,
+    .25, .5, 1., 2.5, 5., 10., 30., 60.,
+)
+
+
+class Metrics(object):
+
+    """
+    Collects counters and latency histograms, which can be exported as a plain dictionary or in
+    the Prometheus text format. Pass an instance to DataSource or geonames.load_data to record
+    their metrics; when no instance is passed, nothing is recorded and nothing is timed.
+
+    Metrics recorded:
+
+        geonames_lookups_total{resolution, result}  Name searches, where result is 'hit' (some
+                                                    location was returned), 'empty' (the name
+                                                    exists, but not for the resolution), or
+                                                    'miss' (unknown name).
+        geonames_search_seconds{resolution}         Latency of name searches.
+        geonames_standardize_seconds                Latency of standardizing the searched names.
+        geonames_load_seconds{source, phase}        Time spent in each phase of loading the data.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self._buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # (name, labels) -> value
+        self._counters = defaultdict(float)
+        # (name, labels) -> [count per bucket (plus one for +Inf), sum, count]
+        self._histograms = {}
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.iteritems())))
+        with self._lock:
+            self._counters[key] += amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.iteritems())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(self._buckets) + 1), 0., 0]
+            histogram[0][bisect_left(self._buckets, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = default_timer()
+        try:
+            yield
+        finally:
+            self.observe(name, default_timer() - start, **labels)
+
+    def to_dict(self):
+        """
+        Returns the metrics in the form
+
+        {
+            'counters': {name: [{'labels': dict, 'value': float}]},
+            'histograms': {name: [{
+                'labels': dict,
+                'buckets': [(upper bound, cumulative count)],   # The last bound is 'inf'
+                'sum': float,
+                'count': int,
+            }]},
+        }
+        """
+        with self._lock:
+            counters = sorted(self._counters.iteritems())
+            histograms = sorted(
+                (key, (list(bucket_counts), sum_, count))
+                for key, (bucket_counts, sum_, count) in self._histograms.iteritems()
+            )
+
+        result = {'counters': defaultdict(list), 'histograms': defaultdict(list)}
+        for (name, labels), value in counters:
+            result['counters'][name].append({'labels': dict(labels), 'value': value})
+        for (name, labels), (bucket_counts, sum_, count) in histograms:
+            cumulative_counts = []
+            total = 0
+            for bucket_count in bucket_counts:
+                total += bucket_count
+                cumulative_counts.append(total)
+            result['histograms'][name].append({
+                'labels': dict(labels),
+                'buckets': zip(self._buckets + (float('inf'),), cumulative_counts),
+                'sum': sum_,
+                'count': count,
+            })
+
+        return {kind: dict(samples) for kind, samples in result.iteritems()}
+
+    def to_prometheus(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        metrics = self.to_dict()
+        lines = []
+
+        for name, samples in sorted(metrics['counters'].iteritems()):
+            lines.append('# TYPE %s counter' % name)
+            for sample in samples:
+                lines.append('%s%s %s' % (
+                    name, _format_labels(sample['labels']), _format_value(sample['value'])
+                ))
+
+        for name, samples in sorted(metrics['histograms'].iteritems()):
+            lines.append('# TYPE %s histogram' % name)
+            for sample in samples:
+                for upper_bound, count in sample['buckets']:
+                    labels = dict(sample['labels'], le=_format_value(upper_bound))
+                    lines.append('%s_bucket%s %d' % (name, _format_labels(labels), count))
+                labels = _format_labels(sample['labels'])
+                lines.append('%s_sum%s %s' % (name, labels, _format_value(sample['sum'])))
+                lines.append('%s_count%s %d' % (name, labels, sample['count']))
+
+        return '\n'.join(lines) + '\n'
+
+
+class LoadProfiler(object):
+
+    """
+    Records a report of each phase of loading data. Pass an instance to geonames.load_data, and
+    call report() after it returns.
+    """
+
+    COUNTS = ('rows_processed', 'rows_skipped_feature_code', 'rows_skipped_invalid', 'aliases')
+
+    def __init__(self):
+        self._phases = []
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Profiles a block of code, yielding a dictionary that the block can add counts to.
+        """
+        stats = defaultdict(int)
+        rss_before = current_rss_bytes()
+        start = default_timer()
+        try:
+            yield stats
+        finally:
+            seconds = default_timer() - start
+            phase = dict((count, 0) for count in LoadProfiler.COUNTS)
+            phase.update(stats)
+            phase.update(
+                phase=name,
+                seconds=seconds,
+                memory_delta_mb=(current_rss_bytes() - rss_before) / 2. ** 20,
+            )
+            self._phases.append(phase)
+
+    def report(self):
+        """
+        Returns a report of the form
+
+        {
+            'phases': [{
+                'phase': str,                       # e.g. 'country', 'admin_1', 'city'
+                'seconds': float,                   # Wall time
+                'memory_delta_mb': float,           # Change in resident memory
+                'rows_processed': int,              # Rows (or entries) read from the data file
+                'rows_skipped_feature_code': int,   # Cities skipped for their feature code
+                'rows_skipped_invalid': int,        # Rows skipped for a missing id or name
+                'aliases': int,                     # Alternate names added for locations
+            }],
+            'seconds': float,
+            'memory_delta_mb': float,
+        }
+        """
+        return {
+            'phases': [dict(phase) for phase in self._phases],
+            'seconds': sum(phase['seconds'] for phase in self._phases),
+            'memory_delta_mb': sum(phase['memory_delta_mb'] for phase in self._phases),
+        }
+
+
+def current_rss_bytes():
+    """
+    Returns the resident memory of the process in bytes, or its peak resident memory where the
+    current one is not available (outside of Linux).
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except IOError:
+        # Not on Linux, so fall back to the peak resident memory.
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak_rss if os.uname()[0] == 'Darwin' else peak_rss * 1024
+
+@contextmanager
+def _no_timer():
+    yield
+
+def timer(metrics, name, **labels):
+    """
+    Returns a context manager timing its block into `metrics`, or doing nothing if metrics is None.
+    """
+    if metrics is None:
+        return _no_timer()
+    return metrics.timer(name, **labels)
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, str(value).replace('\\', r'\\').replace('"', r'\"'))
+        for key, value in sorted(labels.iteritems())
+    )
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
@@ -0,0 +1,169 @@
+import heapq
+import json
+import os
+import re
+from collections import defaultdict
+
+from utils import ResolutionTypes
+
+
+"""
+Writes the processed data (as returned by geonames.load_data) into the files that DataSource
+loads: a single snapshot of all the locations, and per-country shards. Smaller data sets can be
+built by first selecting a subset of the locations with select_locations.
+"""
+
+# Named build profiles, as keyword arguments of select_locations.
+PROFILES = {
+    'population_50k': {'min_population': 50000},
+    'top_10k': {'top_n_by_importance': 10000},
+}
+
+
+def write_snapshot(filepath, locations_by_name, locations_by_id):
+    """
+    Writes a snapshot of the form {'locations': [location], 'names': {name: [id]}}, so that each
+    location is stored once no matter how many names it has.
+
+    Snapshots are canonical: the same data always gives the same file. Locations are sorted by id
+    and names by name, with the ids of each name sorted, and each location and each name is on a
+    line of its own, so that snapshots can be compared line by line (see iter_snapshot).
+    """
+    with open(filepath, 'w') as output:
+        _write_canonical(output, {
+            'locations': locations_by_id.values(),
+            'names': locations_by_name,
+        })
+
+def write_shards(directory, locations_by_name, locations_by_id):
+    """
+    Writes one shard per country to <directory>/<country code>.json. A shard is a snapshot of the
+    locations in the country and their names, plus a 'neighbors' list of the records of the
+    neighboring countries, so that the ids in the country's neighbor_country_ids can be looked up
+    even when the neighbors' shards are not loaded. Neighbors are not searchable by name.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    locations_by_country_code = defaultdict(list)
+    for location in locations_by_id.itervalues():
+        locations_by_country_code[location['country_code']].append(location)
+
+    names_by_country_code = defaultdict(lambda: defaultdict(list))
+    for name, ids in locations_by_name.iteritems():
+        for id_ in ids:
+            names_by_country_code[locations_by_id[id_]['country_code']][name].append(id_)
+
+    for country_code, locations in locations_by_country_code.iteritems():
+        shard = {
+            'locations': locations,
+            'names': names_by_country_code[country_code],
+            'neighbors': [
+                locations_by_id[neighbor_id]
+                for location in locations if location['resolution'] == ResolutionTypes.COUNTRY
+                for neighbor_id in location['neighbor_country_ids']
+            ],
+        }
+        with open(os.path.join(directory, '%s.json' % country_code), 'w') as output:
+            _write_canonical(output, shard)
+
+def iter_snapshot(snapshot_file):
+    """
+    Yields the records of a snapshot (or shard) written by write_snapshot, one line at a time, in
+    the order of the file: (section, location) pairs for the 'locations' (and 'neighbors')
+    sections, and ('names', (name, ids)) pairs for the 'names' section. Raises ValueError if the
+    file is not a canonical snapshot.
+    """
+    section = None
+    for line_number, line in enumerate(snapshot_file, 1):
+        line = line.rstrip('\n')
+        if section is None:
+            if line in ('{', '}'):
+                continue
+            match = _SECTION_START_RE.match(line)
+            if not match:
+                raise ValueError('Line %d is not part of a canonical snapshot' % line_number)
+            section = match.group(1)
+            is_list_section = match.group(2) == '['
+        elif line in (']', '],', '}', '},'):
+            section = None
+        else:
+            if line.endswith(','):
+                line = line[:-1]
+            if is_list_section:
+                yield section, json.loads(line)
+            else:
+                yield section, json.loads('{%s}' % line).items()[0]
+
+_SECTION_START_RE = re.compile(r'^"(\w+)": ([\[{])$')
+
+def _write_canonical(output, snapshot):
+    """
+    Writes the snapshot as JSON with a line per location or name, in a canonical order.
+    """
+    output.write('{\n')
+    sections = sorted(snapshot)
+    for i, section in enumerate(sections):
+        values = snapshot[section]
+        if isinstance(values, dict):
+            output.write('"%s": {\n' % section)
+            lines = (
+                '%s: %s' % (json.dumps(name), json.dumps(sorted(values[name])))
+                for name in sorted(values)
+            )
+            closing = '}'
+        else:
+            output.write('"%s": [\n' % section)
+            lines = (
+                json.dumps(location, sort_keys=True)
+                for location in sorted(values, key=lambda location: location['id'])
+            )
+            closing = ']'
+
+        separator = ''
+        for line in lines:
+            output.write(separator + line)
+            separator = ',\n'
+        if separator:
+            output.write('\n')
+        output.write('%s%s\n' % (closing, ',' if i < len(sections) - 1 else ''))
+    output.write('}\n')
+
+def select_locations(
+    locations_by_name, locations_by_id, min_population=0, top_n_by_importance=None
+):
+    """
+    Returns the locations by name and by id of a smaller data set. It has the locations with at
+    least min_population population that are also among the top_n_by_importance most important
+    locations (if given), along with all countries and the admins of the kept locations, so that
+    every id in the data resolves.
+
+    Kept locations are unchanged, so admin populations are still the sums of the populations of
+    all of their cities, as in the full data set. Only names of kept locations are kept.
+    """
+    candidates = [
+        location for location in locations_by_id.itervalues()
+        if location['population'] >= min_population
+    ]
+    if top_n_by_importance is not None:
+        candidates = heapq.nlargest(top_n_by_importance, candidates, key=lambda location: (
+            location.get('estimated_importance', 0.), location['population'], -location['id']
+        ))
+
+    kept_ids = set(
+        location['id'] for location in locations_by_id.itervalues()
+        if location['resolution'] == ResolutionTypes.COUNTRY
+    )
+    for location in candidates:
+        kept_ids.add(location['id'])
+        for admin_id_field in ('admin_level_1_id', 'admin_level_2_id'):
+            if location.get(admin_id_field):
+                kept_ids.add(location[admin_id_field])
+
+    selected_locations_by_name = {}
+    for name, ids in locations_by_name.iteritems():
+        kept_name_ids = [id_ for id_ in ids if id_ in kept_ids]
+        if kept_name_ids:
+            selected_locations_by_name[name] = kept_name_ids
+
+    return selected_locations_by_name, {id_: locations_by_id[id_] for id_ in kept_ids}
@@ -0,0 +1,271 @@
+import math
+from collections import defaultdict
+from itertools import chain
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from utils import ResolutionTypes
+
+"""
+Geometry of locations, and a grid index to find the locations in an area quickly. Cities are
+points, and countries and admins are the bounding boxes of their cities (see
+geonames._set_region_extents). Boxes are [south, west, north, east] lists of degrees.
+
+A box with west > east wraps around the antimeridian: it spans the longitudes from west to 180 and
+from -180 to east.
+"""
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Kilometers per degree of latitude (and of longitude at the equator).
+_KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# Boxes covering more cells than this (like the boxes of countries spanning continents) are kept in
+# a list that every box query checks, instead of in all of their cells.
+_MAX_BOX_CELLS = 256
+
+
+def haversine_km(latitude_1, longitude_1, latitude_2, longitude_2):
+    """
+    Returns the great-circle distance in kilometers between two points, given in degrees.
+    """
+    latitude_1 = math.radians(latitude_1)
+    latitude_2 = math.radians(latitude_2)
+    sin_half_latitude = math.sin((latitude_2 - latitude_1) / 2)
+    sin_half_longitude = math.sin(math.radians(longitude_2 - longitude_1) / 2)
+    a = (
+        sin_half_latitude * sin_half_latitude +
+        math.cos(latitude_1) * math.cos(latitude_2) * sin_half_longitude * sin_half_longitude
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1., math.sqrt(a)))
+
+def haversine_km_matrix(latitudes_1, longitudes_1, latitudes_2, longitudes_2):
+    """
+    Returns the matrix of great-circle distances in kilometers between each of the first points
+    and each of the second points, given as numpy arrays of degrees. Distances to NaN coordinates
+    are NaN.
+    """
+    latitudes_1 = np.radians(latitudes_1)[:, np.newaxis]
+    latitudes_2 = np.radians(latitudes_2)[np.newaxis, :]
+    sin_half_latitude = np.sin((latitudes_2 - latitudes_1) / 2)
+    sin_half_longitude = np.sin(
+        np.radians(longitudes_2[np.newaxis, :] - longitudes_1[:, np.newaxis]) / 2
+    )
+    a = (
+        sin_half_latitude * sin_half_latitude +
+        np.cos(latitudes_1) * np.cos(latitudes_2) * sin_half_longitude * sin_half_longitude
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.)))
+
+def get_box_area(south, west, north, east):
+    """
+    Returns the area of the box in square kilometers, treating it as flat at its middle latitude.
+    """
+    middle_latitude = math.radians((south + north) / 2.)
+    return (
+        (north - south) * _KM_PER_DEGREE *
+        _get_box_width(west, east) * _KM_PER_DEGREE * math.cos(middle_latitude)
+    )
+
+def get_longitude_interval(longitudes):
+    """
+    Returns the (west, east) of the smallest interval of longitudes that contains all of the
+    longitudes, with west > east if it crosses the antimeridian. That is the complement of the
+    largest gap between consecutive longitudes around the circle.
+    """
+    longitudes = sorted(longitudes)
+    # The gap from the easternmost longitude around to the westernmost one.
+    largest_gap = longitudes[0] + 360 - longitudes[-1]
+    west, east = longitudes[0], longitudes[-1]
+    for i in xrange(1, len(longitudes)):
+        gap = longitudes[i] - longitudes[i - 1]
+        if gap > largest_gap:
+            largest_gap = gap
+            west, east = longitudes[i], longitudes[i - 1]
+    return west, east
+
+def get_mean_longitude(longitude_sin_sum, longitude_cos_sum):
+    """
+    Returns the circular mean of longitudes, given the sums of their sines and cosines, so that
+    the mean of longitudes on both sides of the antimeridian is near it rather than near 0.
+    """
+    return math.degrees(math.atan2(longitude_sin_sum, longitude_cos_sum))
+
+def longitude_in_box(longitude, west, east):
+    """
+    Returns whether the longitude is between the west and east of a box, which may wrap around the
+    antimeridian.
+    """
+    if west <= east:
+        return west <= longitude <= east
+    return longitude >= west or longitude <= east
+
+def _get_box_width(west, east):
+    # In degrees of longitude
+    if west <= east:
+        return east - west
+    return east - west + 360
+
+def _longitude_spans(west, east):
+    # Splits longitudes that wrap around the antimeridian into two intervals that do not.
+    if west <= east:
+        return ((west, east),)
+    return ((west, 180.), (-180., east))
+
+def _longitudes_intersect(west_1, east_1, west_2, east_2):
+    return any(
+        span_west_1 <= span_east_2 and span_west_2 <= span_east_1
+        for span_west_1, span_east_1 in _longitude_spans(west_1, east_1)
+        for span_west_2, span_east_2 in _longitude_spans(west_2, east_2)
+    )
+
+
+class GridIndex(object):
+
+    """
+    Indexes points and boxes by the cells of a grid of cell_size by cell_size degrees that they
+    touch, so that queries only look at the items in the cells that the query touches.
+    """
+
+    def __init__(self, cell_size=1.):
+        self._cell_size = float(cell_size)
+        self._n_rows = int(math.ceil(180 / self._cell_size))
+        self._n_columns = int(math.ceil(360 / self._cell_size))
+        # cell -> [(id, latitude, longitude)]
+        self._points = defaultdict(list)
+        # cell -> [(id, box)]
+        self._boxes = defaultdict(list)
+        self._large_boxes = []
+
+    def add_point(self, id_, latitude, longitude):
+        self._points[self._cell(latitude, longitude)].append((id_, latitude, longitude))
+
+    def add_box(self, id_, box):
+        cells = self._cells(box)
+        if len(cells) > _MAX_BOX_CELLS:
+            self._large_boxes.append((id_, box))
+            return
+        for cell in cells:
+            self._boxes[cell].append((id_, box))
+
+    def points_in_box(self, box):
+        """
+        Returns the ids of the points in the box.
+        """
+        south, west, north, east = box
+        return set(
+            id_ for cell in self._cells(box)
+            for id_, latitude, longitude in self._points.get(cell, ())
+            if south <= latitude <= north and longitude_in_box(longitude, west, east)
+        )
+
+    def boxes_intersecting(self, box):
+        """
+        Returns the ids of the boxes that intersect the box.
+        """
+        south, west, north, east = box
+        boxes = chain(
+            (item for cell in self._cells(box) for item in self._boxes.get(cell, ())),
+            self._large_boxes,
+        )
+        return set(
+            id_ for id_, other in boxes
+            if other[0] <= north and south <= other[2]
+            and _longitudes_intersect(other[1], other[3], west, east)
+        )
+
+    def nearest_point(self, latitude, longitude, max_distance_km=None):
+        """
+        Returns the (distance in kilometers, id) of the nearest point, or None if there are no
+        points (within max_distance_km).
+        """
+        row, column = self._cell(latitude, longitude)
+        nearest = None
+        for ring in xrange(max(self._n_rows, self._n_columns)):
+            min_distance = self._min_distance_outside(latitude, row, column, ring)
+            if min_distance is None:
+                break
+            if nearest is not None and nearest[0] <= min_distance:
+                break
+            if max_distance_km is not None and min_distance > max_distance_km:
+                break
+
+            for cell in self._ring(row, column, ring):
+                for id_, point_latitude, point_longitude in self._points.get(cell, ()):
+                    distance = haversine_km(latitude, longitude, point_latitude, point_longitude)
+                    if nearest is None or (distance, id_) < nearest:
+                        nearest = (distance, id_)
+
+        if nearest is not None and (max_distance_km is None or nearest[0] <= max_distance_km):
+            return nearest
+
+    def _min_distance_outside(self, latitude, row, column, ring):
+        # Returns a lower bound of the distance in kilometers from the point to the points outside
+        # the first ring rings around its cell, or None if there are no cells outside them. Those
+        # points are at least ring - 1 cells away in latitude or in longitude.
+        degrees = max(ring - 1, 0) * self._cell_size
+        distances = []
+        if row - ring >= 0 or row + ring < self._n_rows:
+            distances.append(degrees * _KM_PER_DEGREE)
+        if 2 * ring - 1 < self._n_columns:
+            # The distance to the nearest meridian that far in longitude.
+            distances.append(EARTH_RADIUS_KM * math.asin(
+                math.cos(math.radians(latitude)) * math.sin(math.radians(min(degrees, 90.)))
+            ))
+        if distances:
+            return min(distances)
+
+    def _cell(self, latitude, longitude):
+        return (
+            min(int((latitude + 90) // self._cell_size), self._n_rows - 1),
+            int((longitude + 180) // self._cell_size) % self._n_columns,
+        )
+
+    def _cells(self, box):
+        south, west, north, east = box
+        first_row, first_column = self._cell(south, west)
+        last_row, last_column = self._cell(north, east)
+        if east - west >= 360:
+            first_column, last_column = 0, self._n_columns - 1
+        columns = range(first_column, last_column + 1)
+        if west > east or last_column < first_column:
+            # The box wraps around the antimeridian (or ends at 180 degrees of longitude, in the
+            # cell of -180). Its columns only overlap if it wraps around the whole grid row.
+            columns = range(first_column, self._n_columns) + range(
+                min(last_column, first_column - 1) + 1
+            )
+        return [(row, column) for row in xrange(first_row, last_row + 1) for column in columns]
+
+    def _ring(self, row, column, ring):
+        # The cells at a distance of exactly ring cells (in rows or columns), wrapping around in
+        # longitude.
+        columns = set(
+            (column + offset) % self._n_columns for offset in xrange(-ring, ring + 1)
+        )
+        for ring_row in xrange(max(row - ring, 0), min(row + ring, self._n_rows - 1) + 1):
+            if abs(ring_row - row) == ring:
+                ring_columns = columns
+            else:
+                ring_columns = set(
+                    (column + offset) % self._n_columns for offset in (-ring, ring)
+                )
+            for ring_column in ring_columns:
+                yield ring_row, ring_column
+
+
+def build_index(locations_by_id, cell_size=1.):
+    """
+    Returns a GridIndex of the cities (as points) and of the countries and admins with bounding
+    boxes.
+    """
+    index = GridIndex(cell_size)
+    for location in locations_by_id.itervalues():
+        if location['resolution'] == ResolutionTypes.CITY:
+            if location.get('latitude') is not None:
+                index.add_point(location['id'], location['latitude'], location['longitude'])
+        elif location.get('bounding_box'):
+            index.add_box(location['id'], location['bounding_box'])
+    return index
@@ -1,5 +1,7 @@
+import math
 import re
 import string
+import threading
 from unidecode import unidecode
 
 
@@ -32,18 +34,212 @@ def standardize_loc_name(name):
         name = name.title()
     return name
 
+
+class AliasRules(object):
+
+    """
+    Generates the alternate forms a location name could take on, e.g. "St. Louis" for
+    "Saint Louis". There are four kinds of rules, applied to the original name in this order:
+
+        character rules     Replace every occurrence of a character, e.g. "-" -> " ".
+        prefix rules        Replace a case-insensitive prefix, e.g. "Saint " -> "St. ".
+        word rules          Replace a case-insensitive whole word anywhere in the name, e.g.
+                            "Mount" -> "Mt.".
+        truncations         Drop everything from a character on, e.g. "(" for "Hey (there)".
+    """
+
+    def __init__(self):
+        self._character_rules = []
+        # (lowercase prefix, replacement)
+        self._prefix_rules = []
+        self._max_prefix_length = 0
+        # (lowercase word, compiled pattern, replacement)
+        self._word_rules = []
+        self._truncation_chars = []
+
+    def add_character_rule(self, char, replacement):
+        self._character_rules.append((char, replacement))
+
+    def add_prefix_rule(self, prefix, replacement):
+        self._prefix_rules.append((prefix.lower(), replacement))
+        self._max_prefix_length = max(self._max_prefix_length, len(prefix))
+
+    def add_word_rule(self, word, replacement):
+        pattern = re.compile(r'\b%s\b' % re.escape(word), flags=re.IGNORECASE)
+        self._word_rules.append((word.lower(), pattern, replacement))
+
+    def add_truncation(self, char):
+        self._truncation_chars.append(char)
+
+    def alt_names(self, name):
+        """
+        Returns a list of the distinct non-empty alternate forms of a name, other than the name
+        itself.
+        """
+        variants = []
+        seen = {name}
+
+        def add(variant):
+            if variant and variant not in seen:
+                seen.add(variant)
+                variants.append(variant)
+
+        for char, replacement in self._character_rules:
+            if char in name:
+                add(name.replace(char, replacement))
+
+        if self._prefix_rules:
+            lowercase_start = name[:self._max_prefix_length].lower()
+            for prefix, replacement in self._prefix_rules:
+                if lowercase_start.startswith(prefix):
+                    add(replacement + name[len(prefix):])
+
+        if self._word_rules:
+            lowercase_name = name.lower()
+            for word, pattern, replacement in self._word_rules:
+                # The substring check is much faster than the regular expression, and usually
+                # fails.
+                if word in lowercase_name:
+                    add(pattern.sub(lambda match: replacement, name))
+
+        for char in self._truncation_chars:
+            add(name.split(char, 1)[0].strip())
+
+        return variants
+
+
+ALIAS_RULES = AliasRules()
+ALIAS_RULES.add_character_rule("'", "")
+ALIAS_RULES.add_character_rule("-", " ")
+ALIAS_RULES.add_prefix_rule('St ', 'St. ')
+ALIAS_RULES.add_prefix_rule('Saint ', 'St. ')
+ALIAS_RULES.add_prefix_rule('The ', '')
+ALIAS_RULES.add_prefix_rule('City of ', '')
+ALIAS_RULES.add_truncation('(')
+ALIAS_RULES.add_truncation(',')
+
 def get_alt_punc_names(name):
     """
-    Returns a list of names (possibly repeated) of the various forms an input name could
-    take on.
-    """
-    return [
-        name.replace("'", ""),
-        name.replace("-", " "),
-        re.sub(r'^St ', 'St. ', name, flags=re.IGNORECASE),
-        re.sub(r'^Saint ', 'St. ', name, flags=re.IGNORECASE),
-        re.sub(r'^The ', '', name, flags=re.IGNORECASE),
-        re.sub(r'^City of ', '', name, flags=re.IGNORECASE),
-        name.split('(')[0].strip(),
-        name.split(',')[0].strip(),
-    ]
+    Returns a list of the distinct alternate forms an input name could take on, according to
+    ALIAS_RULES. Custom rules can be added there before loading the data, e.g.
+
+        ALIAS_RULES.add_word_rule('Mount', 'Mt.')
+    """
+    return ALIAS_RULES.alt_names(name)
+
+
+class LRUCache(object):
+
+    """
+    A thread-safe dictionary of at most max_size items, which evicts the least recently used item
+    when it is full.
+    """
+
+    # Items are kept in a circular doubly linked list of [previous, next, key, value] links, from
+    # the least to the most recently used, so that an item is moved to the end in constant time.
+    _PREVIOUS, _NEXT, _KEY, _VALUE = 0, 1, 2, 3
+
+    def __init__(self, max_size):
+        assert max_size > 0
+        self._max_size = max_size
+        self._links_by_key = {}
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            link = self._links_by_key.get(key)
+            if link is None:
+                self._misses += 1
+                return default
+            self._unlink(link)
+            self._append(link)
+            self._hits += 1
+            return link[LRUCache._VALUE]
+
+    def put(self, key, value):
+        with self._lock:
+            link = self._links_by_key.get(key)
+            if link is not None:
+                self._unlink(link)
+            elif len(self._links_by_key) >= self._max_size:
+                oldest = self._root[LRUCache._NEXT]
+                self._unlink(oldest)
+                del self._links_by_key[oldest[LRUCache._KEY]]
+                self._evictions += 1
+            link = self._links_by_key[key] = [None, None, key, value]
+            self._append(link)
+
+    def clear(self):
+        with self._lock:
+            self._links_by_key.clear()
+            self._root[:] = [self._root, self._root, None, None]
+
+    def info(self):
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'size': len(self._links_by_key),
+                'max_size': self._max_size,
+            }
+
+    def _unlink(self, link):
+        previous_link, next_link = link[LRUCache._PREVIOUS], link[LRUCache._NEXT]
+        previous_link[LRUCache._NEXT] = next_link
+        next_link[LRUCache._PREVIOUS] = previous_link
+
+    def _append(self, link):
+        last = self._root[LRUCache._PREVIOUS]
+        link[LRUCache._PREVIOUS] = last
+        link[LRUCache._NEXT] = self._root
+        last[LRUCache._NEXT] = self._root[LRUCache._PREVIOUS] = link
+
+
+class BloomFilter(object):
+
+    """
+    A set of strings that may have false positives (at about the given error rate once it has
+    n_items items), but no false negatives. Strings are hashed with the builtin hash, so a filter
+    is only valid in the process that built it.
+
+    Checks take one bit lookup per hash (or fewer, for strings not in the set). The fewest bits
+    per item for an error rate would take about log2(1 / error_rate) hashes, e.g. 7 for 1%, but
+    each one is slow in Python, so by default this uses 2 hashes and about 2.4 bytes per item for
+    a 1% error rate instead of 1.2.
+    """
+
+    def __init__(self, n_items, error_rate=.01, n_hashes=2):
+        assert 0 < error_rate < 1
+        assert n_hashes >= 1
+        # The error rate is (1 - e^(-n_hashes * n_items / n_bits)) ^ n_hashes.
+        self._n_bits = int(math.ceil(
+            -n_hashes * max(n_items, 1) / math.log(1 - error_rate ** (1. / n_hashes))
+        ))
+        self._n_hashes = n_hashes
+        self._bits = bytearray((self._n_bits + 7) // 8)
+
+    def add(self, key):
+        index, step = self._index_and_step(key)
+        for _ in xrange(self._n_hashes):
+            self._bits[index >> 3] |= 1 << (index & 7)
+            index = (index + step) % self._n_bits
+
+    def __contains__(self, key):
+        index, step = self._index_and_step(key)
+        bits = self._bits
+        for _ in xrange(self._n_hashes):
+            if not bits[index >> 3] & (1 << (index & 7)):
+                return False
+            index = (index + step) % self._n_bits
+        return True
+
+    def _index_and_step(self, key):
+        # Double hashing: the i-th hash is index + i * step, from the two halves of one hash.
+        hash_ = hash(key)
+        return (hash_ & 0xffffffff) % self._n_bits, (hash_ >> 32 | 1) % self._n_bits
@@ -2,6 +2,7 @@ import csv
 import json
 import os
 from collections import defaultdict
+from itertools import chain
 
 from utils import (
     get_alt_punc_names,
@@ -9,17 +10,17 @@ from utils import (
     standardize_loc_name,
 )
 
+_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
 
-def load_data():
-    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
 
-    alt_names_by_id = _load_alt_names_if_possible(os.path.join(data_dir, 'alt_wiki_names.json'))
+def load_data():
+    alt_names_by_id = _load_alt_names_if_possible(os.path.join(_DATA_DIR, 'alt_wiki_names.json'))
     locations_by_name, locations_by_id = _load_main_data(
-        os.path.join(data_dir, 'osm_data.tsv'), alt_names_by_id
+        os.path.join(_DATA_DIR, 'osm_data.tsv'), alt_names_by_id
     )
-    _add_state_abbreviations(os.path.join(data_dir, 'us_states.tsv'), locations_by_name)
+    _add_state_abbreviations(os.path.join(_DATA_DIR, 'us_states.tsv'), locations_by_name)
     _add_missing_countries(
-        os.path.join(data_dir, 'countries.json'), locations_by_name, locations_by_id
+        os.path.join(_DATA_DIR, 'countries.json'), locations_by_name, locations_by_id
     )
     _assign_parent_loc_ids(locations_by_name, locations_by_id)
     _add_fixed_alt_names(locations_by_name)
@@ -41,10 +42,110 @@ def _load_alt_names_if_possible(filepath):
 
     return alt_names_by_id
 
+def iter_locations(resolution=None, min_importance=0.):
+    """
+    Yields OSM locations one at a time, in order of countries -> admin level 1s -> admin level 2s
+    -> cities, without loading all of them into memory. Locations have the same format as in
+    load_data. Only locations of the given resolution (if any) are yielded. OSM has no
+    populations, so locations are filtered by a minimum importance instead. Countries and admins
+    below it are not yielded, but are still the countries and admins of the locations that are.
+
+    The data file is read once per resolution, up to the given resolution. Only the identifying
+    names and ids of the locations already read are kept in memory, to skip duplicates and to
+    match locations with their countries and admins.
+    """
+    country_code_to_id = {}
+    admin_ids = {ResolutionTypes.ADMIN_1: {}, ResolutionTypes.ADMIN_2: {}}
+
+    for pass_resolution in (
+        ResolutionTypes.COUNTRY, ResolutionTypes.ADMIN_1, ResolutionTypes.ADMIN_2,
+        ResolutionTypes.CITY,
+    ):
+        yield_pass = not resolution or resolution == pass_resolution
+        # Countries and admins below min_importance are read for their ids unless no later pass
+        # needs them.
+        last_pass = pass_resolution == (resolution or ResolutionTypes.CITY)
+        seen_by_name = defaultdict(list)
+        locations = (
+            data for _, data in _iter_main_data(os.path.join(_DATA_DIR, 'osm_data.tsv'))
+            if data['resolution'] == pass_resolution
+        )
+        if pass_resolution == ResolutionTypes.COUNTRY:
+            locations = chain(locations, _read_missing_countries(
+                os.path.join(_DATA_DIR, 'countries.json')
+            ))
+
+        for data in locations:
+            skip = yield_pass and data['importance'] < min_importance
+            # The missing countries are not sorted by importance.
+            if skip and last_pass and pass_resolution != ResolutionTypes.COUNTRY:
+                break
+
+            # The missing countries are not deduplicated, as in load_data.
+            if 'city' in data:
+                identifiers = tuple(data[field] for field in _IDENTIFIER_FIELDS)
+                if _should_skip_identifiers(
+                    identifiers, pass_resolution, seen_by_name[data['name']]
+                ):
+                    continue
+                seen_by_name[data['name']].append(identifiers)
+
+            if pass_resolution == ResolutionTypes.COUNTRY:
+                country_code_to_id.setdefault(data['country_code'], data['id'])
+            data['country_id'] = country_code_to_id.get(data['country_code'])
+            if pass_resolution != ResolutionTypes.COUNTRY:
+                if pass_resolution in admin_ids and data['name']:
+                    admin_key = (data['name'], data['admin_level_1'], data['country_code'])
+                    by_key = admin_ids[pass_resolution]
+                    # Ambiguous admins get an id of 0, as in _find_admin_id.
+                    by_key[admin_key] = 0 if admin_key in by_key else data['id']
+
+                for admin_resolution, admin_field, admin_id_field in (
+                    (ResolutionTypes.ADMIN_1, 'admin_level_1', 'admin_level_1_id'),
+                    (ResolutionTypes.ADMIN_2, 'admin_level_2', 'admin_level_2_id'),
+                ):
+                    if admin_resolution == pass_resolution:
+                        break
+                    admin_key = (data[admin_field], data['admin_level_1'], data['country_code'])
+                    data[admin_id_field] = admin_ids[admin_resolution].get(admin_key, 0)
+
+            if yield_pass and not skip:
+                yield data
+
+        if yield_pass and resolution:
+            return
+
 def _load_main_data(filepath, alt_names_by_id):
     locations_by_name = defaultdict(dict)
     locations_by_id = {}
 
+    for loc_info, data in _iter_main_data(filepath):
+        if _should_skip_location(data, locations_by_name):
+            continue
+
+        alt_osm_names = [
+            name for name in loc_info['alternative_names'].split(',') if _is_ascii(name)
+        ]
+        alt_wiki_names = alt_names_by_id[data['id']]
+        alt_punc_name = get_alt_punc_names(loc_info['name'])
+
+        all_names = set(
+            standardize_loc_name(name)
+            for name in [loc_info['name']] + alt_osm_names + alt_wiki_names + alt_punc_name
+        )
+        for name in all_names:
+            locations_by_name[name][data['id']] = data
+
+        assert data['id'] not in locations_by_id
+        locations_by_id[data['id']] = data
+
+    return locations_by_name, locations_by_id
+
+def _iter_main_data(filepath):
+    """
+    Yields (row, location) pairs for the rows of the OSM data file that have a resolution, in
+    order of decreasing importance.
+    """
     with open(filepath) as loc_file:
         csv_reader = csv.reader(loc_file, delimiter='\t')
         keys = next(csv_reader)
@@ -61,7 +162,7 @@ def _load_main_data(filepath, alt_names_by_id):
             if not resolution:
                 continue
 
-            data = dict(
+            yield loc_info, dict(
                 id=int(loc_info['osm_id']),
                 resolution=resolution,
                 name=standardize_loc_name(loc_info['name']),
@@ -75,27 +176,6 @@ def _load_main_data(filepath, alt_names_by_id):
                 country_code=loc_info['country_code'].upper(),
             )
 
-            if _should_skip_location(data, locations_by_name):
-                continue
-
-            alt_osm_names = [
-                name for name in loc_info['alternative_names'].split(',') if _is_ascii(name)
-            ]
-            alt_wiki_names = alt_names_by_id[data['id']]
-            alt_punc_name = get_alt_punc_names(loc_info['name'])
-
-            all_names = set(
-                standardize_loc_name(name)
-                for name in [loc_info['name']] + alt_osm_names + alt_wiki_names + alt_punc_name
-            )
-            for name in all_names:
-                locations_by_name[name][data['id']] = data
-
-            assert data['id'] not in locations_by_id
-            locations_by_id[data['id']] = data
-
-    return locations_by_name, locations_by_id
-
 def _is_ascii(string):
     return all(ord(c) < 128 for c in string)
 
@@ -124,23 +204,33 @@ def _get_resolution(data):
 
     raise ValueError("Location is missing names for all location levels")
 
+_IDENTIFIER_FIELDS = ('name', 'city', 'admin_level_1', 'admin_level_2', 'country')
+
 def _should_skip_location(loc_data, locations_by_name):
-    for other_location in locations_by_name[loc_data['name']].itervalues():
-        if all(
-            other_location[field] == loc_data[field]
-            for field in ('name', 'city', 'admin_level_1', 'admin_level_2', 'country')
-        ):
+    return _should_skip_identifiers(
+        tuple(loc_data[field] for field in _IDENTIFIER_FIELDS),
+        loc_data['resolution'],
+        [
+            tuple(other_location[field] for field in _IDENTIFIER_FIELDS)
+            for other_location in locations_by_name[loc_data['name']].itervalues()
+            if other_location['resolution'] == loc_data['resolution']
+        ],
+    )
+
+def _should_skip_identifiers(identifiers, resolution, other_identifiers_list):
+    """
+    Takes the identifying fields (_IDENTIFIER_FIELDS) of a location, and those of the previously
+    kept locations of the same name and resolution.
+    """
+    for other_identifiers in other_identifiers_list:
+        if identifiers == other_identifiers:
             # Some locations appear as twice in the data set. If we already saw a location with
             # the same location identifiers, just the keep the first (most important) entry.
             return True
 
-        if (
-            loc_data['resolution'] == ResolutionTypes.CITY and
-            other_location['resolution'] == ResolutionTypes.CITY and
-            all(
-                loc_data[field] == other_location[field] or not loc_data[field]
-                for field in ('name', 'city', 'admin_level_1', 'admin_level_2', 'country')
-            )
+        if resolution == ResolutionTypes.CITY and all(
+            field == other_field or not field
+            for field, other_field in zip(identifiers, other_identifiers)
         ):
             # Some cities appear as less specific versions of previous cities. Again just keep
             # the first entry.
@@ -178,6 +268,23 @@ def _add_missing_countries(filepath, locations_by_name, locations_by_id):
     Some countries appear as countries for another location, but don't appear as a distinct row
     themselves. Add these precalculated countries to the data.
     """
+    for country, alt_wiki_names in _iter_missing_countries(filepath):
+        for alt_name in set(
+            standardize_loc_name(name)
+            for name in [country['name']] + alt_wiki_names + get_alt_punc_names(country['name'])
+        ):
+            locations_by_name[alt_name][country['id']] = country
+
+        assert country['id'] not in locations_by_id
+        locations_by_id[country['id']] = country
+
+def _read_missing_countries(filepath):
+    return [country for country, _ in _iter_missing_countries(filepath)]
+
+def _iter_missing_countries(filepath):
+    """
+    Yields (country, alt names) pairs of the precalculated missing countries.
+    """
     if not os.path.isfile(filepath):
         return
 
@@ -187,15 +294,7 @@ def _add_missing_countries(filepath, locations_by_name, locations_by_id):
     for country in missing_countries:
         alt_wiki_names = country['alt_names']
         del country['alt_names']
-
-        for alt_name in set(
-            standardize_loc_name(name)
-            for name in [country['name']] + alt_wiki_names + get_alt_punc_names(country['name'])
-        ):
-            locations_by_name[alt_name][country['id']] = country
-
-        assert country['id'] not in locations_by_id
-        locations_by_id[country['id']] = country
+        yield country, alt_wiki_names
 
 def _assign_parent_loc_ids(locations_by_name, locations_by_id):
     country_code_to_id = {}
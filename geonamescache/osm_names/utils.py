@@ -32,18 +32,95 @@ def standardize_loc_name(name):
         name = name.title()
     return name
 
+
+class AliasRules(object):
+
+    """
+    Generates the alternate forms a location name could take on, e.g. "St. Louis" for
+    "Saint Louis". There are four kinds of rules, applied to the original name in this order:
+
+        character rules     Replace every occurrence of a character, e.g. "-" -> " ".
+        prefix rules        Replace a case-insensitive prefix, e.g. "Saint " -> "St. ".
+        word rules          Replace a case-insensitive whole word anywhere in the name, e.g.
+                            "Mount" -> "Mt.".
+        truncations         Drop everything from a character on, e.g. "(" for "Hey (there)".
+    """
+
+    def __init__(self):
+        self._character_rules = []
+        # (lowercase prefix, replacement)
+        self._prefix_rules = []
+        self._max_prefix_length = 0
+        # (lowercase word, compiled pattern, replacement)
+        self._word_rules = []
+        self._truncation_chars = []
+
+    def add_character_rule(self, char, replacement):
+        self._character_rules.append((char, replacement))
+
+    def add_prefix_rule(self, prefix, replacement):
+        self._prefix_rules.append((prefix.lower(), replacement))
+        self._max_prefix_length = max(self._max_prefix_length, len(prefix))
+
+    def add_word_rule(self, word, replacement):
+        pattern = re.compile(r'\b%s\b' % re.escape(word), flags=re.IGNORECASE)
+        self._word_rules.append((word.lower(), pattern, replacement))
+
+    def add_truncation(self, char):
+        self._truncation_chars.append(char)
+
+    def alt_names(self, name):
+        """
+        Returns a list of the distinct non-empty alternate forms of a name, other than the name
+        itself.
+        """
+        variants = []
+        seen = {name}
+
+        def add(variant):
+            if variant and variant not in seen:
+                seen.add(variant)
+                variants.append(variant)
+
+        for char, replacement in self._character_rules:
+            if char in name:
+                add(name.replace(char, replacement))
+
+        if self._prefix_rules:
+            lowercase_start = name[:self._max_prefix_length].lower()
+            for prefix, replacement in self._prefix_rules:
+                if lowercase_start.startswith(prefix):
+                    add(replacement + name[len(prefix):])
+
+        if self._word_rules:
+            lowercase_name = name.lower()
+            for word, pattern, replacement in self._word_rules:
+                # The substring check is much faster than the regular expression, and usually
+                # fails.
+                if word in lowercase_name:
+                    add(pattern.sub(lambda match: replacement, name))
+
+        for char in self._truncation_chars:
+            add(name.split(char, 1)[0].strip())
+
+        return variants
+
+
+ALIAS_RULES = AliasRules()
+ALIAS_RULES.add_character_rule("'", "")
+ALIAS_RULES.add_character_rule("-", " ")
+ALIAS_RULES.add_prefix_rule('St ', 'St. ')
+ALIAS_RULES.add_prefix_rule('Saint ', 'St. ')
+ALIAS_RULES.add_prefix_rule('The ', '')
+ALIAS_RULES.add_prefix_rule('City of ', '')
+ALIAS_RULES.add_truncation('(')
+ALIAS_RULES.add_truncation(',')
+
 def get_alt_punc_names(name):
     """
-    Returns a list of names (possibly repeated) of the various forms an input name could
-    take on.
+    Returns a list of the distinct alternate forms an input name could take on, according to
+    ALIAS_RULES. Custom rules can be added there before loading the data, e.g.
+
+        ALIAS_RULES.add_word_rule('Mount', 'Mt.')
     """
-    return [
-        name.replace("'", ""),
-        name.replace("-", " "),
-        re.sub(r'^St ', 'St. ', name, flags=re.IGNORECASE),
-        re.sub(r'^Saint ', 'St. ', name, flags=re.IGNORECASE),
-        re.sub(r'^The ', '', name, flags=re.IGNORECASE),
-        re.sub(r'^City of ', '', name, flags=re.IGNORECASE),
-        name.split('(')[0].strip(),
-        name.split(',')[0].strip(),
-    ]
+    return ALIAS_RULES.alt_names(name)
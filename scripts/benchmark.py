@@ -0,0 +1,245 @@
+import gc
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser, SUPPRESS
+from timeit import default_timer
+
+import numpy as np
+
+"""
+Benchmarks for loading and searching the location data. Prints (or writes) a JSON report, so that
+the results of different runs can be compared.
+
+Cold loads are run in a fresh subprocess each, so that they are not affected by data already
+loaded in this process, and report their wall time and peak RSS. Lookup benchmarks replay a query
+log drawn from the names in the Geonames snapshot with a Zipfian distribution, where names of more
+important locations are queried more often.
+
+Run from the root geonamescache directory, e.g.
+
+    python scripts/benchmark.py --output benchmark.json
+"""
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from geonamescache.geonames.metrics import current_rss_bytes
+
+BATCH_SIZE = 100
+CACHE_SIZE = 10000
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on OS X.
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak_rss /= 1024.
+    return peak_rss / 1024.
+
+def _set_geonames_data_dir(data_dir):
+    import geonamescache.geonames.geonames as geonames
+    for key, filepath in geonames._DATA_FILES.items():
+        geonames._DATA_FILES[key] = os.path.join(data_dir, os.path.basename(filepath))
+
+def _load_geonames():
+    import geonamescache.geonames.geonames as geonames
+    locations_by_name, locations_by_id = geonames.load_data()
+    return len(locations_by_name), len(locations_by_id)
+
+def _load_osm():
+    import geonamescache.osm_names.osm_names as osm_names
+    locations_by_name, locations_by_id = osm_names.load_data()
+    return len(locations_by_name), len(locations_by_id)
+
+def _load_snapshot():
+    from geonamescache.geonames.data_source import DataSource
+    data_source = DataSource()
+    return len(data_source._locations_by_name), len(data_source._locations_by_id)
+
+COLD_LOADS = {
+    'geonames': _load_geonames,
+    'osm': _load_osm,
+    'snapshot': _load_snapshot,
+}
+
+def run_cold_load(source, geonames_data_dir=None):
+    """
+    Loads a single data source in this process, and prints the timings as JSON.
+    """
+    if geonames_data_dir:
+        _set_geonames_data_dir(geonames_data_dir)
+
+    rss_before = _peak_rss_mb()
+    start = default_timer()
+    n_names, n_locations = COLD_LOADS[source]()
+    seconds = default_timer() - start
+    gc.collect()
+    print json.dumps(dict(
+        seconds=seconds,
+        rss_mb=current_rss_bytes() / 2. ** 20,
+        peak_rss_mb=_peak_rss_mb(),
+        peak_rss_before_mb=rss_before,
+        n_names=n_names,
+        n_locations=n_locations,
+    ))
+
+def benchmark_cold_load(source, geonames_data_dir=None):
+    command = [sys.executable, os.path.abspath(__file__), '--cold-load', source]
+    if geonames_data_dir:
+        command.extend(['--geonames-data-dir', geonames_data_dir])
+
+    process = subprocess.Popen(
+        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=ROOT_DIR
+    )
+    stdout, stderr = process.communicate()
+    if process.returncode != 0:
+        return dict(error=stderr.strip().splitlines()[-1])
+    return json.loads(stdout.strip().splitlines()[-1])
+
+def make_query_log(data_source, n_queries, zipf_exponent, seed):
+    """
+    Returns a list of queries, drawn from the searchable names with a Zipfian distribution over
+    the names ranked by the importance of their most important location. Queries are lowercased,
+    as text often is, so that they still need to be standardized.
+    """
+    def name_importance(name):
+        return max(
+            data_source._locations_by_id[id_].get('estimated_importance', 0.)
+            for id_ in data_source._locations_by_name[name]
+        )
+
+    names = sorted(data_source._locations_by_name, key=lambda name: (-name_importance(name), name))
+    probabilities = 1. / np.arange(1, len(names) + 1) ** zipf_exponent
+    probabilities /= probabilities.sum()
+
+    random_state = np.random.RandomState(seed)
+    indexes = random_state.choice(len(names), size=n_queries, p=probabilities)
+    return [names[i].lower() for i in indexes]
+
+def _throughput(func, items, batch_size=1):
+    start = default_timer()
+    if batch_size == 1:
+        for item in items:
+            func(item)
+    else:
+        for i in xrange(0, len(items), batch_size):
+            func(items[i:i + batch_size])
+    seconds = default_timer() - start
+    return dict(seconds=seconds, n_queries=len(items), queries_per_second=len(items) / seconds)
+
+def benchmark_lookups(queries):
+    from geonamescache.geonames.data_source import DataSource
+    data_source = DataSource()
+    cached_data_source = DataSource(cache_size=CACHE_SIZE)
+    return dict(
+        single=_throughput(data_source.all_locations_search, queries),
+        batch=_throughput(data_source.bulk_search, queries, BATCH_SIZE),
+        cached_single=dict(
+            _throughput(cached_data_source.all_locations_search, queries),
+            cache_info=cached_data_source.cache_info(),
+        ),
+    )
+
+def benchmark_standardization(queries):
+    from geonamescache.geonames.utils import standardize_loc_name
+    return _throughput(standardize_loc_name, queries)
+
+def benchmark_alias_generation(names):
+    from geonamescache.geonames.utils import get_alt_punc_names
+    return _throughput(get_alt_punc_names, names)
+
+def benchmark_wiki_parsing(pages_dir):
+    """
+    Extracts the alternate names from the wikipedia pages saved in pages_dir (e.g. the --cache-dir
+    of lookup_alt_names_on_wiki.py) with lxml and with BeautifulSoup, and checks that the results
+    are the same.
+    """
+    from lookup_alt_names_on_wiki import extract_alt_names, extract_alt_names_with_soup
+
+    pages = []
+    for filename in sorted(os.listdir(pages_dir)):
+        if filename.endswith('.html'):
+            with open(os.path.join(pages_dir, filename)) as page_file:
+                pages.append(page_file.read().decode('utf-8'))
+
+    results = {}
+    report = {}
+    for parser, extract in (('lxml', extract_alt_names), ('soup', extract_alt_names_with_soup)):
+        results[parser] = []
+        report[parser] = _throughput(lambda html: results[parser].append(extract(html)), pages)
+        report[parser]['pages_per_second'] = report[parser].pop('queries_per_second')
+        del report[parser]['n_queries']
+
+    report['n_pages'] = len(pages)
+    report['n_different'] = sum(
+        1 for lxml_result, soup_result in zip(results['lxml'], results['soup'])
+        if lxml_result != soup_result
+    )
+    return report
+
+def run(args):
+    report = dict(
+        timestamp=time.strftime('%Y-%m-%dT%H:%M:%S'),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        parameters=dict(
+            n_queries=args.queries, zipf_exponent=args.zipf_exponent, seed=args.seed,
+            batch_size=BATCH_SIZE, cache_size=CACHE_SIZE,
+        ),
+        cold_load={},
+    )
+
+    for source in args.sources:
+        report['cold_load'][source] = benchmark_cold_load(source, args.geonames_data_dir)
+
+    if args.queries:
+        from geonamescache.geonames.data_source import DataSource
+        data_source = DataSource()
+        queries = make_query_log(data_source, args.queries, args.zipf_exponent, args.seed)
+        report['lookup'] = benchmark_lookups(queries)
+        report['standardization'] = benchmark_standardization(queries)
+        # Alias generation runs once per location name when loading the raw data.
+        report['alias_generation'] = benchmark_alias_generation(
+            [location['name'] for location in data_source._locations_by_id.itervalues()]
+        )
+
+    if args.wiki_pages_dir:
+        report['wiki_parsing'] = benchmark_wiki_parsing(args.wiki_pages_dir)
+
+    return report
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--output', help='file to write the JSON report to (default: stdout)')
+    parser.add_argument(
+        '--sources', nargs='*', default=sorted(COLD_LOADS), choices=sorted(COLD_LOADS),
+        help='data sources to benchmark cold loads for',
+    )
+    parser.add_argument('--queries', type=int, default=10 ** 5, help='size of the query log')
+    parser.add_argument('--zipf-exponent', type=float, default=1.1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--geonames-data-dir', help='read the raw Geonames files from this directory instead'
+    )
+    parser.add_argument(
+        '--wiki-pages-dir', help='also benchmark the parsing of the wikipedia pages saved here'
+    )
+    parser.add_argument('--cold-load', choices=sorted(COLD_LOADS), help=SUPPRESS)
+    args = parser.parse_args()
+
+    if args.cold_load:
+        run_cold_load(args.cold_load, args.geonames_data_dir)
+        sys.exit(0)
+
+    report = json.dumps(run(args), indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as out:
+            out.write(report + '\n')
+    else:
+        print report
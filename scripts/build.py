@@ -0,0 +1,338 @@
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+"""
+Regenerates the derived data files by running the data scripts as stages of a pipeline, e.g.
+
+    python scripts/build.py                  # importances, missing countries and snapshot
+    python scripts/build.py alt_names        # also crawl wikipedia for alternate names
+
+A stage is skipped when the contents of its input files (including its scripts) and its command
+are the same as when it last succeeded, and its outputs are unchanged since. Otherwise its outputs
+are moved aside and it is run again; some scripts read the previous version of their own output
+(estimate_importances.py and add_missing_countries.py through load_data), which would otherwise
+leak into the new one. If the stage fails, its old outputs are put back. Stages that do not depend
+on each other run in parallel.
+
+STAGES are in the order the README gives. A stage depends on the earlier stages whose outputs it
+reads. An output of a later stage (like the wikipedia alternate names that estimate_importances.py
+reads) is an input like any other file, so a rebuild after that stage ran also runs the stages
+that read it. Manual stages (network crawls) only run when asked for.
+
+Stamps of the stages and the logs of their runs are kept in --build-dir.
+"""
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_GEONAMES = 'geonamescache/geonames/'
+_OSM_NAMES = 'geonamescache/osm_names/'
+
+_GEONAMES_DATA = [
+    _GEONAMES + 'data/countryInfo.txt',
+    _GEONAMES + 'data/admin1CodesASCII.txt',
+    _GEONAMES + 'data/admin2Codes.txt',
+    _GEONAMES + 'data/cities5000.txt',
+]
+# geonames.py and the modules it imports.
+_GEONAMES_CODE = [
+    _GEONAMES + 'geonames.py', _GEONAMES + 'manual_alternate_names.py', _GEONAMES + 'metrics.py',
+    _GEONAMES + 'spatial.py', _GEONAMES + 'utils.py',
+]
+_OSM_DATA = _OSM_NAMES + 'data/osm_data.tsv'
+
+# Suffix of the outputs of a running stage from its last run.
+_OLD_OUTPUT_SUFFIX = '.old'
+
+_IMPORTANCES = _GEONAMES + 'data/estimated_importance.json'
+_ALT_WIKI_NAMES = _GEONAMES + 'data/alt_wiki_names.json'
+
+# Paths are relative to the root geonamescache directory.
+STAGES = [
+    dict(
+        name='importances',
+        command=['scripts/estimate_importances.py', _OSM_DATA, _IMPORTANCES],
+        inputs=_GEONAMES_DATA + _GEONAMES_CODE + [
+            _ALT_WIKI_NAMES, _OSM_DATA, 'scripts/estimate_importances.py',
+        ],
+        outputs=[_IMPORTANCES],
+    ),
+    dict(
+        name='alt_names',
+        command=[
+            'scripts/lookup_alt_names_on_wiki.py', _ALT_WIKI_NAMES,
+            'scripts/readable_wiki_names.tsv', '--cache-dir', '{build_dir}/wiki_cache',
+            '--checkpoint', '{build_dir}/wiki_checkpoint.jsonl',
+        ],
+        inputs=_GEONAMES_DATA + _GEONAMES_CODE + [
+            _IMPORTANCES, 'scripts/lookup_alt_names_on_wiki.py',
+        ],
+        outputs=[_ALT_WIKI_NAMES, 'scripts/readable_wiki_names.tsv'],
+        manual=True,
+    ),
+    dict(
+        name='missing_countries',
+        # The script reads its data relative to the osm_names directory.
+        command=['add_missing_countries.py', 'data/countries.json'],
+        cwd=_OSM_NAMES,
+        # lookup_alt_names_on_wiki.py imports geonames.py.
+        inputs=_GEONAMES_CODE + [
+            _OSM_DATA, _OSM_NAMES + 'data/us_states.tsv', _OSM_NAMES + 'data/countries.csv',
+            _OSM_NAMES + 'add_missing_countries.py', _OSM_NAMES + 'osm_names.py',
+            _OSM_NAMES + 'utils.py', 'scripts/lookup_alt_names_on_wiki.py',
+        ],
+        outputs=[_OSM_NAMES + 'data/countries.json'],
+    ),
+    dict(
+        name='snapshot',
+        command=['scripts/create_single_json.py', _GEONAMES + 'data/geonames_all.json'],
+        inputs=_GEONAMES_DATA + _GEONAMES_CODE + [
+            _IMPORTANCES, _ALT_WIKI_NAMES, _GEONAMES + 'snapshot.py',
+            'scripts/create_single_json.py',
+        ],
+        outputs=[_GEONAMES + 'data/geonames_all.json'],
+    ),
+]
+
+
+def get_stages_to_run(stage_names=None):
+    """
+    Returns the stages with the given names (or the non-manual stages), and the earlier stages
+    they depend on, in pipeline order, with the names of the stages each depends on.
+    """
+    stages_by_name = {stage['name']: stage for stage in STAGES}
+    unknown_names = set(stage_names or ()) - set(stages_by_name)
+    if unknown_names:
+        raise ValueError('Unknown stages: %s' % ', '.join(sorted(unknown_names)))
+
+    if stage_names:
+        wanted = set(stage_names)
+    else:
+        wanted = set(stage['name'] for stage in STAGES if not stage.get('manual'))
+
+    # Go through the stages from last to first, so that each stage's dependencies come later.
+    dependencies = {}
+    for i in reversed(xrange(len(STAGES))):
+        stage = STAGES[i]
+        if stage['name'] not in wanted:
+            continue
+
+        dependencies[stage['name']] = set(
+            earlier_stage['name'] for earlier_stage in STAGES[:i]
+            if set(earlier_stage['outputs']) & set(stage['inputs'])
+            and (earlier_stage['name'] in wanted or not earlier_stage.get('manual'))
+        )
+        wanted.update(dependencies[stage['name']])
+
+    return [
+        (stage, dependencies[stage['name']]) for stage in STAGES if stage['name'] in dependencies
+    ]
+
+
+class StageError(Exception):
+    pass
+
+
+class _FileHashes(object):
+
+    """
+    Hashes the contents of files, rehashing a file only when its size or modification time
+    changed.
+    """
+
+    def __init__(self):
+        self._hashes = {}
+
+    def get(self, path):
+        """
+        Returns the SHA-1 of the file, or None if it does not exist.
+        """
+        if not os.path.isfile(path):
+            return None
+
+        file_stat = os.stat(path)
+        key = (path, file_stat.st_size, file_stat.st_mtime)
+        if key not in self._hashes:
+            sha1 = hashlib.sha1()
+            with open(path, 'rb') as input_file:
+                for block in iter(lambda: input_file.read(2 ** 20), ''):
+                    sha1.update(block)
+            self._hashes[key] = sha1.hexdigest()
+        return self._hashes[key]
+
+
+def get_stage_key(stage, command, file_hashes):
+    """
+    Returns a hash of the stage's command and the contents of its inputs.
+    """
+    sha1 = hashlib.sha1(json.dumps(command))
+    for path in sorted(stage['inputs']):
+        sha1.update('\0%s\0%s' % (path, file_hashes.get(os.path.join(ROOT_DIR, path))))
+    return sha1.hexdigest()
+
+def is_up_to_date(stamp_filepath, key, outputs, file_hashes):
+    """
+    Returns whether the stamp of the stage's last successful run has the same key, and the
+    outputs are still the ones it wrote. A stamp that can't be read is out of date.
+    """
+    if not os.path.isfile(stamp_filepath):
+        return False
+
+    try:
+        with open(stamp_filepath) as stamp_file:
+            stamp = json.load(stamp_file)
+        return stamp['key'] == key and all(
+            stamp['outputs'].get(path) == file_hashes.get(os.path.join(ROOT_DIR, path))
+            for path in outputs
+        )
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return False
+
+def run_stage(stage, build_dir, force=False, file_hashes=None):
+    """
+    Runs the stage unless it is up to date. Returns 'skipped' or 'done', or raises
+    subprocess.CalledProcessError or StageError (or any other exception) if the stage failed.
+    """
+    file_hashes = file_hashes or _FileHashes()
+    command = [arg.format(build_dir=build_dir) for arg in stage['command']]
+    key = get_stage_key(stage, command, file_hashes)
+    stamp_filepath = os.path.join(build_dir, '%s.stamp.json' % stage['name'])
+    if not force and is_up_to_date(stamp_filepath, key, stage['outputs'], file_hashes):
+        return 'skipped'
+
+    if os.path.isfile(stamp_filepath):
+        os.remove(stamp_filepath)
+
+    # The old outputs are moved aside, and put back if the stage fails.
+    moved_outputs = []
+    try:
+        for path in stage['outputs']:
+            output_filepath = os.path.join(ROOT_DIR, path)
+            old_output_filepath = output_filepath + _OLD_OUTPUT_SUFFIX
+            if not os.path.isfile(output_filepath) and os.path.isfile(old_output_filepath):
+                # Left by a build that was killed while running the stage.
+                os.rename(old_output_filepath, output_filepath)
+            if os.path.isfile(output_filepath):
+                os.rename(output_filepath, old_output_filepath)
+                moved_outputs.append(output_filepath)
+
+        _run_command(stage, command, build_dir)
+
+        missing_outputs = [
+            path for path in stage['outputs'] if not os.path.isfile(os.path.join(ROOT_DIR, path))
+        ]
+        if missing_outputs:
+            raise StageError('The stage did not write %s' % ', '.join(missing_outputs))
+    except:
+        for output_filepath in moved_outputs:
+            os.rename(output_filepath + _OLD_OUTPUT_SUFFIX, output_filepath)
+        raise
+
+    for output_filepath in moved_outputs:
+        os.remove(output_filepath + _OLD_OUTPUT_SUFFIX)
+
+    # Write a new stamp and rename it, so that a killed build never leaves a truncated stamp.
+    tmp_stamp_filepath = stamp_filepath + '.tmp'
+    with open(tmp_stamp_filepath, 'w') as stamp_file:
+        json.dump({
+            'key': key,
+            'outputs': {
+                path: file_hashes.get(os.path.join(ROOT_DIR, path)) for path in stage['outputs']
+            },
+        }, stamp_file, indent=2, sort_keys=True)
+    os.rename(tmp_stamp_filepath, stamp_filepath)
+
+    return 'done'
+
+def _run_command(stage, command, build_dir):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT_DIR, os.path.join(ROOT_DIR, 'scripts')] +
+        ([env['PYTHONPATH']] if env.get('PYTHONPATH') else [])
+    )
+    with open(os.path.join(build_dir, '%s.log' % stage['name']), 'w') as log_file, \
+            open(os.devnull) as no_input:
+        # Scripts that drop into the debugger on errors exit when there is no input.
+        subprocess.check_call(
+            [sys.executable] + command, cwd=os.path.join(ROOT_DIR, stage.get('cwd', '')),
+            env=env, stdin=no_input, stdout=log_file, stderr=subprocess.STDOUT,
+        )
+
+def run(stage_names=None, build_dir=None, n_jobs=None, force=False):
+    """
+    Runs the stages with the given names (see get_stages_to_run), each as soon as the stages it
+    depends on succeeded. Returns whether all of them succeeded.
+    """
+    build_dir = os.path.abspath(build_dir or os.path.join(ROOT_DIR, '.build'))
+    if not os.path.isdir(build_dir):
+        os.makedirs(build_dir)
+
+    stages_to_run = get_stages_to_run(stage_names)
+    file_hashes = _FileHashes()
+    # stage name -> 'skipped', 'done', 'failed' or 'not run'
+    results = {}
+    running = {}
+    start_times = {}
+
+    executor = ThreadPoolExecutor(n_jobs or len(stages_to_run))
+    try:
+        while len(results) < len(stages_to_run):
+            for stage, dependencies in stages_to_run:
+                name = stage['name']
+                if name in results or name in running.values():
+                    continue
+                if any(
+                    results.get(dependency) in ('failed', 'not run') for dependency in dependencies
+                ):
+                    results[name] = 'not run'
+                    print '[%s] not run, since a stage it depends on failed' % name
+                elif all(dependency in results for dependency in dependencies):
+                    start_times[name] = time.time()
+                    future = executor.submit(run_stage, stage, build_dir, force, file_hashes)
+                    running[future] = name
+
+            if not running:
+                continue
+
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    # Whatever the error, it only stops the stages that depend on this one.
+                    results[name] = 'failed'
+                    print '[%s] failed (%s: %s), see %s' % (
+                        name, type(e).__name__, e, os.path.join(build_dir, '%s.log' % name)
+                    )
+                    continue
+
+                if results[name] == 'skipped':
+                    print '[%s] up to date' % name
+                else:
+                    print '[%s] done in %.1fs' % (name, time.time() - start_times[name])
+    finally:
+        executor.shutdown()
+
+    return all(result in ('skipped', 'done') for result in results.itervalues())
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument(
+        'stages', nargs='*', help='stages to run, with the stages they depend on (default: all '
+        'but the manual ones: %s)' % ', '.join(
+            stage['name'] for stage in STAGES if not stage.get('manual')
+        )
+    )
+    parser.add_argument('--build-dir', help='directory of stamps and logs (default: .build)')
+    parser.add_argument('--jobs', type=int, help='number of stages to run at once')
+    parser.add_argument('--force', action='store_true', help='run the stages even if up to date')
+    args = parser.parse_args()
+
+    sys.exit(0 if run(args.stages, args.build_dir, args.jobs, args.force) else 1)
@@ -1,13 +1,48 @@
-import json
-import sys
+from argparse import ArgumentParser
 from geonamescache.geonames.geonames import load_data
+from geonamescache.geonames.snapshot import (
+    PROFILES,
+    select_locations,
+    write_shards,
+    write_snapshot,
+)
 
 
-def run(output_filepath):
+def run(output_filepath, shards_dir=None, **selection):
+    """
+    Writes the full data set, or a smaller one if any selection arguments of
+    snapshot.select_locations are given.
+    """
     locations_by_name, locations_by_id = load_data()
-    with open(output_filepath, 'w') as output:
-        json.dump(locations_by_name, output)
+    if selection:
+        locations_by_name, locations_by_id = select_locations(
+            locations_by_name, locations_by_id, **selection
+        )
+
+    write_snapshot(output_filepath, locations_by_name, locations_by_id)
+    if shards_dir:
+        write_shards(shards_dir, locations_by_name, locations_by_id)
 
 
 if __name__ == '__main__':
-    run(sys.argv[1])
+    parser = ArgumentParser()
+    parser.add_argument('output_filepath')
+    parser.add_argument(
+        '--shards-dir', help='also write per-country shards (for DataSource(countries=...)) here'
+    )
+    parser.add_argument(
+        '--profile', choices=sorted(PROFILES), help='build a smaller data set with this profile'
+    )
+    parser.add_argument('--min-population', type=int, help='only keep bigger locations')
+    parser.add_argument(
+        '--top-n-by-importance', type=int, help='only keep the most important locations'
+    )
+    args = parser.parse_args()
+
+    selection = dict(PROFILES[args.profile]) if args.profile else {}
+    if args.min_population is not None:
+        selection['min_population'] = args.min_population
+    if args.top_n_by_importance is not None:
+        selection['top_n_by_importance'] = args.top_n_by_importance
+
+    run(args.output_filepath, args.shards_dir, **selection)
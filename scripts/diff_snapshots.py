@@ -0,0 +1,232 @@
+import heapq
+import json
+import sys
+from argparse import ArgumentParser
+from collections import defaultdict
+from itertools import groupby
+
+from geonamescache.geonames.snapshot import iter_snapshot
+
+"""
+Compares two snapshots (or shards) written by snapshot.write_snapshot, e.g. before deploying a new
+build:
+
+    python scripts/diff_snapshots.py old/geonames_all.json new/geonames_all.json
+
+Reports the added, removed and changed locations (with the number of changes of each field), the
+added and removed aliases (name, id pairs), and the largest changes of estimated importance. Both
+snapshots are read one line at a time, side by side, so memory does not grow with their size.
+With --exit-code, exits with 1 if the snapshots differ, as `git diff --exit-code` does.
+"""
+
+N_EXAMPLES = 10
+
+
+def run(old_filepath, new_filepath, n_examples=N_EXAMPLES, as_json=False, exit_code=False):
+    """
+    Prints the report of the differences between the two snapshots, and returns the exit status:
+    1 if exit_code is set and the snapshots differ, 0 otherwise.
+    """
+    with open(old_filepath) as old_file, open(new_filepath) as new_file:
+        report = diff_snapshots(old_file, new_file, n_examples)
+
+    if as_json:
+        print json.dumps(report, indent=2, sort_keys=True)
+    else:
+        print_report(report)
+
+    return 1 if exit_code and is_different(report) else 0
+
+def diff_snapshots(old_file, new_file, n_examples=N_EXAMPLES):
+    """
+    Returns a report of the differences between the two snapshot files, with up to n_examples
+    examples of each kind of difference.
+    """
+    report = {}
+    old_sections = groupby(iter_snapshot(old_file), key=lambda record: record[0])
+    new_sections = groupby(iter_snapshot(new_file), key=lambda record: record[0])
+    for section, old_records, new_records in _merge(old_sections, new_sections, 'section'):
+        report[section] = _diff_section(
+            section,
+            (record for _, record in old_records or ()),
+            (record for _, record in new_records or ()),
+            n_examples,
+        )
+    # groupby yields no group for a section that is empty in both snapshots.
+    for section in ('locations', 'names'):
+        if section not in report:
+            report[section] = _diff_section(section, (), (), n_examples)
+    return report
+
+def _diff_section(section, old_records, new_records, n_examples):
+    if section == 'names':
+        return _diff_names(old_records, new_records, n_examples)
+    return _diff_locations(old_records, new_records, n_examples)
+
+def _merge(old_items, new_items, kind, key=lambda item: item[0]):
+    """
+    Merges two iterables of items sorted by key, yielding (key, old item or None, new item or
+    None) for each key. Raises ValueError if they are not sorted.
+    """
+    old_items = iter(old_items)
+    new_items = iter(new_items)
+    old_item = next(old_items, None)
+    new_item = next(new_items, None)
+    last_key = None
+    while old_item is not None or new_item is not None:
+        if new_item is None or (old_item is not None and key(old_item) < key(new_item)):
+            item_key, old_value, new_value = key(old_item), old_item, None
+        elif old_item is None or key(new_item) < key(old_item):
+            item_key, old_value, new_value = key(new_item), None, new_item
+        else:
+            item_key, old_value, new_value = key(old_item), old_item, new_item
+
+        if last_key is not None and item_key <= last_key:
+            raise ValueError('The %ss of a snapshot are not sorted at %r' % (kind, item_key))
+        last_key = item_key
+
+        yield item_key, old_value and old_value[1], new_value and new_value[1]
+        if old_value is not None:
+            old_item = next(old_items, None)
+        if new_value is not None:
+            new_item = next(new_items, None)
+
+def _diff_locations(old_locations, new_locations, n_examples):
+    added = []
+    removed = []
+    changed = []
+    n_added = n_removed = n_changed = 0
+    changed_fields = defaultdict(int)
+    importance_deltas = []
+    n_importance_changes = 0
+    total_importance_delta = 0.
+
+    for id_, old, new in _merge(
+        ((location['id'], location) for location in old_locations),
+        ((location['id'], location) for location in new_locations),
+        'location',
+    ):
+        if old is None:
+            n_added += 1
+            if len(added) < n_examples:
+                added.append(_describe(new))
+            continue
+        if new is None:
+            n_removed += 1
+            if len(removed) < n_examples:
+                removed.append(_describe(old))
+            continue
+        if old == new:
+            continue
+
+        fields = sorted(
+            field for field in set(old) | set(new) if old.get(field) != new.get(field)
+        )
+        n_changed += 1
+        for field in fields:
+            changed_fields[field] += 1
+        if len(changed) < n_examples:
+            changed.append(dict(_describe(new), fields=fields))
+
+        if 'estimated_importance' in fields:
+            delta = new.get('estimated_importance', 0.) - old.get('estimated_importance', 0.)
+            n_importance_changes += 1
+            total_importance_delta += abs(delta)
+            _keep_largest(importance_deltas, (abs(delta), id_, delta, new['name']), n_examples)
+
+    return dict(
+        n_added=n_added,
+        n_removed=n_removed,
+        n_changed=n_changed,
+        changed_fields=dict(changed_fields),
+        importance=dict(
+            n_changed=n_importance_changes,
+            mean_abs_delta=(
+                total_importance_delta / n_importance_changes if n_importance_changes else 0.
+            ),
+            largest_deltas=[
+                dict(id=id_, name=name, delta=delta)
+                for _, id_, delta, name in sorted(importance_deltas, reverse=True)
+            ],
+        ),
+        added=added,
+        removed=removed,
+        changed=changed,
+    )
+
+def _diff_names(old_names, new_names, n_examples):
+    added = []
+    removed = []
+    n_added = n_removed = 0
+    for name, old_ids, new_ids in _merge(old_names, new_names, 'name'):
+        old_ids = set(old_ids or ())
+        new_ids = set(new_ids or ())
+        for ids, examples, is_added in (
+            (new_ids - old_ids, added, True), (old_ids - new_ids, removed, False)
+        ):
+            if is_added:
+                n_added += len(ids)
+            else:
+                n_removed += len(ids)
+            for id_ in sorted(ids)[:n_examples - len(examples)]:
+                examples.append(dict(name=name, id=id_))
+
+    return dict(n_added=n_added, n_removed=n_removed, added=added, removed=removed)
+
+def _describe(location):
+    return dict(
+        id=location['id'], name=location['name'], resolution=location['resolution'],
+        country_code=location.get('country_code'),
+    )
+
+def _keep_largest(heap, item, n):
+    # A min-heap of the n largest items.
+    if len(heap) < n:
+        heapq.heappush(heap, item)
+    elif item > heap[0]:
+        heapq.heapreplace(heap, item)
+
+def is_different(report):
+    return any(
+        section_report['n_added'] or section_report['n_removed'] or
+        section_report.get('n_changed')
+        for section_report in report.itervalues()
+    )
+
+def print_report(report):
+    for section, section_report in sorted(report.iteritems()):
+        print '##########################'
+        print '%s: %d added, %d removed%s' % (
+            section, section_report['n_added'], section_report['n_removed'],
+            ', %d changed' % section_report['n_changed'] if 'n_changed' in section_report else '',
+        )
+        for kind in ('added', 'removed', 'changed'):
+            for example in section_report.get(kind, ()):
+                print '  %s %s' % (kind, json.dumps(example, sort_keys=True))
+        if section_report.get('changed_fields'):
+            print '  changed fields:', json.dumps(section_report['changed_fields'], sort_keys=True)
+        importance = section_report.get('importance')
+        if importance and importance['n_changed']:
+            print '  importance changes: %d, mean absolute change %.4f' % (
+                importance['n_changed'], importance['mean_abs_delta']
+            )
+            for delta in importance['largest_deltas']:
+                print '    %+.4f %s (%d)' % (delta['delta'], delta['name'], delta['id'])
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('old_filepath')
+    parser.add_argument('new_filepath')
+    parser.add_argument(
+        '--examples', type=int, default=N_EXAMPLES, help='number of examples of each difference'
+    )
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument(
+        '--exit-code', action='store_true', help='exit with 1 if the snapshots differ'
+    )
+    args = parser.parse_args()
+
+    sys.exit(run(
+        args.old_filepath, args.new_filepath, args.examples, args.json, args.exit_code
+    ))
@@ -4,18 +4,23 @@ import matplotlib
 matplotlib.use('TkAgg')
 import matplotlib.pyplot as plt
 import numpy as np
+import os
 import pdb
+import pickle
 import sys
+import time
 import traceback
 
 from argparse import ArgumentParser
 from collections import defaultdict
+from multiprocessing import cpu_count, Pool
 from sklearn.base import clone
 from sklearn.ensemble import GradientBoostingRegressor
 from sklearn.linear_model import Ridge
 from sklearn.model_selection import train_test_split
 
 import geonamescache.geonames.geonames as geonames
+from geonamescache.geonames.columnar import find_indexes
 from geonamescache.geonames.utils import (
     get_alt_punc_names,
     ResolutionTypes,
@@ -91,20 +96,30 @@ DEFAULT_IMPORTANCE = {
 }
 
 
-def run(osm_data_filepath, out_filepath, show_plot):
+def run(
+    osm_data_filepath, out_filepath, show_plot, n_processes=None, compare_matching=False,
+    n_trials=None, state_dir=None
+):
     geo_locations_by_name, geo_locations_by_id = geonames.load_data()
     location_importances = find_osm_importances(
-        osm_data_filepath, geo_locations_by_name, geo_locations_by_id
+        osm_data_filepath, geo_locations_by_name, geo_locations_by_id, n_processes,
+        compare_matching
+    )
+    location_columns = get_location_columns(geo_locations_by_id.itervalues())
+    training_sets, predict_sets = get_data_sets(location_columns, location_importances)
+    models = train_models(
+        training_sets, geo_locations_by_id, location_importances, show_plot, n_trials
     )
-    training_sets, predict_sets = get_data_sets(geo_locations_by_id, location_importances)
-    models = train_models(training_sets, geo_locations_by_id, location_importances, show_plot)
     predictions = make_predictions(
-        models, training_sets, predict_sets, geo_locations_by_id, location_importances
+        models, training_sets, predict_sets, location_columns, location_importances
     )
 
     with open(out_filepath, 'w') as out:
         json.dump(predictions, out)
 
+    if state_dir:
+        save_state(state_dir, models, location_columns, location_importances)
+
     if show_plot:
         plt.show()
 
@@ -289,26 +304,209 @@ def resolve_best_location(locations, is_osm):
         ):
             return top_location
 
-def find_osm_importances(osm_data_filepath, geo_locations_by_name, geo_locations_by_id):
+def find_osm_importances(
+    osm_data_filepath, geo_locations_by_name, geo_locations_by_id, n_processes=None,
+    compare_matching=False
+):
     """
     For each Geonames location of non-trivial population, try to identify the corresponding
     location in the OSM dataset and record its importance score.
     """
     osm_locations_by_name, osm_countries = read_osm_locations(osm_data_filepath)
 
+    start = time.time()
+    location_importances, counts = match_locations(
+        osm_locations_by_name, osm_countries, geo_locations_by_name, geo_locations_by_id,
+        n_processes
+    )
+    seconds = time.time() - start
+    print '##########################'
+    print 'Matched locations in %.1f seconds' % seconds
+
+    if compare_matching:
+        start = time.time()
+        naive_results = _match_locations_naive(
+            osm_locations_by_name, osm_countries, geo_locations_by_name, geo_locations_by_id
+        )
+        naive_seconds = time.time() - start
+        assert naive_results == (location_importances, counts)
+        print 'Unindexed matching took %.1f seconds, with identical results (%.1fx speedup)' % (
+            naive_seconds, naive_seconds / seconds
+        )
+
+    print '##########################'
+    print 'All locations matches'
+    for kind, ids in counts.iteritems():
+        print '%s: %d' % (kind, len(ids))
+
+    print '##########################'
+    print 'Country matches'
+    print 'Matches: ', len([
+        id_ for id_ in counts['Found match']
+        if geo_locations_by_id[id_]['resolution'] == ResolutionTypes.COUNTRY
+    ])
+    for kind, ids in counts.iteritems():
+        if kind != 'Found match':
+            locs = []
+            for id_ in ids:
+                geo_location = geo_locations_by_id[id_]
+                if (
+                    id_ not in location_importances and
+                    geo_location['resolution'] == ResolutionTypes.COUNTRY
+                ):
+                    locs.append((geo_location['name'], geo_location['population']))
+            print '## %s: %d' % (kind, len(locs))
+            for loc in locs:
+                print loc
+
+    return location_importances
+
+_MATCH_COUNT_KINDS = (
+    'Unresolved geoname locations', 'Small location', 'Unresolved osm locations',
+    'Dummy osm importance', 'Found match',
+)
+
+# The data shared with the matching worker processes, which inherit it when they are forked.
+_MATCHING_DATA = None
+
+def match_locations(
+    osm_locations_by_name, osm_countries, geo_locations_by_name, geo_locations_by_id,
+    n_processes=None
+):
+    """
+    Matches the most important Geonames location for each name and resolution to the best OSM
+    location with the same name, resolution and country, in parallel over the names. Returns the
+    OSM importances by Geonames id, and the sets of Geonames ids of each kind of match result.
+    """
+    global _MATCHING_DATA
+
+    _MATCHING_DATA = (
+        osm_locations_by_name, osm_countries, geo_locations_by_name, geo_locations_by_id
+    )
+    names = list(geo_locations_by_name)
+    n_processes = n_processes or cpu_count()
+    try:
+        if n_processes == 1:
+            results = [_match_names(names)]
+        else:
+            pool = Pool(n_processes)
+            try:
+                results = pool.map(
+                    _match_names, [names[i::n_processes] for i in range(n_processes)]
+                )
+            finally:
+                pool.close()
+                pool.join()
+    finally:
+        _MATCHING_DATA = None
+
     location_importances = {}
-    counts = dict((kind, set()) for kind in (
-        'Unresolved geoname locations', 'Small location', 'Unresolved osm locations',
-        'Dummy osm importance', 'Found match'
-    ))
+    counts = dict((kind, set()) for kind in _MATCH_COUNT_KINDS)
+    for worker_importances, worker_counts in results:
+        location_importances.update(worker_importances)
+        for kind, ids in worker_counts.iteritems():
+            counts[kind].update(ids)
+
+    return location_importances, counts
+
+def _match_names(names):
+    osm_locations_by_name, osm_countries, geo_locations_by_name, geo_locations_by_id = (
+        _MATCHING_DATA
+    )
+
+    location_importances = {}
+    counts = dict((kind, set()) for kind in _MATCH_COUNT_KINDS)
+
+    for name in names:
+        geo_locations = [geo_locations_by_id[id_] for id_ in geo_locations_by_name[name]]
+        # The best OSM location for each (resolution, country code) of this name, found once
+        # instead of for each Geonames location of the name.
+        best_osm_matches = None
+
+        for resolution in (
+            ResolutionTypes.CITY, ResolutionTypes.ADMIN_1, ResolutionTypes.ADMIN_2,
+            ResolutionTypes.COUNTRY
+        ):
+            candidate_locations = [
+                loc for loc in geo_locations if loc['resolution'] == resolution
+            ]
+            if not candidate_locations:
+                continue
+
+            geo_location = resolve_best_location(candidate_locations, is_osm=False)
+            if not geo_location:
+                counts['Unresolved geoname locations'].update([
+                    loc['id'] for loc in candidate_locations
+                ])
+                continue
+
+            counts['Unresolved geoname locations'].update([
+                loc['id'] for loc in candidate_locations if loc['id'] != geo_location['id']
+            ])
+
+            if geo_location['name'] != name:
+                continue
+            if (
+                resolution != ResolutionTypes.COUNTRY and
+                geo_location['population'] < MIN_POPULATION_THRESHOLD
+            ):
+                counts['Small location'].add(geo_location['id'])
+                continue
+
+            if resolution == ResolutionTypes.COUNTRY:
+                best_match = osm_countries.get(geo_location['country_code'])
+            else:
+                if best_osm_matches is None:
+                    best_osm_matches = _find_best_osm_matches(
+                        osm_locations_by_name.get(name, ())
+                    )
+                best_match = best_osm_matches.get((resolution, geo_location['country_code']))
+
+            if not best_match:
+                counts['Unresolved osm locations'].add(geo_location['id'])
+                continue
+
+            if (best_match['importance'] < .41 or best_match['importance'] in (.5, .45)):
+                counts['Dummy osm importance'].add(geo_location['id'])
+                continue
+
+            counts['Found match'].add(geo_location['id'])
+            location_importances[geo_location['id']] = best_match['importance']
+
+    return location_importances, counts
 
-    for name, geo_locations in geo_locations_by_name.iteritems():
+def _find_best_osm_matches(osm_locations):
+    """
+    Returns the best of the given OSM locations for each (resolution, country code).
+    """
+    osm_locations_by_key = defaultdict(list)
+    for osm_location in osm_locations:
+        osm_locations_by_key[(osm_location['resolution'], osm_location['country_code'])].append(
+            osm_location
+        )
+    return {
+        key: resolve_best_location(key_locations, is_osm=True)
+        for key, key_locations in osm_locations_by_key.iteritems()
+    }
+
+def _match_locations_naive(
+    osm_locations_by_name, osm_countries, geo_locations_by_name, geo_locations_by_id
+):
+    """
+    The unindexed, single process version of match_locations, to check that it gives the same
+    results.
+    """
+    location_importances = {}
+    counts = dict((kind, set()) for kind in _MATCH_COUNT_KINDS)
+
+    for name, geo_ids in geo_locations_by_name.iteritems():
+        geo_locations = [geo_locations_by_id[id_] for id_ in geo_ids]
         for resolution in (
             ResolutionTypes.CITY, ResolutionTypes.ADMIN_1, ResolutionTypes.ADMIN_2,
             ResolutionTypes.COUNTRY
         ):
             candidate_locations = [
-                loc for loc in geo_locations.itervalues() if loc['resolution'] == resolution
+                loc for loc in geo_locations if loc['resolution'] == resolution
             ]
             if not candidate_locations:
                 continue
@@ -338,7 +536,7 @@ def find_osm_importances(osm_data_filepath, geo_locations_by_name, geo_locations
             else:
                 matches = [
                     osm_location
-                    for osm_location in osm_locations_by_name[name]
+                    for osm_location in osm_locations_by_name.get(name, ())
                     if (
                         osm_location['resolution'] == resolution and
                         osm_location['country_code'] == geo_location['country_code']
@@ -357,81 +555,96 @@ def find_osm_importances(osm_data_filepath, geo_locations_by_name, geo_locations
             counts['Found match'].add(geo_location['id'])
             location_importances[geo_location['id']] = best_match['importance']
 
-    print '##########################'
-    print 'All locations matches'
-    for kind, ids in counts.iteritems():
-        print '%s: %d' % (kind, len(ids))
+    return location_importances, counts
 
-    print '##########################'
-    print 'Country matches'
-    print 'Matches: ', len([
-        id_ for id_ in counts['Found match']
-        if geo_locations_by_id[id_]['resolution'] == ResolutionTypes.COUNTRY
-    ])
-    for kind, ids in counts.iteritems():
-        if kind != 'Found match':
-            locs = []
-            for id_ in ids:
-                geo_location = geo_locations_by_id[id_]
-                if (
-                    id_ not in location_importances and
-                    geo_location['resolution'] == ResolutionTypes.COUNTRY
-                ):
-                    locs.append((geo_location['name'], geo_location['population']))
-            print '## %s: %d' % (kind, len(locs))
-            for loc in locs:
-                print loc
+def get_location_columns(locations):
+    """
+    Returns the fields of the given Geonames locations needed for the features as NumPy columns,
+    in the same order.
+    """
+    locations = list(locations)
+    return {
+        'id': np.array([location['id'] for location in locations], dtype=np.int64),
+        'resolution': np.array([location['resolution'] for location in locations], dtype=str),
+        'country_id': np.array([location['country_id'] for location in locations], dtype=np.int64),
+        'population': np.array(
+            [location['population'] for location in locations], dtype=np.float64
+        ),
+    }
 
-    return location_importances
+def get_features(location_columns, location_importances):
+    """
+    Returns the features (country_importance, population_fraction) of every location as an
+    (n_locations, 2) array, along with whether each location's country has an importance. The
+    features of countries and of locations whose country has no importance are NaN.
+    """
+    is_country = location_columns['resolution'] == ResolutionTypes.COUNTRY
+    country_ids = location_columns['id'][is_country]
+    country_populations = location_columns['population'][is_country]
+    country_importances = np.array(
+        [location_importances.get(id_, np.nan) for id_ in country_ids.tolist()], dtype=np.float64
+    )
 
-def get_data_sets(geo_locations_by_id, location_importances):
+    # The index of each location's country in the country columns, -1 if it is missing.
+    country_indexes = find_indexes(
+        country_ids, location_columns['country_id'], sorter=np.argsort(country_ids)
+    )
+    has_country = (country_indexes >= 0) & ~is_country
+    location_country_importances = np.full(len(is_country), np.nan)
+    location_country_importances[has_country] = country_importances[
+        country_indexes[has_country]
+    ]
+    has_country_importance = has_country & ~np.isnan(location_country_importances)
+
+    features = np.full((len(is_country), 2), np.nan)
+    features[has_country_importance, 0] = location_country_importances[has_country_importance]
+    features[has_country_importance, 1] = (
+        location_columns['population'][has_country_importance] /
+        country_populations[country_indexes[has_country_importance]]
+    )
+    return features, has_country_importance
+
+def get_data_sets(location_columns, location_importances):
     """
     Make data sets using Geonames locations (this includes the input features for each location
     and the importance labels for those of which we were able to find the match in OSM data)
     """
-    training_sets = {
-        # values are lists of ids, features, and labels
-        resolution: ([], [], [])
-        for resolution in (ResolutionTypes.CITY, ResolutionTypes.ADMIN_1, ResolutionTypes.ADMIN_2)
-    }
-    predict_sets = {
-        resolution: ([], [])
-        for resolution in (ResolutionTypes.CITY, ResolutionTypes.ADMIN_1, ResolutionTypes.ADMIN_2)
-    }
-    n_locs_missing_country_importance = dict((res, 0) for res in training_sets)
-
-    for id_, location in geo_locations_by_id.iteritems():
-        if location['resolution'] == ResolutionTypes.COUNTRY:
-            continue
-        if location['country_id'] not in location_importances:
-            n_locs_missing_country_importance[location['resolution']] += 1
-            continue
-        if location['population'] < MIN_POPULATION_THRESHOLD:
-            continue
-
-        country = geo_locations_by_id[location['country_id']]
-        country_importance = location_importances[country['id']]
-        population_fraction = float(location['population']) / country['population']
+    features, has_country_importance = get_features(location_columns, location_importances)
+    importances = np.array([
+        location_importances.get(id_, np.nan) for id_ in location_columns['id'].tolist()
+    ], dtype=np.float64)
+    has_importance = ~np.isnan(importances)
+    is_big_enough = location_columns['population'] >= MIN_POPULATION_THRESHOLD
+
+    training_sets = {}
+    predict_sets = {}
+    n_locs_missing_country_importance = {}
+    for resolution in (ResolutionTypes.CITY, ResolutionTypes.ADMIN_1, ResolutionTypes.ADMIN_2):
+        is_resolution = location_columns['resolution'] == resolution
+        n_locs_missing_country_importance[resolution] = int(
+            np.sum(is_resolution & ~has_country_importance)
+        )
 
-        if id_ in location_importances:
-            ids, features, labels = training_sets[location['resolution']]
-            ids.append(id_)
-            features.append([country_importance, population_fraction])
-            labels.append(location_importances[id_])
-        else:
-            ids, features = predict_sets[location['resolution']]
-            ids.append(id_)
-            features.append([country_importance, population_fraction])
+        usable = is_resolution & has_country_importance & is_big_enough
+        # values are arrays of ids, features, and labels
+        training = usable & has_importance
+        training_sets[resolution] = (
+            location_columns['id'][training], features[training], importances[training]
+        )
+        predict = usable & ~has_importance
+        predict_sets[resolution] = (location_columns['id'][predict], features[predict])
 
     print 'Locations missing country importance: ', n_locs_missing_country_importance
 
     return training_sets, predict_sets
 
-def train_models(training_sets, geo_locations_by_id, location_importances, show_plot):
+def train_models(
+    training_sets, geo_locations_by_id, location_importances, show_plot, n_trials=None
+):
     """
     Train a model for each resolution type. Print the training / test loss for some training / test
     splits to get an idea of how well the models perform, and then return the final models trained
-    on all of the data.
+    on all of the data. Pass n_trials=0 to skip the evaluation, which takes most of the time.
     """
     models = {}
 
@@ -451,8 +664,10 @@ def train_models(training_sets, geo_locations_by_id, location_importances, show_
 
         train_scores = []
         test_scores = []
-        n_trials = 300 if resolution == ResolutionTypes.CITY else 1000
-        for t in range(n_trials):
+        resolution_n_trials = n_trials
+        if resolution_n_trials is None:
+            resolution_n_trials = 300 if resolution == ResolutionTypes.CITY else 1000
+        for t in range(resolution_n_trials):
             X_train, X_test, Y_train, Y_test, weights_train, weights_test = train_test_split(
                 X, Y, weights, train_size=.9
             )
@@ -462,8 +677,9 @@ def train_models(training_sets, geo_locations_by_id, location_importances, show_
             train_scores.append(model.score(X_train, Y_train, sample_weight=weights_train))
             test_scores.append(model.score(X_test, Y_test, sample_weight=weights_test))
 
-        print 'Average R2 on training set: ', sum(train_scores) / n_trials
-        print 'Average R2 on test set: ', sum(test_scores) / n_trials
+        if resolution_n_trials:
+            print 'Average R2 on training set: ', sum(train_scores) / resolution_n_trials
+            print 'Average R2 on test set: ', sum(test_scores) / resolution_n_trials
 
         model = clone(MODELS_TYPES[resolution])
         model.fit(X, Y, sample_weight=weights)
@@ -471,7 +687,7 @@ def train_models(training_sets, geo_locations_by_id, location_importances, show_
 
         predicts = model.predict(X)
         weighted_errors = weights * (predicts - Y) ** 2
-        loc_errors = zip(training_ids, predicts, weighted_errors)
+        loc_errors = zip(training_ids.tolist(), predicts, weighted_errors)
         loc_errors.sort(key=lambda error: error[2], reverse=True)
         print 'Biggest errors:'
         for id_, prediction, weighted_error in loc_errors[:10]:
@@ -489,50 +705,49 @@ def train_models(training_sets, geo_locations_by_id, location_importances, show_
 
     return models
 
-def make_predictions(
-    models, training_sets, predict_sets, geo_locations_by_id, location_importances
-):
+def make_predictions(models, training_sets, predict_sets, location_columns, location_importances):
     """
     Make importance predictions for all Geonames locations (including those in the training set).
     For locations whose country does not have an importance score, we assign it a default
     importance.
     """
-    ids_with_features = set()
-    for data_sets in (training_sets, predict_sets):
-        for data_set in data_sets.itervalues():
-            ids_with_features.update(data_set[0])
+    ids = location_columns['id']
+    resolutions = location_columns['resolution']
+    ids_with_features = np.concatenate([
+        data_set[0] for data_sets in (training_sets, predict_sets)
+        for data_set in data_sets.itervalues()
+    ])
 
     predictions = {}
-    default_country_predictions = []
-    default_predictions = []
 
-    for id_, location in geo_locations_by_id.iteritems():
-        if location['resolution'] == ResolutionTypes.COUNTRY:
-            if id_ in location_importances:
-                predictions[id_] = location_importances[id_]
-            else:
-                predictions[id_] = DEFAULT_IMPORTANCE[ResolutionTypes.COUNTRY]
-                default_country_predictions.append(location)
-        else:
-            if id_ not in ids_with_features:
-                predictions[id_] = DEFAULT_IMPORTANCE[location['resolution']]
-                if location['population'] > MIN_POPULATION_THRESHOLD:
-                    default_predictions.append(location)
+    is_country = resolutions == ResolutionTypes.COUNTRY
+    country_ids = ids[is_country].tolist()
+    is_found_country = np.array([id_ in location_importances for id_ in country_ids], dtype=bool)
+    for id_ in country_ids:
+        predictions[id_] = location_importances.get(
+            id_, DEFAULT_IMPORTANCE[ResolutionTypes.COUNTRY]
+        )
+
+    is_default = ~is_country & ~np.in1d(ids, ids_with_features)
+    for resolution in (ResolutionTypes.CITY, ResolutionTypes.ADMIN_1, ResolutionTypes.ADMIN_2):
+        predictions.update(dict.fromkeys(
+            ids[is_default & (resolutions == resolution)].tolist(), DEFAULT_IMPORTANCE[resolution]
+        ))
 
     print '##########################'
-    print 'Default country predictions:', len(default_country_predictions)
-    print 'Default other predictions:', len(default_predictions)
+    print 'Default country predictions:', int(np.sum(~is_found_country))
+    print 'Default other predictions:', int(np.sum(
+        is_default & (location_columns['population'] > MIN_POPULATION_THRESHOLD)
+    ))
 
     for resolution, model in models.iteritems():
-        training_ids, training_features, training_labels = training_sets[resolution]
-        X = np.log(training_features)
-        training_predictions = model.predict(X)
-        predictions.update(dict(zip(training_ids, training_predictions)))
-
+        training_ids, training_features, _ = training_sets[resolution]
         predict_ids, predict_features = predict_sets[resolution]
-        X = np.log(predict_features)
-        predict_predictions = model.predict(X)
-        predictions.update(zip(predict_ids, predict_predictions))
+        # Predict for the training and the other locations in a single batch.
+        model_predictions = model.predict(np.log(np.vstack([training_features, predict_features])))
+        predictions.update(zip(
+            np.concatenate([training_ids, predict_ids]).tolist(), model_predictions.tolist()
+        ))
 
         print 'Num %s locations trained, only predicted: %d, %d' % (
             resolution, len(training_ids), len(predict_ids)
@@ -540,6 +755,40 @@ def make_predictions(
 
     return predictions
 
+def save_state(state_dir, models, location_columns, location_importances):
+    """
+    Saves what update_importances.py needs to re-estimate the importances of changed locations:
+    the trained models, the OSM importances of the matched locations, and the location and
+    feature columns.
+    """
+    if not os.path.isdir(state_dir):
+        os.makedirs(state_dir)
+
+    with open(os.path.join(state_dir, 'models.pkl'), 'wb') as models_file:
+        pickle.dump(models, models_file, pickle.HIGHEST_PROTOCOL)
+    with open(os.path.join(state_dir, 'osm_importances.json'), 'w') as importances_file:
+        json.dump(location_importances, importances_file)
+
+    features, _ = get_features(location_columns, location_importances)
+    np.savez(os.path.join(state_dir, 'columns.npz'), features=features, **location_columns)
+
+def load_state(state_dir):
+    """
+    Returns the models, location columns, feature columns and OSM importances saved by
+    save_state.
+    """
+    with open(os.path.join(state_dir, 'models.pkl'), 'rb') as models_file:
+        models = pickle.load(models_file)
+    with open(os.path.join(state_dir, 'osm_importances.json')) as importances_file:
+        # JSON keys are strings, but our ids are integers.
+        location_importances = {
+            int(id_): importance for id_, importance in json.load(importances_file).iteritems()
+        }
+
+    columns = dict(np.load(os.path.join(state_dir, 'columns.npz')))
+    features = columns.pop('features')
+    return models, columns, features, location_importances
+
 def print_diffs(importance_filepath_1, importance_filepath_2):
     """
     Use this method to print the top differences between two different files for estimated
@@ -560,10 +809,10 @@ def print_diffs(importance_filepath_1, importance_filepath_2):
         if abs(i1 - i2) < .1:
             break
 
-        if id_ not in locations_by_id:
+        if int(id_) not in locations_by_id:
             print id_
             continue
-        location = locations_by_id[id_]
+        location = locations_by_id[int(id_)]
         print location['resolution'], location['name'], location['country'], i1, i2
 
 if __name__ == '__main__':
@@ -571,10 +820,28 @@ if __name__ == '__main__':
     parser.add_argument('osm_filepath')
     parser.add_argument('output_filepath')
     parser.add_argument('--plot', action='store_true')
+    parser.add_argument(
+        '--processes', type=int, help='number of processes for matching (default: all CPUs)'
+    )
+    parser.add_argument(
+        '--compare-matching', action='store_true',
+        help='also run the unindexed matching, check that the results match and print the speedup'
+    )
+    parser.add_argument(
+        '--trials', type=int,
+        help='number of train / test splits to evaluate each model on (0 to skip evaluation)'
+    )
+    parser.add_argument(
+        '--state-dir',
+        help='save the models and features here, for updating with update_importances.py'
+    )
     args = parser.parse_args()
 
     try:
-        run(args.osm_filepath, args.output_filepath, args.plot)
+        run(
+            args.osm_filepath, args.output_filepath, args.plot, args.processes,
+            args.compare_matching, args.trials, args.state_dir
+        )
     except:
         type, value, tb = sys.exc_info()
         traceback.print_exc()
@@ -0,0 +1,12 @@
+import sys
+from geonamescache.geonames.columnar import write_columns
+from geonamescache.geonames.geonames import load_data
+
+
+def run(output_dir):
+    locations_by_name, locations_by_id = load_data()
+    write_columns(output_dir, locations_by_name, locations_by_id)
+
+
+if __name__ == '__main__':
+    run(sys.argv[1])
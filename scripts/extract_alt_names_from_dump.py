@@ -0,0 +1,316 @@
+import bz2
+import json
+import re
+from argparse import ArgumentParser
+from multiprocessing import cpu_count, Pool
+from StringIO import StringIO
+from xml.etree import cElementTree as ElementTree
+
+from geonamescache.geonames.geonames import load_data
+from lookup_alt_names_on_wiki import (
+    fix_name,
+    get_alt_names_found,
+    get_locations_to_search,
+    new_counts,
+    write_log,
+)
+
+"""
+Finds the same alternate names as lookup_alt_names_on_wiki.py, but from a local dump of the
+English wikipedia articles instead of the live site, e.g.
+
+    python scripts/extract_alt_names_from_dump.py enwiki-latest-pages-articles-multistream.xml.bz2 geonamescache/geonames/data/alt_wiki_names.json scripts/readable_wiki_names.tsv --index enwiki-latest-pages-articles-multistream-index.txt.bz2
+
+from https://dumps.wikimedia.org/enwiki/latest/. Redirects are pages of the dump too, so no
+separate redirect dump is needed.
+
+The dump is read twice: first to map the redirects of the searched titles to their targets, then
+to read the target pages. With the index of a multistream dump, whose bz2 streams of 100 pages can
+each be decompressed on their own, the streams are split between processes. Otherwise (or with a
+plain pages-articles dump) the dump is read by a single process.
+
+Alternate names are the names the live search would see on each page: its title, the targets of
+'(disambiguation)' links in its hatnotes and the names of its {{Redirect}} hatnotes ("X redirects
+here"). Disambiguation pages are skipped, as on the live site.
+"""
+
+# Streams per chunk of work of a process.
+STREAMS_PER_CHUNK = 100
+
+_DISAMBIGUATION_RE = re.compile(
+    r'\{\{\s*(?:disambiguation|disambig|dab|disamb|geodis|hndis|place name disambiguation)'
+    r'\s*[|}]',
+    re.IGNORECASE,
+)
+_REFERS_TO_RE = re.compile(r'refer[s]? to:')
+_HATNOTE_RE = re.compile(
+    r'\{\{\s*(redirect|redirect2|redirect-multi|about|other uses|for)\s*((?:\|[^{}]*)?)\}\}',
+    re.IGNORECASE,
+)
+
+# Titles searched (in the first pass) or read (in the second pass) by the worker processes.
+_TITLES = None
+
+
+def normalize_title(title):
+    """
+    Returns the title as it appears in the dump, as the live site would normalize it in a URL.
+    """
+    title = re.sub(r'[ _]+', ' ', title).strip()
+    return title[:1].upper() + title[1:]
+
+def get_query_titles(query):
+    """
+    Returns the titles that lookup_alt_names_on_wiki.search tries for the query, in order.
+    """
+    titles = [query]
+    if ' ' in query:
+        titles.append(query.replace(' ', '-'))
+    if '(' in query:
+        titles.append(query.split('(')[0].strip())
+    if ',' in query:
+        titles.append(query.split(',')[0].strip())
+    return [normalize_title(title) for title in titles]
+
+def get_page_info(title, text):
+    """
+    Returns None if the page is a disambiguation page, or else the names from its hatnotes.
+    """
+    if title.endswith('(disambiguation)') or _DISAMBIGUATION_RE.search(text):
+        return None
+
+    # Hatnotes and the first paragraph come before the first section.
+    lead = text.split('\n==', 1)[0]
+    first_paragraph = next((
+        line for line in lead.splitlines()
+        if line.strip() and not line.startswith(('{{', '|', '}}', '[[File:', '[[Image:'))
+    ), '')
+    if _REFERS_TO_RE.search(first_paragraph):
+        return None
+
+    hatnote_names = []
+    for template, args in _HATNOTE_RE.findall(lead):
+        args = [arg.strip() for arg in args.split('|')[1:]]
+        template = template.lower()
+        if template in ('redirect', 'redirect2') and args:
+            hatnote_names.append(args[0])
+            if template == 'redirect2' and len(args) > 1:
+                hatnote_names.append(args[1])
+        elif template == 'redirect-multi' and args and args[0].isdigit():
+            hatnote_names.extend(args[1:1 + int(args[0])])
+        elif template == 'other uses' and not args:
+            hatnote_names.append(title)
+        hatnote_names.extend(arg for arg in args if arg.endswith('(disambiguation)'))
+
+    return hatnote_names
+
+def get_alt_names(query, redirects, pages):
+    """
+    Returns the alternate names for the query, as lookup_alt_names_on_wiki.search does, given the
+    targets of the redirects by title and the page infos (from get_page_info) by title.
+    """
+    for title in get_query_titles(query):
+        title = redirects.get(title, title)
+        page_info = pages.get(title)
+        if page_info is None:
+            continue
+
+        alt_names = set(fix_name(name) for name in [title] + page_info)
+        alt_names.discard(fix_name(query))
+        return list(alt_names)
+
+def iter_pages(xml_file):
+    """
+    Yields the (title, redirect target or None, text) of each article in the XML file.
+    """
+    events = ElementTree.iterparse(xml_file, events=('start', 'end'))
+    _, root = next(events)
+    for event, element in events:
+        if event != 'end' or _local_name(element.tag) != 'page':
+            continue
+
+        fields = {}
+        for child in element.iter():
+            name = _local_name(child.tag)
+            if name == 'redirect':
+                fields[name] = child.get('title')
+            elif name in ('title', 'ns', 'text'):
+                fields[name] = child.text or u''
+        root.clear()
+
+        if fields.get('ns') == '0':
+            yield fields['title'], fields.get('redirect'), fields.get('text', u'')
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+def read_dump(dump_filepath, titles, find, index_filepath=None, n_processes=None):
+    """
+    Returns the merged results of find(pages, titles) over the pages of the dump.
+    """
+    global _TITLES
+
+    if not index_filepath:
+        with open(dump_filepath, 'rb') as dump_file:
+            return find(iter_pages(_BZ2StreamsFile(dump_file)), titles)
+
+    offsets = read_stream_offsets(index_filepath)
+    chunks = [
+        (dump_filepath, offsets[i], offsets[min(i + STREAMS_PER_CHUNK, len(offsets) - 1)], find)
+        for i in xrange(0, len(offsets) - 1, STREAMS_PER_CHUNK)
+    ]
+
+    # Workers get the titles when they are forked, instead of with every chunk.
+    _TITLES = titles
+    pool = Pool(n_processes or cpu_count())
+    try:
+        results = {}
+        for chunk_results in pool.imap_unordered(_read_chunk, chunks):
+            results.update(chunk_results)
+        return results
+    finally:
+        pool.terminate()
+        _TITLES = None
+
+def read_stream_offsets(index_filepath):
+    """
+    Returns the sorted byte offsets of the streams in a multistream dump, given its index of lines
+    '<offset>:<page id>:<title>', with the end of the dump as the last offset.
+    """
+    offsets = set()
+    for line in bz2.BZ2File(index_filepath):
+        offsets.add(int(line.split(':', 1)[0]))
+    # The last stream is read to the end of the file.
+    return sorted(offsets) + [None]
+
+def _decompress_streams(compressed_file, block_size=2 ** 20):
+    """
+    Yields the decompressed data of all the bz2 streams in the file, one after the other.
+    bz2.BZ2File stops at the end of the first stream, which in a multistream dump only has the
+    header of the dump.
+    """
+    decompressor = bz2.BZ2Decompressor()
+    for data in iter(lambda: compressed_file.read(block_size), ''):
+        while data:
+            try:
+                decompressed = decompressor.decompress(data)
+            except EOFError:
+                # The last stream ended exactly at the end of the previous block.
+                decompressor = bz2.BZ2Decompressor()
+                continue
+
+            if decompressed:
+                yield decompressed
+            data = decompressor.unused_data
+            if data:
+                decompressor = bz2.BZ2Decompressor()
+
+
+class _BZ2StreamsFile(object):
+
+    """
+    A file of the decompressed data of all the bz2 streams in a file, for iterparse.
+    """
+
+    def __init__(self, compressed_file):
+        self._blocks = _decompress_streams(compressed_file)
+        self._block = ''
+        # Offset of the unread data in the block.
+        self._offset = 0
+
+    def read(self, size=-1):
+        parts = []
+        while size != 0:
+            if self._offset == len(self._block):
+                self._block = next(self._blocks, None)
+                self._offset = 0
+                if self._block is None:
+                    self._block = ''
+                    break
+
+            end = len(self._block) if size < 0 else min(self._offset + size, len(self._block))
+            parts.append(self._block[self._offset:end])
+            if size > 0:
+                size -= end - self._offset
+            self._offset = end
+        return ''.join(parts)
+
+
+def _read_chunk(chunk):
+    dump_filepath, start, end, find = chunk
+    with open(dump_filepath, 'rb') as dump_file:
+        dump_file.seek(start)
+        data = dump_file.read() if end is None else dump_file.read(end - start)
+
+    xml = ''.join(_decompress_streams(StringIO(data)))
+
+    # Streams have whole pages, but the last one also closes the root element of the dump.
+    start = xml.find('<page>')
+    xml = xml[start:xml.rfind('</page>') + len('</page>')] if start >= 0 else ''
+    return find(iter_pages(StringIO('<pages>%s</pages>' % xml)), _TITLES)
+
+def find_redirects(pages, titles):
+    """
+    Returns the target of each redirect of the given titles.
+    """
+    return {
+        title: redirect.split('#')[0]
+        for title, redirect, _ in pages if redirect and title in titles
+    }
+
+def find_page_infos(pages, titles):
+    """
+    Returns the page info (see get_page_info) of each page of the given titles that is not a
+    redirect.
+    """
+    return {
+        title: get_page_info(title, text)
+        for title, redirect, text in pages if not redirect and title in titles
+    }
+
+def run(dump_filepath, out_filename, log_filename, index_filepath=None, n_processes=None):
+    locations_by_name, locations_by_id = load_data()
+
+    counts = new_counts()
+    locations_to_search = get_locations_to_search(locations_by_name, locations_by_id, counts)
+
+    query_titles = set(
+        title for name in locations_to_search for title in get_query_titles(name)
+    )
+    redirects = read_dump(dump_filepath, query_titles, find_redirects, index_filepath, n_processes)
+    print 'Redirects of searched titles:', len(redirects)
+
+    page_titles = set(redirects.get(title, title) for title in query_titles)
+    pages = read_dump(dump_filepath, page_titles, find_page_infos, index_filepath, n_processes)
+    pages = {title: info for title, info in pages.iteritems() if info is not None}
+    print 'Pages found:', len(pages)
+
+    results = {
+        name: get_alt_names(name, redirects, pages) for name in locations_to_search
+    }
+    alt_names_found = get_alt_names_found(
+        locations_to_search, results, locations_by_name, locations_by_id, counts
+    )
+    print counts, len(alt_names_found)
+
+    with open(out_filename, 'w') as out:
+        json.dump(alt_names_found, out)
+
+    if log_filename:
+        write_log(log_filename, alt_names_found, locations_by_id)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('dump_filepath', help='a pages-articles(-multistream) .xml.bz2 dump')
+    parser.add_argument('out_filename')
+    parser.add_argument('log_filename', nargs='?')
+    parser.add_argument(
+        '--index', help='the index of a multistream dump, to read the dump with many processes'
+    )
+    parser.add_argument(
+        '--processes', type=int, help='number of processes with --index (default: all CPUs)'
+    )
+    args = parser.parse_args()
+
+    run(args.dump_filepath, args.out_filename, args.log_filename, args.index, args.processes)
@@ -1,14 +1,21 @@
 # -*- coding: utf-8 -*-
+import hashlib
+import os
 import re
 import json
 import pdb
 import requests
 import sys
+import threading
 import traceback
+from argparse import ArgumentParser
 from collections import defaultdict
+from multiprocessing.pool import ThreadPool
 
+import lxml.html
 from bs4 import BeautifulSoup
 from bs4.element import NavigableString, CData, Comment
+from lxml import etree
 
 from geonamescache.geonames.utils import ResolutionTypes, standardize_loc_name
 from geonamescache.geonames.geonames import load_data
@@ -16,11 +23,22 @@ from geonamescache.geonames.geonames import load_data
 
 """
 Fetches alternate names from wikipedia for locations in the geonames data set.
+
+Pages are fetched by a pool of threads, each reusing the connections of its own requests session.
+With a cache directory, every fetched page is saved there and read from there on later runs, and
+with a checkpoint file, the search result of every name is appended to it as it is found, so that
+an interrupted run resumes where it stopped. To run offline, e.g. in tests, point --base-url at a
+local server, or fill the cache directory.
 """
 
 MIN_POPULATION_THRESHOLD = 10 ** 4
 MIN_AMBIG_IMPORTANCE_THRESHOLD = .5
 
+DEFAULT_BASE_URL = 'https://en.wikipedia.org/wiki/'
+DEFAULT_N_THREADS = 8
+# Responses that are final answers for a title: a page, or no such page.
+CACHED_STATUS_CODES = (200, 404)
+
 def text_attrs(base):
     """
     Yield `(text, attr)` pairs for all descendants of `base`.
@@ -97,22 +115,176 @@ def is_valid_wiki_page(soup):
 
     return True
 
-def get_wikipedia(search_term):
+
+class WikiFetcher(object):
+
+    """
+    Fetches wikipedia pages by title. It is safe to share between threads.
+    """
+
+    def __init__(self, base_url=DEFAULT_BASE_URL, cache_dir=None, timeout=10):
+        self._base_url = base_url
+        self._cache_dir = cache_dir
+        self._timeout = timeout
+        self._local = threading.local()
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def fetch(self, title):
+        """
+        Returns the HTML of the page with the given title (or of the error page, if there is no
+        such page), or None if the request failed. Only pages and 404 error pages are cached, so
+        that failed requests (including 429 and 5xx responses) are tried again.
+        """
+        cache_filepath = None
+        if self._cache_dir:
+            cache_filepath = os.path.join(
+                self._cache_dir, hashlib.sha1(title.encode('utf-8')).hexdigest() + '.html'
+            )
+            if os.path.isfile(cache_filepath):
+                with open(cache_filepath) as cache_file:
+                    return cache_file.read().decode('utf-8')
+
+        url = self._base_url + title.replace(' ', '_')
+        try:
+            response = self._get_session().get(url, timeout=self._timeout)
+        except requests.RequestException:
+            response = None
+
+        if response is None or response.status_code not in CACHED_STATUS_CODES:
+            print 'Warning: could not fetch results for ', title
+            self._local.n_failures = self.n_failures() + 1
+            return None
+
+        if cache_filepath:
+            # Write to a temporary file first, so that an interrupted run can't cache a partial
+            # page.
+            tmp_filepath = '%s.%d.tmp' % (cache_filepath, threading.current_thread().ident)
+            with open(tmp_filepath, 'w') as cache_file:
+                cache_file.write(response.text.encode('utf-8'))
+            os.rename(tmp_filepath, cache_filepath)
+
+        return response.text
+
+    def n_failures(self):
+        """
+        Returns the number of failed requests of the current thread.
+        """
+        return getattr(self._local, 'n_failures', 0)
+
+    def _get_session(self):
+        # Sessions are not documented as thread safe, so each thread has its own.
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.headers['User-agent'] = 'Mozilla/5.0'
+        return session
+
+
+_DEFAULT_FETCHER = WikiFetcher()
+
+def get_wikipedia(search_term, fetcher=_DEFAULT_FETCHER):
     """
     Get the alternate names from the wikipedia search term. Returns None if the request failed
     or if there was no real page found.
     """
+    html = fetcher.fetch(search_term)
+    if html is None:
+        return None
+
+    alt_names = extract_alt_names(html)
+    if alt_names is None:
+        return None
 
-    url = 'https://en.wikipedia.org/wiki/%s' % search_term.replace(' ', '_')
-    headers = {'User-agent': 'Mozilla/5.0'}
+    alt_names.discard(fix_name(search_term))
+    return list(alt_names)
 
+def extract_alt_names(html):
+    """
+    Returns the set of alternate names on a wikipedia page, or None if it is not a valid content
+    page. Only the nodes that are needed are read from the lxml tree, instead of building a
+    BeautifulSoup tree of the whole page as extract_alt_names_with_soup does; the result is the
+    same.
+    """
     try:
-        req = requests.get(url, headers=headers, timeout=10)
-    except requests.RequestException:
-        print 'Warning: could not fetch results for ', search_term
+        document = lxml.html.document_fromstring(html)
+    except etree.ParserError:
+        # The page is empty.
+        return None
+
+    first_heading = document.xpath('//h1[@id="firstHeading"]')
+    if not first_heading:
+        return None
+
+    page_name = first_heading[0].text_content()
+    if page_name == 'Search results':
+        return None
+
+    mw_content_text = document.xpath('//div[@id="mw-content-text"]')
+    if not mw_content_text:
+        return None
+
+    first_paragraph = None
+    for paragraph in mw_content_text[0].iterchildren('p'):
+        paragraph_text = []
+        for text, styles in _styled_text(paragraph, None):
+            style = css_style(styles or [])
+            if 'font-size' in style or style.get('display', '') == 'none':
+                continue
+
+            paragraph_text.append(text)
+
+        paragraph_text = ''.join(paragraph_text)
+        if paragraph_text:
+            first_paragraph = paragraph_text
+            break
+
+    if not first_paragraph or re.findall(r'refer[s]? to:', first_paragraph):
         return None
 
-    soup = BeautifulSoup(req.text, 'lxml')
+    alt_names = [page_name]
+    alt_names.extend(link.text_content() for link in document.xpath(_DISAMBIG_LINKS_XPATH))
+    for element in document.xpath(_HATNOTES_XPATH):
+        redirects_here_match = re.match(r'"(.*)" redirects here', element.text_content())
+        if redirects_here_match:
+            alt_names.append(redirects_here_match.groups()[0])
+
+    return set(fix_name(name) for name in alt_names)
+
+_HATNOTES_XPATH = '//*[contains(concat(" ", normalize-space(@class), " "), " hatnote ")]'
+_DISAMBIG_LINKS_XPATH = (
+    _HATNOTES_XPATH + '//a[contains(concat(" ", normalize-space(@class), " "), " mw-disambig ")]'
+)
+
+def _styled_text(element, styles):
+    """
+    Yields `(text, styles)` pairs for all text in `element`, where styles are the style attributes
+    of its ancestors, as text_attrs does. As in text_attrs, an element adds its style to the list
+    of its parent if the parent has one, so that it also applies to the text after it.
+    """
+    style = element.get('style')
+    if style is not None:
+        if styles is None:
+            styles = []
+        styles.append(style)
+
+    if element.text:
+        yield element.text, styles
+    for child in element:
+        if isinstance(child.tag, basestring):
+            for child_text in _styled_text(child, styles):
+                yield child_text
+        elif child.text:
+            # Comments are text too in BeautifulSoup.
+            yield child.text, styles
+        if child.tail:
+            yield child.tail, styles
+
+def extract_alt_names_with_soup(html):
+    """
+    Returns the same as extract_alt_names, using BeautifulSoup.
+    """
+    soup = BeautifulSoup(html, 'lxml')
     if not is_valid_wiki_page(soup):
         return None
 
@@ -130,30 +302,27 @@ def get_wikipedia(search_term):
         if redirects_here_match:
             alt_names.append(redirects_here_match.groups()[0])
 
-    alt_names = set(fix_name(name) for name in alt_names)
-    alt_names.discard(fix_name(search_term))
-
-    return list(alt_names)
+    return set(fix_name(name) for name in alt_names)
 
 def fix_name(name):
     name = name.split('(')[0].strip()
     name = name.split(',')[0].strip()
     return standardize_loc_name(name)
 
-def search(query):
-    result = get_wikipedia(query)
+def search(query, fetcher=_DEFAULT_FETCHER):
+    result = get_wikipedia(query, fetcher)
 
     if result is None:
         if ' ' in query:
-            result = get_wikipedia(query.replace(' ', '-'))
+            result = get_wikipedia(query.replace(' ', '-'), fetcher)
 
     if result is None:
         if '(' in query:
-            result = get_wikipedia(query.split('(')[0].strip())
+            result = get_wikipedia(query.split('(')[0].strip(), fetcher)
 
     if result is None:
         if ',' in query:
-            result = get_wikipedia(query.split(',')[0].strip())
+            result = get_wikipedia(query.split(',')[0].strip(), fetcher)
 
     return result
 
@@ -170,46 +339,132 @@ def get_adjusted_importance(location):
 
 BLACKLIST = set(['Jay Leno', 'Kiss'])
 
-def run(out_filename, log_filename):
+def select_location(name, locations_by_name, locations_by_id):
     """
-    Find the alternate names of locations in the geonames data set and write them to an output file.
+    Returns the location to search wikipedia for the given name for, or None if the name is too
+    ambiguous or its location is too small.
     """
-    locations_by_name, locations_by_id = load_data()
+    locations_with_name = [locations_by_id[id_] for id_ in locations_by_name[name]]
+    if len(locations_with_name) == 1:
+        candidate = locations_with_name[0]
+        if candidate['population'] > MIN_POPULATION_THRESHOLD:
+            return candidate
+        return None
 
-    alt_names_found = {}
-    counts = dict((kind, 0) for kind in (
-        'ambiguous name', 'no wiki page found', 'no alt names found', 'ambiguous alt name'
-    ))
-    hits = 0
+    locations_by_importance = sorted(
+        locations_with_name, key=lambda loc: get_adjusted_importance(loc),
+        reverse=True
+    )
+    top_importance = get_adjusted_importance(locations_by_importance[0])
+    next_importance = get_adjusted_importance(locations_by_importance[1])
+    if (
+        top_importance > MIN_AMBIG_IMPORTANCE_THRESHOLD and
+        top_importance - next_importance > .12
+    ):
+        candidate = locations_by_importance[0]
+        if candidate['population'] > MIN_POPULATION_THRESHOLD:
+            return candidate
+
+def filter_alt_names(alt_names, location, locations_by_name, locations_by_id):
+    """
+    Returns the alternate names found for the location that are not blacklisted, and that are not
+    already names of locations about as important as it.
+    """
+    importance = get_adjusted_importance(location)
+    good_alt_names = []
+
+    for alt_name in alt_names:
+        skip_name = alt_name.title() in BLACKLIST
+        for alt_id in locations_by_name.get(alt_name, ()):
+            alt_location = locations_by_id[alt_id]
+            if alt_location['id'] == location['id']:
+                continue
+            alt_importance = get_adjusted_importance(alt_location)
+            if alt_location['name'] == alt_name and alt_importance + .1 > importance:
+                skip_name = True
+                break
+            if alt_location['name'] != alt_name and alt_importance > importance + .1:
+                skip_name = True
+                break
 
-    for i, (name, locations_with_name) in enumerate(locations_by_name.iteritems()):
-        if i % 1000 == 0:
-            print 'Search number', i
-            print counts, hits
+        if not skip_name:
+            good_alt_names.append(alt_name)
 
-        if not locations_with_name:
-            continue
+    return good_alt_names
 
-        location = None
-        if len(locations_with_name) == 1:
-            candidate = locations_with_name.values()[0]
-            if candidate['population'] > MIN_POPULATION_THRESHOLD:
-                location = candidate
-        else:
-            locations_by_importance = sorted(
-                locations_with_name.values(), key=lambda loc: get_adjusted_importance(loc),
-                reverse=True
-            )
-            top_importance = get_adjusted_importance(locations_by_importance[0])
-            next_importance = get_adjusted_importance(locations_by_importance[1])
-            if (
-                top_importance > MIN_AMBIG_IMPORTANCE_THRESHOLD and
-                top_importance - next_importance > .12
-            ):
-                candidate = locations_by_importance[0]
-                if candidate['population'] > MIN_POPULATION_THRESHOLD:
-                    location = candidate
+def read_checkpoint(checkpoint_filepath):
+    """
+    Returns the search results by name saved in the checkpoint file, if it exists.
+    """
+    results = {}
+    if checkpoint_filepath and os.path.isfile(checkpoint_filepath):
+        with open(checkpoint_filepath) as checkpoint_file:
+            for line in checkpoint_file:
+                try:
+                    name, result = json.loads(line)
+                except ValueError:
+                    # The last line is cut off if the run was killed while writing it.
+                    continue
+                results[name] = result
+    return results
 
+def search_all(names, fetcher, n_threads=DEFAULT_N_THREADS, checkpoint_filepath=None):
+    """
+    Returns the search result of each name, searching with n_threads threads. Results are appended
+    to the checkpoint file as they are found, and names that already have a result there are not
+    searched again. Names for which a request failed have a None result, and are not added to the
+    checkpoint file so that they are searched again when the run is resumed.
+    """
+    results = read_checkpoint(checkpoint_filepath)
+    names_to_search = [name for name in names if name not in results]
+    print 'Names to search: %d (%d already searched)' % (
+        len(names_to_search), len(names) - len(names_to_search)
+    )
+
+    def search_name(name):
+        # Each thread searches one name at a time, so failures of its requests are this name's.
+        n_failures = fetcher.n_failures()
+        result = search(name, fetcher)
+        return name, result, fetcher.n_failures() > n_failures
+
+    n_failed = 0
+    checkpoint_file = open(checkpoint_filepath, 'a') if checkpoint_filepath else None
+    pool = ThreadPool(n_threads)
+    try:
+        for i, (name, result, failed) in enumerate(
+            pool.imap_unordered(search_name, names_to_search)
+        ):
+            if i % 1000 == 0:
+                print 'Search number', i
+            if failed:
+                # A fallback title may have been found only because the first request failed.
+                n_failed += 1
+                results[name] = None
+                continue
+
+            results[name] = result
+            if checkpoint_file:
+                checkpoint_file.write(json.dumps([name, result]) + '\n')
+                checkpoint_file.flush()
+    finally:
+        pool.terminate()
+        if checkpoint_file:
+            checkpoint_file.close()
+
+    if n_failed:
+        print 'Searches with failed requests: %d (run again to retry them)' % n_failed
+    return results
+
+def get_locations_to_search(locations_by_name, locations_by_id, counts):
+    """
+    Returns the locations to search wikipedia for by name, counting the skipped names.
+    """
+    locations_to_search = {}
+    for name, ids_with_name in locations_by_name.iteritems():
+        if not ids_with_name:
+            continue
+
+        location = select_location(name, locations_by_name, locations_by_id)
         if not location:
             counts['ambiguous name'] += 1
             continue
@@ -218,7 +473,18 @@ def run(out_filename, log_filename):
             # only search for location's real name
             continue
 
-        result = search(name)
+        locations_to_search[name] = location
+
+    return locations_to_search
+
+def get_alt_names_found(locations_to_search, results, locations_by_name, locations_by_id, counts):
+    """
+    Returns the good alternate names of each location by id, given the search results by name,
+    counting the locations without any.
+    """
+    alt_names_found = {}
+    for name, location in locations_to_search.iteritems():
+        result = results[name]
         if result is None:
             counts['no wiki page found'] += 1
             continue
@@ -227,36 +493,49 @@ def run(out_filename, log_filename):
             counts['no alt names found'] += 1
             continue
 
-        importance = get_adjusted_importance(location)
-        good_alt_names = []
-
-        for alt_name in result:
-            skip_name = alt_name.title() in BLACKLIST
-            locations_with_alt_name = locations_by_name.get(alt_name, {})
-            for alt_location in locations_with_alt_name.itervalues():
-                if alt_location['id'] == location['id']:
-                    continue
-                alt_importance = get_adjusted_importance(alt_location)
-                if alt_location['name'] == alt_name and alt_importance + .1 > importance:
-                    skip_name = True
-                    break
-                if alt_location['name'] != alt_name and alt_importance > importance + .1:
-                    skip_name = True
-                    break
-
-            if not skip_name:
-                good_alt_names.append(alt_name)
-
+        good_alt_names = filter_alt_names(result, location, locations_by_name, locations_by_id)
         if not good_alt_names:
             counts['ambiguous alt name'] += 1
             continue
 
-        hits += 1
         alt_names_found[location['id']] = good_alt_names
 
+    return alt_names_found
+
+def new_counts():
+    return dict((kind, 0) for kind in (
+        'ambiguous name', 'no wiki page found', 'no alt names found', 'ambiguous alt name'
+    ))
+
+def run(
+    out_filename, log_filename, n_threads=DEFAULT_N_THREADS, cache_dir=None,
+    checkpoint_filepath=None, base_url=DEFAULT_BASE_URL
+):
+    """
+    Find the alternate names of locations in the geonames data set and write them to an output file.
+    """
+    locations_by_name, locations_by_id = load_data()
+
+    counts = new_counts()
+    locations_to_search = get_locations_to_search(locations_by_name, locations_by_id, counts)
+
+    fetcher = WikiFetcher(base_url, cache_dir)
+    results = search_all(sorted(locations_to_search), fetcher, n_threads, checkpoint_filepath)
+
+    alt_names_found = get_alt_names_found(
+        locations_to_search, results, locations_by_name, locations_by_id, counts
+    )
+    print counts, len(alt_names_found)
+
     with open(out_filename, 'w') as out:
         json.dump(alt_names_found, out)
 
+    write_log(log_filename, alt_names_found, locations_by_id)
+
+def write_log(log_filename, alt_names_found, locations_by_id):
+    """
+    Writes the alternate names found in a readable TSV file, most populated locations first.
+    """
     with open(log_filename, 'w') as out:
         out.write('\t'.join(('Resolution', 'Name', 'Country', 'Population', 'Alt names')) + '\n')
 
@@ -295,7 +574,7 @@ def print_extra(alt_names1, alt_names2, locations_by_id):
     for id_, alt_names in alt_names1.iteritems():
         extra_names = [name for name in alt_names if name not in alt_names2.get(id_, [])]
         if extra_names:
-            loc = locations_by_id[id_]
+            loc = locations_by_id[int(id_)]
             extras.append((
                 loc['resolution'], loc['name'], loc['country'], str(loc['population']),
                 extra_names
@@ -307,8 +586,24 @@ def print_extra(alt_names1, alt_names2, locations_by_id):
         print extra
 
 if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('out_filename')
+    parser.add_argument('log_filename')
+    parser.add_argument('--threads', type=int, default=DEFAULT_N_THREADS)
+    parser.add_argument('--cache-dir', help='save fetched pages here, and reuse the saved ones')
+    parser.add_argument(
+        '--checkpoint', help='save search results here as they are found, and resume from them'
+    )
+    parser.add_argument(
+        '--base-url', default=DEFAULT_BASE_URL, help='fetch pages from here instead of wikipedia'
+    )
+    args = parser.parse_args()
+
     try:
-        run(sys.argv[1], sys.argv[2])
+        run(
+            args.out_filename, args.log_filename, args.threads, args.cache_dir, args.checkpoint,
+            args.base_url
+        )
     except:
         type, value, tb = sys.exc_info()
         traceback.print_exc()
@@ -0,0 +1,140 @@
+import json
+import os
+from argparse import ArgumentParser
+
+import numpy as np
+
+import geonamescache.geonames.geonames as geonames
+from create_single_json import run as write_single_json
+from estimate_importances import (
+    DEFAULT_IMPORTANCE,
+    MIN_POPULATION_THRESHOLD,
+    get_features,
+    get_location_columns,
+    load_state,
+    save_state,
+)
+from geonamescache.geonames.columnar import find_indexes
+from geonamescache.geonames.utils import ResolutionTypes
+
+"""
+Updates the estimated importances after a Geonames data update, without matching the OSM data or
+training the models again. Only the importances of locations that are new, or whose resolution or
+features (country importance and population fraction) changed, are predicted again, using the
+models saved by
+
+    python scripts/estimate_importances.py ... --state-dir STATE_DIR
+
+The other importances are kept, and those of deleted locations are removed. Run from the root
+geonamescache directory, e.g.
+
+    python scripts/update_importances.py STATE_DIR geonamescache/geonames/data/estimated_importance.json --snapshot geonamescache/geonames/data/geonames_all.json
+
+Retrain with estimate_importances.py when the OSM data changes, or when many locations changed.
+"""
+
+
+def run(state_dir, importance_filepath, snapshot_filepath=None):
+    models, old_columns, old_features, location_importances = load_state(state_dir)
+    # The importance file does not have the new locations yet, so it can't be loaded with them.
+    location_columns = get_location_columns(geonames.iter_locations())
+    features, has_country_importance = get_features(location_columns, location_importances)
+
+    is_changed = find_changed_locations(old_columns, old_features, location_columns, features)
+    predictions = predict_importances(
+        models, location_columns, features, has_country_importance, location_importances,
+        is_changed
+    )
+
+    with open(importance_filepath) as importance_file:
+        importances = json.load(importance_file)
+    ids = set(str(id_) for id_ in location_columns['id'].tolist())
+    removed_ids = [id_ for id_ in importances if id_ not in ids]
+    for id_ in removed_ids:
+        del importances[id_]
+    n_added = sum(1 for id_ in predictions if str(id_) not in importances)
+    # JSON keys are strings, so that ints would otherwise be written twice.
+    importances.update((str(id_), importance) for id_, importance in predictions.iteritems())
+
+    print 'Changed locations: %d (%d new)' % (len(predictions), n_added)
+    print 'Removed locations: %d' % len(removed_ids)
+
+    # Write a new file and rename it, so that the importance file is never half-written.
+    tmp_filepath = importance_filepath + '.tmp'
+    with open(tmp_filepath, 'w') as out:
+        json.dump(importances, out)
+    os.rename(tmp_filepath, importance_filepath)
+
+    save_state(state_dir, models, location_columns, location_importances)
+
+    if snapshot_filepath:
+        geonames._DATA_FILES['estimated_importance'] = importance_filepath
+        write_single_json(snapshot_filepath)
+
+def find_changed_locations(old_columns, old_features, location_columns, features):
+    """
+    Returns whether each location is new, or has a different resolution or different features
+    than in the saved columns.
+    """
+    old_indexes = find_indexes(
+        old_columns['id'], location_columns['id'], sorter=np.argsort(old_columns['id'])
+    )
+    is_changed = old_indexes < 0
+    is_old = ~is_changed
+    old_indexes = old_indexes[is_old]
+    old_location_features = old_features[old_indexes]
+    location_features = features[is_old]
+    # NaN features (of countries and of locations whose country has no importance) are equal.
+    is_same_feature = (
+        (old_location_features == location_features) |
+        (np.isnan(old_location_features) & np.isnan(location_features))
+    )
+    is_changed[is_old] = (
+        (old_columns['resolution'][old_indexes] != location_columns['resolution'][is_old]) |
+        ~is_same_feature.all(axis=1)
+    )
+    return is_changed
+
+def predict_importances(
+    models, location_columns, features, has_country_importance, location_importances, is_changed
+):
+    """
+    Returns the importances of the changed locations, predicted as in
+    estimate_importances.make_predictions.
+    """
+    ids = location_columns['id']
+    resolutions = location_columns['resolution']
+    is_big_enough = location_columns['population'] >= MIN_POPULATION_THRESHOLD
+
+    predictions = {}
+    for resolution in (
+        ResolutionTypes.CITY, ResolutionTypes.ADMIN_1, ResolutionTypes.ADMIN_2,
+        ResolutionTypes.COUNTRY,
+    ):
+        is_resolution = is_changed & (resolutions == resolution)
+        if resolution == ResolutionTypes.COUNTRY:
+            for id_ in ids[is_resolution].tolist():
+                predictions[id_] = location_importances.get(id_, DEFAULT_IMPORTANCE[resolution])
+            continue
+
+        usable = is_resolution & has_country_importance & is_big_enough
+        predictions.update(dict.fromkeys(
+            ids[is_resolution & ~usable].tolist(), DEFAULT_IMPORTANCE[resolution]
+        ))
+        if usable.any():
+            predictions.update(zip(
+                ids[usable].tolist(),
+                models[resolution].predict(np.log(features[usable])).tolist(),
+            ))
+
+    return predictions
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('state_dir', help='the --state-dir of estimate_importances.py')
+    parser.add_argument('importance_filepath', help='the importance file to update')
+    parser.add_argument('--snapshot', help='also write the single JSON file of the data here')
+    args = parser.parse_args()
+
+    run(args.state_dir, args.importance_filepath, args.snapshot)
@@ -0,0 +1,35 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+import geonamescache.geonames.data_source as data_source_module
+
+_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Lets tests import the scripts, as the scripts import each other.
+sys.path.insert(0, os.path.join(_ROOT_DIR, 'scripts'))
+
+
+@pytest.fixture
+def shards_dir(monkeypatch):
+    """
+    Returns an empty directory that DataSource(countries=...) reads shards from, for tests to
+    write shards to with snapshot.write_shards.
+    """
+    directory = tempfile.mkdtemp()
+    monkeypatch.setattr(data_source_module, '_SHARDS_DIR', directory)
+    monkeypatch.setattr(data_source_module, '_SHARDS', {})
+    yield directory
+    shutil.rmtree(directory)
+
+@pytest.fixture
+def directory():
+    """
+    Returns an empty temporary directory, removed after the test.
+    """
+    directory = tempfile.mkdtemp()
+    yield directory
+    shutil.rmtree(directory)
@@ -0,0 +1,43 @@
+from geonamescache.geonames.spatial import get_box_area
+from geonamescache.geonames.utils import ResolutionTypes
+
+"""
+Location records in the format of geonames.load_data, for tests.
+"""
+
+
+def country(id_, name, country_code, neighbor_country_ids=(), population=1000, box=None):
+    location = {
+        'id': id_, 'resolution': ResolutionTypes.COUNTRY, 'name': name,
+        'country_code': country_code, 'country': name, 'country_id': id_,
+        'population': population, 'neighbor_country_ids': list(neighbor_country_ids),
+    }
+    return _with_box(location, box)
+
+def admin_1(id_, name, country, population=0, box=None):
+    location = {
+        'id': id_, 'resolution': ResolutionTypes.ADMIN_1, 'name': name,
+        'country_code': country['country_code'], 'country': country['name'],
+        'country_id': country['id'], 'population': population,
+    }
+    return _with_box(location, box)
+
+def city(id_, name, country, population=100, admin_1=None, latitude=None, longitude=None):
+    return {
+        'id': id_, 'resolution': ResolutionTypes.CITY, 'name': name,
+        'country_code': country['country_code'], 'country': country['name'],
+        'country_id': country['id'], 'admin_level_1': admin_1['name'] if admin_1 else None,
+        'admin_level_1_id': admin_1['id'] if admin_1 else None, 'admin_level_2': None,
+        'admin_level_2_id': None, 'population': population, 'latitude': latitude,
+        'longitude': longitude,
+    }
+
+def _with_box(location, box):
+    # Countries and admins with a box are at its center.
+    if box is not None:
+        south, west, north, east = box
+        location.update(
+            latitude=(south + north) / 2., longitude=(west + east) / 2., bounding_box=box,
+            bounding_box_area=get_box_area(*box),
+        )
+    return location
@@ -0,0 +1,38 @@
+from geonamescache.geonames.async_data_source import AsyncDataSource
+from geonamescache.geonames.data_source import DataSource
+from geonamescache.geonames.utils import ResolutionTypes
+
+
+def test_async_data_source():
+    data_source = DataSource()
+    async_data_source = AsyncDataSource(data_source, max_workers=2, inline_batch_size=2)
+
+    # single lookups run inline
+    japans = async_data_source.search('japan', ResolutionTypes.COUNTRY)
+    assert japans.done()
+    assert japans.result() == data_source.country_search('japan')
+
+    japan_id = japans.result().keys()[0]
+    japan = async_data_source.get_location_by_id(japan_id)
+    assert japan.done()
+    assert japan.result()['resolution'] == ResolutionTypes.COUNTRY
+    tokyo_id = data_source.city_search('tokyo').keys()[0]
+    distance = async_data_source.distance(japan_id, tokyo_id)
+    assert distance.done()
+    assert distance.result() == data_source.distance(japan_id, tokyo_id)
+
+    # small and large batches
+    names = ['japan', 'lebanon']
+    assert async_data_source.bulk_search(names).result() == data_source.bulk_search(names)
+    names = ['japan', 'lebanon', 'san francisco', 'bad location']
+    results = async_data_source.bulk_search(names).result()
+    assert results == data_source.bulk_search(names)
+    assert not results['bad location']
+
+    async_data_source.close()
+
+def test_async_data_source_load():
+    async_data_source = AsyncDataSource()
+    assert isinstance(async_data_source.load().result(), DataSource)
+    assert async_data_source.search('lebanon').result()
+    async_data_source.close()
@@ -0,0 +1,109 @@
+import os
+
+import pytest
+
+import build
+from build import get_stages_to_run, run
+
+
+def _copy(input_path, output_path):
+    # A trivial command that copies a file, run as `python -c`.
+    return ['-c', "open('%s', 'w').write(open('%s').read())" % (output_path, input_path)]
+
+_STAGES = [
+    dict(name='a', command=_copy('in.txt', 'a.txt'), inputs=['in.txt'], outputs=['a.txt']),
+    dict(name='b', command=_copy('a.txt', 'b.txt'), inputs=['a.txt'], outputs=['b.txt']),
+    dict(
+        name='fail', command=['-c', 'import sys; sys.exit(1)'], inputs=['in.txt'],
+        outputs=['fail.txt'],
+    ),
+    dict(
+        name='after_fail', command=_copy('fail.txt', 'c.txt'), inputs=['fail.txt'],
+        outputs=['c.txt'],
+    ),
+    dict(
+        name='manual', command=_copy('b.txt', 'm.txt'), inputs=['b.txt'], outputs=['m.txt'],
+        manual=True,
+    ),
+]
+
+@pytest.fixture
+def stages(directory, monkeypatch):
+    monkeypatch.setattr(build, 'STAGES', _STAGES)
+    monkeypatch.setattr(build, 'ROOT_DIR', directory)
+    for filename, contents in (('in.txt', 'input'), ('fail.txt', 'old output')):
+        with open(os.path.join(directory, filename), 'w') as output:
+            output.write(contents)
+    return directory
+
+def _read(directory, filename):
+    with open(os.path.join(directory, filename)) as input_file:
+        return input_file.read()
+
+def _stage_results(output):
+    # The stage names at the start of the printed lines, with the rest of the lines.
+    return dict(line[1:].split('] ', 1) for line in output.splitlines())
+
+def test_get_stages_to_run(stages):
+    def names(stage_names=None):
+        return [
+            (stage['name'], sorted(dependencies))
+            for stage, dependencies in get_stages_to_run(stage_names)
+        ]
+
+    assert names() == [('a', []), ('b', ['a']), ('fail', []), ('after_fail', ['fail'])]
+    assert names(['b']) == [('a', []), ('b', ['a'])]
+    assert names(['manual', 'fail']) == [('a', []), ('b', ['a']), ('fail', []), ('manual', ['b'])]
+    with pytest.raises(ValueError):
+        names(['unknown'])
+
+def test_run(stages, capsys):
+    build_dir = os.path.join(stages, '.build')
+    assert not run(build_dir=build_dir, n_jobs=2)
+    results = _stage_results(capsys.readouterr()[0])
+    assert sorted(results) == ['a', 'after_fail', 'b', 'fail']
+    assert results['a'].startswith('done') and results['b'].startswith('done')
+    assert results['fail'].startswith('failed (CalledProcessError')
+    assert results['after_fail'].startswith('not run')
+    assert _read(stages, 'b.txt') == 'input'
+    # The failed stage's old output is put back.
+    assert _read(stages, 'fail.txt') == 'old output'
+    assert not os.path.exists(os.path.join(stages, 'c.txt'))
+
+    assert run(['b'], build_dir=build_dir)
+    results = _stage_results(capsys.readouterr()[0])
+    assert results == {'a': 'up to date', 'b': 'up to date'}
+
+    # A changed input runs the stages that depend on it again.
+    with open(os.path.join(stages, 'in.txt'), 'w') as output:
+        output.write('new input')
+    assert run(['b'], build_dir=build_dir)
+    results = _stage_results(capsys.readouterr()[0])
+    assert results['a'].startswith('done') and results['b'].startswith('done')
+    assert _read(stages, 'b.txt') == 'new input'
+
+def test_unreadable_stamp(stages, capsys):
+    build_dir = os.path.join(stages, '.build')
+    assert run(['b'], build_dir=build_dir)
+    for stamp in ('{"key": ', '[]', '{}'):
+        with open(os.path.join(build_dir, 'a.stamp.json'), 'w') as stamp_file:
+            stamp_file.write(stamp)
+        capsys.readouterr()
+        assert run(['b'], build_dir=build_dir)
+        results = _stage_results(capsys.readouterr()[0])
+        assert results['a'].startswith('done')
+        assert results['b'] == 'up to date'
+
+def test_unexpected_error(stages, capsys, monkeypatch):
+    def run_command(stage, command, build_dir):
+        raise RuntimeError('unexpected')
+
+    monkeypatch.setattr(build, '_run_command', run_command)
+    assert not run(['manual'], build_dir=os.path.join(stages, '.build'))
+    assert _stage_results(capsys.readouterr()[0]) == {
+        'a': 'failed (RuntimeError: unexpected), see %s' % os.path.join(
+            stages, '.build', 'a.log'
+        ),
+        'b': 'not run, since a stage it depends on failed',
+        'manual': 'not run, since a stage it depends on failed',
+    }
@@ -0,0 +1,52 @@
+import math
+import shutil
+import tempfile
+
+import numpy as np
+
+from geonamescache.geonames.columnar import read_columns, RESOLUTIONS, write_columns
+from geonamescache.geonames.utils import ResolutionTypes
+
+
+def test_columnar_round_trip():
+    locations_by_id = {
+        2: {
+            'id': 2, 'resolution': ResolutionTypes.COUNTRY, 'name': u'Japan', 'country_id': 2,
+            'population': 127000000, 'estimated_importance': .9,
+        },
+        10: {
+            'id': 10, 'resolution': ResolutionTypes.CITY, 'name': u'T\u014dky\u014d',
+            'country_id': 2, 'admin_level_1_id': 5, 'admin_level_2_id': None,
+            'population': 8000000, 'latitude': 35.7, 'longitude': 139.7,
+        },
+    }
+    locations_by_name = {u'Japan': [2], u'T\u014dky\u014d': [10], u'Tokyo': [10]}
+
+    directory = tempfile.mkdtemp()
+    try:
+        write_columns(directory, locations_by_name, locations_by_id)
+        for mmap in (False, True):
+            tables = read_columns(directory, mmap=mmap)
+            locations = tables['locations']
+            assert list(locations['id']) == [2, 10]
+            assert locations['id'].dtype == np.int64
+            assert [RESOLUTIONS[code] for code in locations['resolution']] == [
+                ResolutionTypes.COUNTRY, ResolutionTypes.CITY
+            ]
+            assert list(locations['name'].to_numpy()) == [u'Japan', u'T\u014dky\u014d']
+            assert list(locations['admin_level_1_id']) == [0, 5]
+            assert list(locations['admin_level_2_id']) == [0, 0]
+            assert list(locations['population']) == [127000000, 8000000]
+            assert locations['estimated_importance'][0] == .9
+            assert math.isnan(locations['estimated_importance'][1])
+            assert math.isnan(locations['latitude'][0])
+            assert locations['longitude'][1] == 139.7
+
+            aliases = tables['aliases']
+            assert len(aliases['name']) == 3
+            assert [aliases['name'][i] for i in xrange(3)] == [
+                u'Japan', u'Tokyo', u'T\u014dky\u014d'
+            ]
+            assert list(aliases['location_id']) == [2, 10, 10]
+    finally:
+        shutil.rmtree(directory)
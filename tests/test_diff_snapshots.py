@@ -0,0 +1,115 @@
+import json
+import os
+
+import pytest
+
+from diff_snapshots import diff_snapshots, is_different, run
+from geonamescache.geonames.snapshot import write_snapshot
+from geonamescache.geonames.utils import ResolutionTypes
+from location_factories import city, country
+
+
+def _snapshots(directory):
+    france = dict(country(1, u'France', u'FR'), estimated_importance=.8)
+    spain = dict(country(2, u'Spain', u'ES'), estimated_importance=.8)
+    paris = dict(city(10, u'Paris', france), estimated_importance=.5)
+    lyon = dict(city(11, u'Lyon', france), estimated_importance=.45)
+    nice = dict(city(12, u'Nice', france), estimated_importance=.45)
+
+    old_filepath = os.path.join(directory, 'old.json')
+    write_snapshot(
+        old_filepath,
+        {u'France': [1], u'Paris': [10], u'Paname': [10], u'Lyon': [11], u'Nice': [12]},
+        {1: france, 10: paris, 11: lyon, 12: nice},
+    )
+    # Paris grows and gets more important, Nice is removed, Spain and Madrid are added, and an
+    # alias of Paris is replaced.
+    new_filepath = os.path.join(directory, 'new.json')
+    write_snapshot(
+        new_filepath,
+        {
+            u'France': [1], u'Spain': [2], u'Paris': [10], u'Ville Lumiere': [10], u'Lyon': [11],
+            u'Madrid': [20],
+        },
+        {
+            1: france, 2: spain, 10: dict(paris, population=200, estimated_importance=.7),
+            11: lyon, 20: dict(city(20, u'Madrid', spain), estimated_importance=.6),
+        },
+    )
+    return old_filepath, new_filepath
+
+def _diff(old_filepath, new_filepath, n_examples=10):
+    with open(old_filepath) as old_file, open(new_filepath) as new_file:
+        return diff_snapshots(old_file, new_file, n_examples)
+
+def test_diff_snapshots(directory):
+    old_filepath, new_filepath = _snapshots(directory)
+    report = _diff(old_filepath, new_filepath)
+
+    locations = report['locations']
+    assert (locations['n_added'], locations['n_removed'], locations['n_changed']) == (2, 1, 1)
+    assert [location['id'] for location in locations['added']] == [2, 20]
+    assert locations['removed'] == [
+        {'id': 12, 'name': u'Nice', 'resolution': ResolutionTypes.CITY, 'country_code': u'FR'},
+    ]
+    assert locations['changed'][0]['fields'] == ['estimated_importance', 'population']
+    assert locations['changed_fields'] == {'estimated_importance': 1, 'population': 1}
+    importance = locations['importance']
+    assert importance['n_changed'] == 1
+    assert abs(importance['mean_abs_delta'] - .2) < 1e-9
+    assert [(delta['id'], delta['name']) for delta in importance['largest_deltas']] == [
+        (10, u'Paris'),
+    ]
+    assert abs(importance['largest_deltas'][0]['delta'] - .2) < 1e-9
+
+    assert report['names'] == {
+        'n_added': 3, 'n_removed': 2,
+        'added': [
+            {'name': u'Madrid', 'id': 20}, {'name': u'Spain', 'id': 2},
+            {'name': u'Ville Lumiere', 'id': 10},
+        ],
+        'removed': [{'name': u'Nice', 'id': 12}, {'name': u'Paname', 'id': 10}],
+    }
+    assert is_different(report)
+
+    # Examples are limited, but not counts.
+    report = _diff(old_filepath, new_filepath, n_examples=1)
+    assert len(report['locations']['added']) == 1
+    assert len(report['names']['added']) == 1
+    assert report['names']['n_added'] == 3
+
+def test_same_snapshots(directory):
+    old_filepath, _ = _snapshots(directory)
+    report = _diff(old_filepath, old_filepath)
+    assert report['locations']['n_changed'] == 0
+    assert not is_different(report)
+
+    # Sections that are empty in both snapshots are reported too.
+    empty_filepath = os.path.join(directory, 'empty.json')
+    write_snapshot(empty_filepath, {}, {})
+    report = _diff(empty_filepath, empty_filepath)
+    assert sorted(report) == ['locations', 'names']
+    assert (report['locations']['n_added'], report['names']['n_added']) == (0, 0)
+    assert not is_different(report)
+
+def test_unsorted_snapshot(directory):
+    old_filepath, new_filepath = _snapshots(directory)
+    with open(new_filepath) as new_file:
+        lines = new_file.readlines()
+    # Swap the lines of France and Spain.
+    lines[2], lines[3] = lines[3], lines[2]
+    with open(new_filepath, 'w') as new_file:
+        new_file.writelines(lines)
+
+    with pytest.raises(ValueError):
+        _diff(old_filepath, new_filepath)
+
+def test_run(directory, capsys):
+    old_filepath, new_filepath = _snapshots(directory)
+    assert run(old_filepath, new_filepath) == 0
+    assert run(old_filepath, new_filepath, exit_code=True) == 1
+    assert run(old_filepath, old_filepath, exit_code=True) == 0
+    capsys.readouterr()
+
+    assert run(old_filepath, new_filepath, as_json=True) == 0
+    assert json.loads(capsys.readouterr()[0]) == _diff(old_filepath, new_filepath)
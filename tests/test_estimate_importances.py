@@ -0,0 +1,170 @@
+import math
+
+import numpy as np
+
+from estimate_importances import (
+    _match_locations_naive,
+    get_data_sets,
+    get_features,
+    get_location_columns,
+    make_predictions,
+    match_locations,
+)
+from geonamescache.geonames.utils import ResolutionTypes
+from location_factories import admin_1, city, country
+
+
+class _SumModel(object):
+
+    """
+    Predicts the sum of the (log) features, so that predictions are easy to compute by hand.
+    """
+
+    def predict(self, X):
+        return X.sum(axis=1)
+
+
+def _locations():
+    france = country(1, u'France', u'FR', population=100000)
+    # Spain has no importance.
+    spain = country(2, u'Spain', u'ES', population=200000)
+    # The country of Atlantis is missing.
+    atlantis = country(3, u'Atlantis', u'AT')
+    return [
+        france, spain,
+        city(10, u'Paris', france, population=20000),
+        # Below MIN_POPULATION_THRESHOLD
+        city(11, u'Lyon', france, population=1000),
+        city(20, u'Madrid', spain, population=50000),
+        city(30, u'Poseidonis', atlantis, population=10000),
+        admin_1(40, u'Ile-de-France', france, population=50000),
+        {
+            'id': 50, 'resolution': ResolutionTypes.ADMIN_2, 'country_id': 1,
+            'population': 30000,
+        },
+    ]
+
+def test_get_features():
+    location_importances = {1: .7, 10: .65}
+    location_columns = get_location_columns(_locations())
+    features, has_country_importance = get_features(location_columns, location_importances)
+
+    nan = float('nan')
+    np.testing.assert_array_equal(features, [
+        [nan, nan], [nan, nan], [.7, .2], [.7, .01], [nan, nan], [nan, nan], [.7, .5], [.7, .3],
+    ])
+    assert has_country_importance.tolist() == [
+        False, False, True, True, False, False, True, True,
+    ]
+
+    # Without any country among the locations
+    features, has_country_importance = get_features(
+        get_location_columns(_locations()[5:6]), location_importances
+    )
+    np.testing.assert_array_equal(features, [[nan, nan]])
+    assert has_country_importance.tolist() == [False]
+
+def test_make_predictions():
+    location_importances = {1: .7, 10: .65}
+    location_columns = get_location_columns(_locations())
+    training_sets, predict_sets = get_data_sets(location_columns, location_importances)
+    assert {
+        resolution: data_set[0].tolist() for resolution, data_set in training_sets.iteritems()
+    } == {ResolutionTypes.CITY: [10], ResolutionTypes.ADMIN_1: [], ResolutionTypes.ADMIN_2: []}
+    assert {
+        resolution: data_set[0].tolist() for resolution, data_set in predict_sets.iteritems()
+    } == {ResolutionTypes.CITY: [], ResolutionTypes.ADMIN_1: [40], ResolutionTypes.ADMIN_2: [50]}
+    assert training_sets[ResolutionTypes.CITY][2].tolist() == [.65]
+
+    models = dict.fromkeys(
+        (ResolutionTypes.CITY, ResolutionTypes.ADMIN_1, ResolutionTypes.ADMIN_2), _SumModel()
+    )
+    predictions = make_predictions(
+        models, training_sets, predict_sets, location_columns, location_importances
+    )
+    expected = {
+        1: .7, 2: .6, 11: .4, 20: .4, 30: .4,
+        10: math.log(.7) + math.log(.2),
+        40: math.log(.7) + math.log(.5),
+        50: math.log(.7) + math.log(.3),
+    }
+    assert sorted(predictions) == sorted(expected)
+    for id_, prediction in expected.iteritems():
+        assert abs(predictions[id_] - prediction) < 1e-12
+
+def _geo_location(id_, name, resolution, country_code, population):
+    return {
+        'id': id_, 'name': name, 'resolution': resolution, 'country_code': country_code,
+        'population': population,
+    }
+
+def _osm_location(resolution, country_code, importance):
+    return {'resolution': resolution, 'country_code': country_code, 'importance': importance}
+
+def test_match_locations():
+    CITY = ResolutionTypes.CITY
+    ADMIN_1 = ResolutionTypes.ADMIN_1
+    COUNTRY = ResolutionTypes.COUNTRY
+    geo_locations = [
+        _geo_location(1, u'France', COUNTRY, u'FR', 60000000),
+        _geo_location(2, u'Atlantis', COUNTRY, u'AT', 1000),
+        _geo_location(3, u'Georgia', COUNTRY, u'GE', 4000000),
+        _geo_location(4, u'Georgia', ADMIN_1, u'US', 10000000),
+        _geo_location(10, u'Paris', CITY, u'FR', 2000000),
+        _geo_location(11, u'Paris', CITY, u'US', 25000),
+        _geo_location(12, u'Paris', ADMIN_1, u'FR', 2000000),
+        # Too close in population to tell apart
+        _geo_location(20, u'Springfield', CITY, u'US', 150000),
+        _geo_location(21, u'Springfield', CITY, u'US', 120000),
+        _geo_location(30, u'Lyon', CITY, u'FR', 500000),
+        _geo_location(40, u'Nowhere', CITY, u'FR', 10000),
+        _geo_location(50, u'Hamlet', CITY, u'FR', 100),
+        _geo_location(60, u'Dummyville', CITY, u'FR', 10000),
+    ]
+    geo_locations_by_id = {location['id']: location for location in geo_locations}
+    geo_locations_by_name = {}
+    for location in geo_locations:
+        geo_locations_by_name.setdefault(location['name'], []).append(location['id'])
+    # An alias, which is only matched by the location's own name
+    geo_locations_by_name[u'Paname'] = [10]
+
+    osm_locations_by_name = {
+        u'Paris': [
+            _osm_location(CITY, u'US', .6),
+            _osm_location(CITY, u'FR', .9),
+            # Ties with the city, in another resolution
+            _osm_location(ADMIN_1, u'FR', .9),
+        ],
+        u'Paname': [_osm_location(CITY, u'FR', .7)],
+        u'Georgia': [_osm_location(ADMIN_1, u'US', .7), _osm_location(COUNTRY, u'GE', .75)],
+        u'Springfield': [_osm_location(CITY, u'US', .6)],
+        u'Lyon': [
+            # Too close in importance to tell apart, while the US one is in another country
+            _osm_location(CITY, u'FR', .7),
+            _osm_location(CITY, u'FR', .65),
+            _osm_location(CITY, u'US', .8),
+        ],
+        u'Dummyville': [_osm_location(CITY, u'FR', .45)],
+    }
+    osm_countries = {
+        u'FR': _osm_location(COUNTRY, u'FR', .8), u'GE': _osm_location(COUNTRY, u'GE', .75),
+    }
+
+    naive_results = _match_locations_naive(
+        osm_locations_by_name, osm_countries, geo_locations_by_name, geo_locations_by_id
+    )
+    for n_processes in (1, 2):
+        assert match_locations(
+            osm_locations_by_name, osm_countries, geo_locations_by_name, geo_locations_by_id,
+            n_processes
+        ) == naive_results
+
+    location_importances, counts = naive_results
+    assert location_importances == {1: .8, 3: .75, 4: .7, 10: .9, 12: .9}
+    assert counts == {
+        'Unresolved geoname locations': set([11, 20, 21]),
+        'Small location': set([50]),
+        'Unresolved osm locations': set([2, 30, 40]),
+        'Dummy osm importance': set([60]),
+        'Found match': set([1, 3, 4, 10, 12]),
+    }
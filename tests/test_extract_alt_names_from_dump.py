@@ -0,0 +1,72 @@
+import bz2
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from extract_alt_names_from_dump import (
+    find_page_infos,
+    find_redirects,
+    get_alt_names,
+    read_dump,
+)
+
+
+def _page(title, text=u'', redirect=None, ns=0):
+    redirect = u'<redirect title="%s" />' % redirect if redirect else u''
+    return (
+        u'<page><title>%s</title><ns>%d</ns>%s<revision><text>%s</text></revision></page>\n' % (
+            title, ns, redirect, text
+        )
+    )
+
+# Each list is a stream of the dump, of whole pages as in a multistream dump.
+_STREAMS = [
+    [u'<mediawiki><siteinfo><sitename>Wikipedia</sitename></siteinfo>\n'],
+    [
+        _page(u'Paris', u'{{Redirect|City of Light}}\nParis is the capital of France.'),
+        _page(u'Paname', redirect=u'Paris'),
+        _page(u'Talk:Paris', u'Talk', ns=1),
+    ],
+    [
+        _page(u'Springfield', u'{{disambiguation}}'),
+        _page(u'Lyon', u'Lyon is a city.\n== History =='),
+        u'</mediawiki>\n',
+    ],
+]
+
+@pytest.fixture
+def dump():
+    directory = tempfile.mkdtemp()
+    dump_filepath = os.path.join(directory, 'pages-articles-multistream.xml.bz2')
+    index_filepath = os.path.join(directory, 'pages-articles-multistream-index.txt.bz2')
+
+    index_lines = []
+    with open(dump_filepath, 'wb') as dump_file:
+        for i, stream in enumerate(_STREAMS):
+            offset = dump_file.tell()
+            dump_file.write(bz2.compress(u''.join(stream).encode('utf-8')))
+            if i > 0:
+                index_lines.extend(
+                    '%d:%d:page\n' % (offset, i * 100 + j) for j in range(len(stream))
+                )
+    with open(index_filepath, 'wb') as index_file:
+        index_file.write(bz2.compress(''.join(index_lines)))
+
+    yield dump_filepath, index_filepath
+    shutil.rmtree(directory)
+
+def test_read_dump(dump):
+    dump_filepath, index_filepath = dump
+    titles = set([u'Paris', u'Paname', u'Lyon', u'Springfield', u'Talk:Paris'])
+    for index in (None, index_filepath):
+        redirects = read_dump(dump_filepath, titles, find_redirects, index, n_processes=2)
+        assert redirects == {u'Paname': u'Paris'}
+
+        pages = read_dump(dump_filepath, titles, find_page_infos, index, n_processes=2)
+        assert pages == {u'Paris': [u'City of Light'], u'Lyon': [], u'Springfield': None}
+
+    pages = {title: info for title, info in pages.iteritems() if info is not None}
+    assert sorted(get_alt_names(u'Paname', redirects, pages)) == [u'City Of Light', u'Paris']
+    assert get_alt_names(u'Springfield', redirects, pages) is None
@@ -1,10 +1,20 @@
+import copy
+
+import pytest
+
 from geonamescache.geonames.data_source import DataSource
-from geonamescache.geonames.geonames import load_data
+from geonamescache.geonames.geonames import iter_locations, load_data
+from geonamescache.geonames.snapshot import write_shards
+from geonamescache.geonames.spatial import longitude_in_box
 from geonamescache.geonames.utils import (
+    AliasRules,
+    BloomFilter,
     get_alt_punc_names,
+    LRUCache,
     ResolutionTypes,
     standardize_loc_name,
 )
+from location_factories import city, country
 
 
 def test_data_source():
@@ -58,6 +68,79 @@ def _test_data_source_search(data_source):
     japan = data_source.get_location_by_id(japans.values()[0]['id'])
     assert japan
     assert japan['resolution'] == ResolutionTypes.COUNTRY
+    assert data_source.get_location_by_id(str(japan['id'])) == japan
+    assert data_source.get_location_by_id('bad id') is None
+
+def test_data_source_cache():
+    data_source = DataSource(cache_size=2)
+    uncached_data_source = DataSource()
+    assert uncached_data_source.cache_info() is None
+
+    for name in ('san francisco', 'San Francisco', 'japan', 'san francisco', 'lebanon'):
+        assert (
+            data_source.all_locations_search(name) ==
+            uncached_data_source.all_locations_search(name)
+        )
+    assert data_source.city_search('lebanon') == uncached_data_source.city_search('lebanon')
+    assert data_source.cache_info() == {
+        'hits': 2, 'misses': 4, 'evictions': 2, 'size': 2, 'max_size': 2,
+    }
+
+def test_cached_results_are_read_only(shards_dir):
+    france = country(1, u'France', u'FR', box=[43.3, -1.55, 48.86, 7.26])
+    paris = city(10, u'Paris', france)
+    write_shards(shards_dir, {u'France': [1], u'Paris': [10]}, {1: france, 10: paris})
+    data_source = DataSource(countries=['FR'], cache_size=2)
+
+    results = data_source.all_locations_search('france')
+    for modify in (
+        lambda: results.pop(1),
+        lambda: results[1].update(name=u'Changed'),
+        lambda: results[1]['bounding_box'].append(0.),
+    ):
+        with pytest.raises(TypeError):
+            modify()
+
+    # A shallow copy can be changed, but not its lists.
+    location = results[1].copy()
+    location['name'] = u'Changed'
+    with pytest.raises(TypeError):
+        location['bounding_box'].append(0.)
+    location = copy.deepcopy(results[1])
+    location['name'] = u'Changed'
+    location['bounding_box'].append(0.)
+    location['neighbor_country_ids'].append(2)
+    assert type(location) is dict and type(location['bounding_box']) is list
+    assert data_source.all_locations_search('france') == {1: france}
+    assert data_source.cache_info()['hits'] == 1
+
+def test_data_source_prefilter():
+    data_source = DataSource(prefilter_error_rate=.01)
+    unfiltered_data_source = DataSource()
+
+    for name in (
+        'san francisco', 'SAN FRANCISCO', 'japan', 'US', 'usa', u'S\xe3o Paulo', 'Sao Paulo',
+        'bad location', 'of the',
+    ):
+        assert (
+            data_source.all_locations_search(name) ==
+            unfiltered_data_source.all_locations_search(name)
+        )
+    assert data_source.might_contain('SAN FRANCISCO')
+    assert data_source.might_contain(u'S\xe3o Paulo')
+    assert unfiltered_data_source.might_contain('japan')
+    assert not unfiltered_data_source.might_contain('bad location')
+
+def test_shared_strings():
+    # Repeated strings should be stored once, rather than once per location.
+    for locations_by_id in (DataSource()._locations_by_id, load_data()[1]):
+        us_locations = [
+            loc for loc in locations_by_id.itervalues() if loc['country_code'] == 'US'
+        ]
+        assert len(us_locations) > 1000
+        assert len(set(id(loc['country']) for loc in us_locations)) == 1
+        assert len(set(id(loc['country_code']) for loc in us_locations)) == 1
+        assert len(set(id(loc['resolution']) for loc in us_locations)) == 4
 
 def test_geonames_data_format():
     locations_by_name, locations_by_id = load_data()
@@ -74,9 +157,12 @@ def _test_data_format(locations_by_id):
         elif location['resolution'] == ResolutionTypes.CITY:
             _test_city_fields(location, locations_by_id)
 
+        if location['resolution'] != ResolutionTypes.CITY:
+            _test_region_fields(location)
+
 def _test_mandatory_fields(location, locations_by_id):
     # id
-    assert isinstance(location['id'], basestring)
+    assert isinstance(location['id'], int)
     # resolution
     assert location['resolution'] in (
         ResolutionTypes.CITY, ResolutionTypes.ADMIN_1, ResolutionTypes.ADMIN_2,
@@ -104,6 +190,19 @@ def _test_country_fields(country):
     # neighbor_country_ids
     assert isinstance(country['neighbor_country_ids'], list)
 
+def _test_region_fields(region):
+    # bounding_box, bounding_box_area, latitude and longitude
+    if region['bounding_box'] is None:
+        assert region['latitude'] is None and region['longitude'] is None
+        assert region['bounding_box_area'] is None
+    else:
+        south, west, north, east = region['bounding_box']
+        assert south <= region['latitude'] <= north
+        # The circular mean of longitudes is in their smallest interval if it is below 180 degrees.
+        if (east - west) % 360 < 180:
+            assert longitude_in_box(region['longitude'], west, east)
+        assert region['bounding_box_area'] >= 0
+
 def _test_admin_2_fields(admin_2, locations_by_id):
     # admin_level_1
     assert isinstance(admin_2['admin_level_1'], basestring)
@@ -136,11 +235,41 @@ def test_geonames_data_numbers():
     locations_by_name, locations_by_id = load_data()
     _test_data_numbers(locations_by_name, locations_by_id)
 
+def test_iter_locations():
+    locations_by_name, locations_by_id = load_data()
+    resolution_order = [
+        ResolutionTypes.COUNTRY, ResolutionTypes.ADMIN_1, ResolutionTypes.ADMIN_2,
+        ResolutionTypes.CITY,
+    ]
+
+    resolutions = []
+    n_locations = 0
+    for location in iter_locations():
+        expected = dict(locations_by_id[location['id']])
+        expected.pop('estimated_importance', None)
+        assert location == expected
+        resolutions.append(resolution_order.index(location['resolution']))
+        n_locations += 1
+    assert n_locations == len(locations_by_id)
+    assert resolutions == sorted(resolutions)
+
+    big_admins = list(iter_locations(ResolutionTypes.ADMIN_1, min_population=10 ** 6))
+    assert big_admins
+    assert len(big_admins) == len([
+        loc for loc in locations_by_id.itervalues()
+        if loc['resolution'] == ResolutionTypes.ADMIN_1 and loc['population'] >= 10 ** 6
+    ])
+
 def _test_data_numbers(locations_by_name, locations_by_id):
     _test_populations(locations_by_id)
-    _test_basic_alternate_names(locations_by_name)
+    _test_basic_alternate_names(locations_by_name, locations_by_id)
     _test_basic_estimated_importances(locations_by_name, locations_by_id)
 
+def _locations_with_name(locations_by_name, locations_by_id, name):
+    return [
+        locations_by_id[id_] for id_ in locations_by_name.get(standardize_loc_name(name), ())
+    ]
+
 def _test_populations(locations_by_id):
     n_big_locations = len(
         [loc for loc in locations_by_id.itervalues() if loc['population'] > 10 ** 6]
@@ -172,7 +301,7 @@ def _check_subpopulation(locations_by_id, sublocation, parent_id_fields):
             else:
                 assert parent['population'] >= sublocation['population']
 
-def _test_basic_alternate_names(locations_by_name):
+def _test_basic_alternate_names(locations_by_name, locations_by_id):
     for name, alt_names, country, resolution in (
         # hardcoded alternate names
         (
@@ -208,7 +337,7 @@ def _test_basic_alternate_names(locations_by_name):
     ):
         for alt_name in alt_names:
             matching_locations = [
-                loc for loc in locations_by_name[standardize_loc_name(alt_name)].itervalues()
+                loc for loc in _locations_with_name(locations_by_name, locations_by_id, alt_name)
                 if (
                     loc['name'] == name and
                     loc['country'] == country and
@@ -251,7 +380,7 @@ def _test_basic_estimated_importances(locations_by_name, location_by_id):
         ('New Jersey', 'United States', ResolutionTypes.ADMIN_1, .6),
     ):
         matching_locations = [
-            loc for loc in locations_by_name[standardize_loc_name(name)].itervalues()
+            loc for loc in _locations_with_name(locations_by_name, location_by_id, name)
             if (
                 loc['name'] == name and
                 loc['country'] == country and
@@ -292,3 +421,39 @@ def test_alt_punc_names():
     assert 'Hey' in get_alt_punc_names('Hey (there)')
     assert 'Hey' in get_alt_punc_names('Hey, there')
 
+    # no repeats, empty names or the name itself
+    assert get_alt_punc_names('Japan') == []
+    assert get_alt_punc_names('(there)') == []
+    alt_names = get_alt_punc_names("St Mary's-Hill (Town)")
+    assert len(alt_names) == len(set(alt_names))
+
+def test_alias_rules():
+    rules = AliasRules()
+    rules.add_prefix_rule('Fort ', 'Ft. ')
+    rules.add_word_rule('Mount', 'Mt.')
+    assert rules.alt_names('Fort Worth') == ['Ft. Worth']
+    assert rules.alt_names('fort worth') == ['Ft. worth']
+    assert rules.alt_names('Mount Vernon') == ['Mt. Vernon']
+    assert rules.alt_names('Lake Mount Pleasant') == ['Lake Mt. Pleasant']
+    assert rules.alt_names('Mountain View') == []
+
+def test_lru_cache():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    # 'b' was the least recently used
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.info() == {'hits': 3, 'misses': 1, 'evictions': 1, 'size': 2, 'max_size': 2}
+
+def test_bloom_filter():
+    bloom_filter = BloomFilter(1000, error_rate=.01)
+    for i in xrange(1000):
+        bloom_filter.add('name %d' % i)
+
+    assert all('name %d' % i in bloom_filter for i in xrange(1000))
+    n_false_positives = sum('other name %d' % i in bloom_filter for i in xrange(10000))
+    assert n_false_positives < 300
@@ -0,0 +1,113 @@
+import json
+import os
+import threading
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from collections import defaultdict
+
+import pytest
+
+from lookup_alt_names_on_wiki import read_checkpoint, search_all, WikiFetcher
+
+
+def _page(title, hatnote=''):
+    return (
+        u'<html><body><h1 id="firstHeading">%s</h1><div class="hatnote">%s</div>'
+        u'<div id="mw-content-text"><p>%s is a city.</p></div></body></html>' % (
+            title, hatnote, title
+        )
+    )
+
+_MISSING_PAGE = u'<html><body><h1 id="firstHeading">Search results</h1></body></html>'
+
+
+class _WikiServer(HTTPServer):
+
+    """
+    Serves the pages by title, counting the requests for each title. Titles in `failures` get a
+    503 response that many times before their page.
+    """
+
+    def __init__(self, pages, failures):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), _WikiHandler)
+        self.pages = pages
+        self.failures = failures
+        self.n_requests = defaultdict(int)
+
+
+class _WikiHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        title = self.path[len('/wiki/'):]
+        self.server.n_requests[title] += 1
+        if self.server.failures.get(title):
+            self.server.failures[title] -= 1
+            status, body = 503, u'Service unavailable'
+        elif title in self.server.pages:
+            status, body = 200, self.server.pages[title]
+        else:
+            status, body = 404, _MISSING_PAGE
+
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def wiki_server():
+    server = _WikiServer(
+        pages={
+            'Paris': _page(u'Paris', u'"City of Light" redirects here.'),
+            'Lyon': _page(u'Lyon'),
+        },
+        failures={'Lyon': 1},
+    )
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def _fetcher(server, cache_dir):
+    return WikiFetcher(
+        base_url='http://127.0.0.1:%d/wiki/' % server.server_address[1], cache_dir=cache_dir
+    )
+
+def test_search_all(wiki_server, directory):
+    cache_dir = os.path.join(directory, 'cache')
+    checkpoint_filepath = os.path.join(directory, 'checkpoint.jsonl')
+    names = ['Paris', 'Lyon', 'Nowhere']
+
+    results = search_all(names, _fetcher(wiki_server, cache_dir), 2, checkpoint_filepath)
+    assert results == {'Paris': ['City Of Light'], 'Lyon': None, 'Nowhere': None}
+    # The failed search is not checkpointed, so that a resumed run tries it again.
+    assert read_checkpoint(checkpoint_filepath) == {'Paris': ['City Of Light'], 'Nowhere': None}
+
+    results = search_all(names, _fetcher(wiki_server, cache_dir), 2, checkpoint_filepath)
+    assert results == {'Paris': ['City Of Light'], 'Lyon': [], 'Nowhere': None}
+    assert wiki_server.n_requests == {'Paris': 1, 'Lyon': 2, 'Nowhere': 1}
+    with open(checkpoint_filepath) as checkpoint_file:
+        checkpointed_names = [json.loads(line)[0] for line in checkpoint_file]
+    # The first run checkpoints its searches in the order they finish.
+    assert sorted(checkpointed_names[:2]) == ['Nowhere', 'Paris']
+    assert checkpointed_names[2:] == ['Lyon']
+
+def test_fetcher_cache(wiki_server, directory):
+    fetcher = _fetcher(wiki_server, directory)
+    assert fetcher.fetch('Lyon') is None
+    assert fetcher.n_failures() == 1
+    assert fetcher.fetch('Lyon') == _page(u'Lyon')
+    assert fetcher.fetch('Nowhere') == _MISSING_PAGE
+
+    # Pages and missing pages are cached, failed requests are not.
+    cached_fetcher = _fetcher(wiki_server, directory)
+    assert cached_fetcher.fetch('Lyon') == _page(u'Lyon')
+    assert cached_fetcher.fetch('Nowhere') == _MISSING_PAGE
+    assert wiki_server.n_requests == {'Lyon': 2, 'Nowhere': 1}
+    assert len(os.listdir(directory)) == 2
@@ -0,0 +1,90 @@
+import os
+import tempfile
+import threading
+
+import pytest
+
+from geonamescache.geonames.data_source import DataSource
+from geonamescache.geonames.lookup_client import DataSourceClient, LookupServerError
+from geonamescache.geonames.lookup_server import (
+    JSON_CODEC,
+    LookupServer,
+    MSGPACK_CODEC,
+    UnixLookupServer,
+)
+
+
+def _serve(server):
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+def test_lookup_server():
+    data_source = DataSource()
+    server = LookupServer(('127.0.0.1', 0), data_source)
+    _serve(server)
+
+    try:
+        for codec in (MSGPACK_CODEC, JSON_CODEC):
+            client = DataSourceClient(server.server_address, max_connections=2, codec=codec)
+            _test_client(client, data_source)
+            client.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_unix_lookup_server():
+    data_source = DataSource()
+    socket_path = os.path.join(tempfile.mkdtemp(), 'lookup.sock')
+    server = UnixLookupServer(socket_path, data_source)
+    _serve(server)
+
+    try:
+        client = DataSourceClient(socket_path)
+        _test_client(client, data_source)
+        client.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def _test_client(client, data_source):
+    assert client.city_search('san francisco') == data_source.city_search('san francisco')
+    assert client.country_search('japan') == data_source.country_search('japan')
+    assert not client.all_locations_search('bad location')
+
+    names = ['lebanon', 'washington', 'bad location']
+    assert client.bulk_search(names) == data_source.bulk_search(names)
+
+    japan_id = data_source.country_search('japan').keys()[0]
+    assert client.get_location_by_id(japan_id) == data_source.get_location_by_id(japan_id)
+    assert client.get_location_by_id('bad id') is None
+
+    box = (35, 139, 36, 140)
+    assert client.locations_in_box(*box) == data_source.locations_in_box(*box)
+    assert client.reverse_geocode(35.68, 139.69) == data_source.reverse_geocode(35.68, 139.69)
+    tokyo_id = data_source.city_search('tokyo').keys()[0]
+    assert client.distance(japan_id, tokyo_id) == data_source.distance(japan_id, tokyo_id)
+    assert client.distance(str(japan_id), 'bad id') is None
+
+    # connections are reused from many threads
+    results = []
+    errors = []
+
+    def search():
+        try:
+            results.append(client.country_search('japan'))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=search) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    assert len(results) == 10
+    assert all(result == data_source.country_search('japan') for result in results)
+
+    with pytest.raises(LookupServerError):
+        client._call('_name_search', 'japan')
@@ -0,0 +1,79 @@
+from geonamescache.geonames.data_source import DataSource
+from geonamescache.geonames.metrics import current_rss_bytes, LoadProfiler, Metrics
+from geonamescache.geonames.utils import ResolutionTypes
+
+
+def test_metrics():
+    metrics = Metrics(buckets=(.1, 1.))
+    metrics.increment('requests_total', result='hit')
+    metrics.increment('requests_total', 2, result='hit')
+    metrics.increment('requests_total', result='miss')
+    metrics.observe('latency_seconds', .05)
+    metrics.observe('latency_seconds', .5)
+    metrics.observe('latency_seconds', 5.)
+
+    result = metrics.to_dict()
+    assert sorted(
+        (sample['labels']['result'], sample['value'])
+        for sample in result['counters']['requests_total']
+    ) == [('hit', 3.), ('miss', 1.)]
+    latency = result['histograms']['latency_seconds'][0]
+    assert latency['buckets'] == [(.1, 1), (1., 2), (float('inf'), 3)]
+    assert latency['count'] == 3
+    assert abs(latency['sum'] - 5.55) < 1e-9
+
+    lines = metrics.to_prometheus().splitlines()
+    assert '# TYPE requests_total counter' in lines
+    assert 'requests_total{result="hit"} 3.0' in lines
+    assert '# TYPE latency_seconds histogram' in lines
+    assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in lines
+    assert 'latency_seconds_count 3' in lines
+
+def test_data_source_metrics():
+    metrics = Metrics()
+    data_source = DataSource(metrics=metrics)
+    data_source.city_search('san francisco')
+    data_source.city_search('japan')
+    data_source.all_locations_search('bad location')
+
+    lookups = dict(
+        ((sample['labels']['resolution'], sample['labels']['result']), sample['value'])
+        for sample in metrics.to_dict()['counters']['geonames_lookups_total']
+    )
+    assert lookups == {
+        (ResolutionTypes.CITY, 'hit'): 1,
+        (ResolutionTypes.CITY, 'empty'): 1,
+        ('ALL', 'miss'): 1,
+    }
+
+    histograms = metrics.to_dict()['histograms']
+    assert histograms['geonames_standardize_seconds'][0]['count'] == 3
+    assert sum(sample['count'] for sample in histograms['geonames_search_seconds']) == 3
+
+    # without metrics, nothing is instrumented
+    assert DataSource()._name_search.__func__ is DataSource._name_search.__func__
+
+def test_load_profiler():
+    profiler = LoadProfiler()
+    with profiler.phase('country') as stats:
+        stats['rows_processed'] += 2
+        stats['aliases'] += 1
+    with profiler.phase('city') as stats:
+        stats['rows_processed'] += 3
+        stats['rows_skipped_feature_code'] += 1
+
+    report = profiler.report()
+    assert [phase['phase'] for phase in report['phases']] == ['country', 'city']
+    country, city = report['phases']
+    assert country['rows_processed'] == 2
+    assert country['aliases'] == 1
+    assert country['rows_skipped_feature_code'] == 0
+    assert city['rows_skipped_feature_code'] == 1
+    assert report['seconds'] == country['seconds'] + city['seconds']
+    assert all(isinstance(phase['memory_delta_mb'], float) for phase in report['phases'])
+
+def test_current_rss_bytes():
+    rss_bytes = current_rss_bytes()
+    assert isinstance(rss_bytes, (int, long))
+    assert rss_bytes > 2 ** 20
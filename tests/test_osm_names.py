@@ -0,0 +1,61 @@
+import json
+import os
+import shutil
+import tempfile
+
+import pytest
+
+import geonamescache.osm_names.osm_names as osm_names
+from geonamescache.osm_names.utils import ResolutionTypes
+
+_KEYS = [
+    'osm_id', 'name', 'alternative_names', 'osm_type', 'class', 'type', 'lon', 'lat',
+    'place_rank', 'importance', 'street', 'city', 'county', 'state', 'country', 'country_code',
+    'display_name', 'west', 'south', 'east', 'north', 'wikidata', 'wikipedia',
+]
+
+def _row(id_, name, importance, city='', county='', state='', country=u'France'):
+    return dict(
+        osm_id=id_, name=name, lon=2., lat=48., importance=importance, city=city, county=county,
+        state=state, country=country, country_code='fr',
+    )
+
+@pytest.fixture
+def data_dir(monkeypatch):
+    # In order of decreasing importance, as in the OSM data.
+    rows = [
+        _row(4, u'Paris', .8, city=u'Paris', county=u'Paris', state=u'Ile-de-France'),
+        _row(3, u'Paris', .6, county=u'Paris', state=u'Ile-de-France'),
+        _row(1, u'France', .5),
+        _row(2, u'Ile-de-France', .4, state=u'Ile-de-France'),
+    ]
+    directory = tempfile.mkdtemp()
+    with open(os.path.join(directory, 'osm_data.tsv'), 'w') as osm_file:
+        osm_file.write('\t'.join(_KEYS) + '\n')
+        for row in rows:
+            osm_file.write('\t'.join(unicode(row.get(key, '')) for key in _KEYS) + '\n')
+    with open(os.path.join(directory, 'countries.json'), 'w') as countries_file:
+        json.dump([], countries_file)
+
+    monkeypatch.setattr(osm_names, '_DATA_DIR', directory)
+    yield directory
+    shutil.rmtree(directory)
+
+def _parent_ids(location):
+    return (
+        location['country_id'], location.get('admin_level_1_id'), location.get('admin_level_2_id')
+    )
+
+def test_iter_locations_min_importance(data_dir):
+    all_locations = {location['id']: location for location in osm_names.iter_locations()}
+    assert sorted(all_locations) == [1, 2, 3, 4]
+    assert _parent_ids(all_locations[4]) == (1, 2, 3)
+
+    # The country and admins of the city are below the minimum importance.
+    locations = list(osm_names.iter_locations(min_importance=.7))
+    assert [location['id'] for location in locations] == [4]
+    assert _parent_ids(locations[0]) == (1, 2, 3)
+
+    cities = list(osm_names.iter_locations(ResolutionTypes.CITY, min_importance=.7))
+    assert cities == locations
+    assert not list(osm_names.iter_locations(ResolutionTypes.ADMIN_1, min_importance=.7))
@@ -0,0 +1,111 @@
+import json
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from geonamescache.geonames.data_source import DataSource
+from geonamescache.geonames.snapshot import (
+    iter_snapshot,
+    select_locations,
+    write_shards,
+    write_snapshot,
+)
+from location_factories import admin_1, city, country
+
+
+@pytest.fixture
+def shards(shards_dir):
+    france = country(1, u'France', u'FR', [2])
+    spain = country(2, u'Spain', u'ES', [1])
+    locations_by_id = {
+        1: france, 2: spain, 10: city(10, u'Paris', france), 20: city(20, u'Madrid', spain),
+        21: city(21, u'Paris', spain),
+    }
+    locations_by_name = {
+        u'France': [1], u'Spain': [2], u'Paris': [10, 21], u'Madrid': [20], u'Espana': [2],
+    }
+    write_shards(shards_dir, locations_by_name, locations_by_id)
+    return locations_by_id
+
+def test_shards(shards):
+    france_only = DataSource(countries=['fr'])
+    assert france_only.city_search('Paris').keys() == [10]
+    assert france_only.country_search('France').keys() == [1]
+    assert not france_only.all_locations_search('Madrid')
+    # Neighbors can be looked up by id, but not searched for.
+    assert not france_only.country_search('Spain')
+    assert france_only.get_location_by_id(2) == shards[2]
+
+    both = DataSource(countries=['FR', 'ES'])
+    assert sorted(both.city_search('Paris')) == [10, 21]
+    assert both.country_search('Espana').keys() == [2]
+    assert both.get_location_by_id(20) == shards[20]
+
+    with pytest.raises(ValueError):
+        DataSource(countries=['XX'])
+
+def test_select_locations():
+    france = country(1, u'France', u'FR')
+    ile_de_france = admin_1(5, u'Ile-de-France', france, 2200)
+    paris = city(10, u'Paris', france, 2000, ile_de_france)
+    nice = city(11, u'Nice', france, 200)
+    locations_by_id = {1: france, 5: ile_de_france, 10: paris, 11: nice}
+    locations_by_name = {
+        u'France': [1], u'Ile-de-France': [5], u'Paris': [10], u'City of Light': [10],
+        u'Nice': [11],
+    }
+
+    # Countries and the admins of kept locations are always kept.
+    for selection in ({'min_population': 2500}, {'top_n_by_importance': 0}):
+        selected_by_name, selected_by_id = select_locations(
+            locations_by_name, locations_by_id, **selection
+        )
+        assert selected_by_id == {1: france}
+        assert selected_by_name == {u'France': [1]}
+
+    selected_by_name, selected_by_id = select_locations(
+        locations_by_name, locations_by_id, min_population=1000
+    )
+    assert selected_by_id == {1: france, 5: ile_de_france, 10: paris}
+    assert selected_by_name[u'City of Light'] == [10]
+    assert u'Nice' not in selected_by_name
+    # Admin populations are not recomputed.
+    assert selected_by_id[5]['population'] == 2200
+
+    paris['estimated_importance'] = .1
+    nice['estimated_importance'] = .5
+    selected_by_name, selected_by_id = select_locations(
+        locations_by_name, locations_by_id, min_population=1, top_n_by_importance=1
+    )
+    assert sorted(selected_by_id) == [1, 11]
+
+def test_canonical_snapshot():
+    france = country(1, u'France', u'FR')
+    paris = city(10, u'Paris', france)
+    nice = city(11, u'Nice', france)
+    locations_by_name = {u'Paris': [10], u'Nice': [11], u'France': [1], u'P': [11, 10]}
+
+    directory = tempfile.mkdtemp()
+    try:
+        filepaths = [os.path.join(directory, name) for name in ('a.json', 'b.json')]
+        write_snapshot(filepaths[0], locations_by_name, {10: paris, 11: nice, 1: france})
+        write_snapshot(
+            filepaths[1], dict(reversed(locations_by_name.items())),
+            {1: france, 11: nice, 10: paris},
+        )
+        with open(filepaths[0]) as file_a, open(filepaths[1]) as file_b:
+            assert file_a.read() == file_b.read()
+
+        with open(filepaths[0]) as snapshot_file:
+            assert list(iter_snapshot(snapshot_file)) == [
+                ('locations', france), ('locations', paris), ('locations', nice),
+                ('names', (u'France', [1])), ('names', (u'Nice', [11])),
+                ('names', (u'P', [10, 11])), ('names', (u'Paris', [10])),
+            ]
+        # Snapshots are still plain JSON.
+        with open(filepaths[0]) as snapshot_file:
+            assert json.load(snapshot_file)['names'][u'P'] == [10, 11]
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,182 @@
+import math
+import random
+
+import numpy as np
+import pytest
+
+from geonamescache.geonames.data_source import DataSource
+from geonamescache.geonames.snapshot import write_shards
+from geonamescache.geonames.spatial import (
+    get_box_area,
+    get_longitude_interval,
+    get_mean_longitude,
+    GridIndex,
+    haversine_km,
+)
+from geonamescache.geonames.utils import ResolutionTypes
+from location_factories import admin_1, city, country
+
+
+def test_haversine_km():
+    assert haversine_km(10, 20, 10, 20) == 0
+    # Paris to London
+    assert abs(haversine_km(48.8566, 2.3522, 51.5074, -.1278) - 343.5) < 1
+    # Across the antimeridian
+    assert abs(haversine_km(0, 179.5, 0, -179.5) - 111.2) < .1
+
+def test_get_box_area():
+    assert abs(get_box_area(0, 0, 1, 1) - 111.19 ** 2) < 1
+    assert get_box_area(60, 0, 61, 1) < get_box_area(0, 0, 1, 1) / 1.9
+    # Across the antimeridian
+    assert abs(get_box_area(0, 179.5, 1, -179.5) - get_box_area(0, 0, 1, 1)) < 1e-6
+
+def test_get_longitude_interval():
+    assert get_longitude_interval([10.]) == (10., 10.)
+    assert get_longitude_interval([-5., 20., 3.]) == (-5., 20.)
+    # Fiji has cities on both sides of the antimeridian.
+    assert get_longitude_interval([178.4, -179.9, 177.4, -178.8]) == (177.4, -178.8)
+    assert get_longitude_interval([-170., 10., 170.]) == (10., -170.)
+
+def test_get_mean_longitude():
+    def mean(longitudes):
+        return get_mean_longitude(
+            sum(math.sin(math.radians(longitude)) for longitude in longitudes),
+            sum(math.cos(math.radians(longitude)) for longitude in longitudes),
+        )
+
+    assert abs(mean([10., 20.]) - 15) < 1e-9
+    assert abs(abs(mean([179., -179.])) - 180) < 1e-9
+    assert abs(mean([178., -179.]) - 179.5) < 1e-9
+
+def _random_box(max_size):
+    # Returns the box and its width, wrapping around the antimeridian if it goes past 180.
+    south, west = random.uniform(-90, 90 - max_size), random.uniform(-180, 180)
+    width = random.uniform(0, max_size)
+    east = west + width
+    if east > 180:
+        east -= 360
+    return [south, west, south + random.uniform(0, max_size), east], width
+
+def test_grid_index():
+    random.seed(0)
+    points = {
+        id_: (random.uniform(-90, 90), random.uniform(-180, 180)) for id_ in xrange(2000)
+    }
+    boxes = {}
+    for id_ in xrange(2000, 2200):
+        boxes[id_] = _random_box(10)
+    # Cover too many cells to be indexed by cell
+    boxes[2200] = [-80, -170, 80, 170], 340
+    boxes[2201] = [-80, 170, 80, 160], 350
+
+    index = GridIndex(cell_size=5)
+    for id_, (latitude, longitude) in points.iteritems():
+        index.add_point(id_, latitude, longitude)
+    for id_, (box, _) in boxes.iteritems():
+        index.add_box(id_, box)
+
+    for _ in xrange(100):
+        query, width = _random_box(30)
+        assert index.points_in_box(query) == set(
+            id_ for id_, (latitude, longitude) in points.iteritems()
+            if query[0] <= latitude <= query[2] and (longitude - query[1]) % 360 <= width
+        )
+        assert index.boxes_intersecting(query) == set(
+            id_ for id_, (box, box_width) in boxes.iteritems()
+            if box[0] <= query[2] and query[0] <= box[2]
+            and ((box[1] - query[1]) % 360 <= width or (query[1] - box[1]) % 360 <= box_width)
+        )
+
+        latitude, longitude = random.uniform(-90, 90), random.uniform(-180, 180)
+        assert index.nearest_point(latitude, longitude) == min(
+            (haversine_km(latitude, longitude, *point), id_) for id_, point in points.iteritems()
+        )
+
+    assert index.nearest_point(0, 179.9, max_distance_km=1) is None
+    index.add_point(-1, 0, -179.9)
+    # The nearest point is across the antimeridian.
+    assert index.nearest_point(0, 179.9)[1] == -1
+
+
+@pytest.fixture
+def data_source(shards_dir):
+    france = country(1, u'France', u'FR', box=[43.3, -1.55, 48.86, 7.26])
+    ile_de_france = admin_1(2, u'Ile-de-France', france, box=[48.8, 2.2, 48.9, 2.4])
+    south = admin_1(3, u'Provence', france, box=[43.3, 5.37, 43.7, 7.26])
+    fiji = country(4, u'Fiji', u'FJ', box=[-19.2, 177.4, -16.4, -178.5])
+    locations_by_id = {
+        1: france, 2: ile_de_france, 3: south,
+        10: city(10, u'Paris', france, admin_1=ile_de_france, latitude=48.86, longitude=2.35),
+        11: city(11, u'Boulogne', france, admin_1=ile_de_france, latitude=48.84, longitude=2.24),
+        20: city(20, u'Marseille', france, admin_1=south, latitude=43.3, longitude=5.37),
+        21: city(21, u'Nice', france, admin_1=south, latitude=43.7, longitude=7.26),
+        # Across the antimeridian
+        4: fiji,
+        30: city(30, u'Lambasa', fiji, latitude=-17.5, longitude=179.4),
+        31: city(31, u'Levuka', fiji, latitude=-17.7, longitude=178.8),
+    }
+    locations_by_name = {
+        location['name']: [id_] for id_, location in locations_by_id.iteritems()
+    }
+    write_shards(shards_dir, locations_by_name, locations_by_id)
+    return DataSource(countries=['FR', 'FJ'])
+
+def test_locations_in_box(data_source):
+    assert sorted(data_source.locations_in_box(48, 2, 49, 3)) == [1, 2, 10, 11]
+    assert sorted(data_source.locations_in_box(48, 2, 49, 2.3, ResolutionTypes.CITY)) == [11]
+    assert sorted(data_source.locations_in_box(43, 5, 44, 6, ResolutionTypes.ADMIN_1)) == [3]
+    assert not data_source.locations_in_box(0, 0, 1, 1)
+    assert sorted(data_source.locations_in_box(-18, 179, -17, -179)) == [4, 30]
+    assert sorted(data_source.locations_in_box(-17, 177, -16, 178)) == [4]
+
+    results = data_source.locations_in_box(48, 2, 49, 3)
+    results[10]['name'] = u'changed'
+    assert data_source.get_location_by_id(10)['name'] == u'Paris'
+
+def test_reverse_geocode(data_source):
+    results = data_source.reverse_geocode(48.85, 2.33)
+    assert {
+        resolution: location['id'] for resolution, location in results.iteritems()
+    } == {ResolutionTypes.CITY: 10, ResolutionTypes.ADMIN_1: 2, ResolutionTypes.COUNTRY: 1}
+    assert data_source.reverse_geocode(43.6, 7.1)[ResolutionTypes.CITY]['name'] == u'Nice'
+    assert data_source.reverse_geocode(45, 3) == {}
+    assert data_source.reverse_geocode(45, 3, max_distance_km=500)
+
+def test_distance(data_source):
+    paris_to_marseille = data_source.distance(10, 20)
+    assert abs(paris_to_marseille - 661) < 1
+    assert data_source.distance(20, 10) == paris_to_marseille
+    assert data_source.distance(10, 10) == 0
+    assert data_source.distance(10, 12345) is None
+    assert data_source.distance('10', u'20') == paris_to_marseille
+    assert data_source.distance('10', 'bad id') is None
+    assert data_source.distance_cache_info() is None
+
+    cached = DataSource(countries=['FR'], distance_cache_size=2)
+    assert cached.distance(10, 20) == paris_to_marseille
+    assert cached.distance(20, 10) == paris_to_marseille
+    assert cached.distance(10, 12345) is None
+    assert cached.distance('12345', '10') is None
+    info = cached.distance_cache_info()
+    assert (info['hits'], info['misses'], info['size']) == (2, 2, 2)
+
+def test_distance_matrix(data_source):
+    ids_a = [10, 20, 12345]
+    ids_b = [21, 1, 10, 2]
+    matrix = data_source.distance_matrix(ids_a, ids_b)
+    assert matrix.shape == (3, 4)
+    for i, id_a in enumerate(ids_a):
+        for j, id_b in enumerate(ids_b):
+            distance = data_source.distance(id_a, id_b)
+            if distance is None:
+                assert np.isnan(matrix[i, j])
+            else:
+                assert abs(matrix[i, j] - distance) < 1e-6
+    assert data_source.distance_matrix([], ids_b).shape == (0, 4)
+
+    string_ids_b = [str(id_) for id_ in ids_b]
+    string_matrix = data_source.distance_matrix(['10', u'20', 'bad id'], string_ids_b)
+    assert np.array_equal(string_matrix[:2], matrix[:2])
+    assert np.isnan(string_matrix[2]).all()
+
+    assert np.isnan(DataSource(countries=[]).distance_matrix(ids_a, ids_b)).all()
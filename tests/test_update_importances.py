@@ -0,0 +1,98 @@
+import json
+import os
+
+import numpy as np
+from sklearn.linear_model import Ridge
+
+import update_importances
+from estimate_importances import get_features, get_location_columns, load_state, save_state
+from geonamescache.geonames.utils import ResolutionTypes
+from location_factories import city, country
+from update_importances import find_changed_locations, run
+
+
+def _models():
+    # A tiny linear model of the importance, the same for every resolution.
+    model = Ridge(alpha=.01)
+    model.fit(np.log([[.5, .1], [.9, .1], [.5, .5], [.9, .5]]), [.4, .6, .5, .8])
+    return {
+        ResolutionTypes.CITY: model, ResolutionTypes.ADMIN_1: model, ResolutionTypes.ADMIN_2: model,
+    }
+
+def _locations():
+    france = country(1, u'France', u'FR', population=100000)
+    spain = country(2, u'Spain', u'ES', population=200000)
+    return [
+        france, spain,
+        city(10, u'Paris', france, population=10000),
+        city(11, u'Lyon', france, population=20000),
+        city(20, u'Madrid', spain, population=50000),
+        city(21, u'Sevilla', spain, population=10000),
+    ]
+
+def test_find_changed_locations():
+    location_importances = {1: .7, 2: .8}
+    old_columns = get_location_columns(_locations())
+    old_features, _ = get_features(old_columns, location_importances)
+
+    locations = _locations()
+    locations[3]['population'] = 30000
+    locations.append(city(12, u'Nice', locations[0], population=10000))
+    location_columns = get_location_columns(locations)
+    features, _ = get_features(location_columns, location_importances)
+    is_changed = find_changed_locations(old_columns, old_features, location_columns, features)
+    assert location_columns['id'][is_changed].tolist() == [11, 12]
+
+    # The features of the cities of a country change with its importance.
+    features, _ = get_features(location_columns, {1: .7, 2: .9})
+    is_changed = find_changed_locations(old_columns, old_features, location_columns, features)
+    assert location_columns['id'][is_changed].tolist() == [11, 20, 21, 12]
+
+    # Without saved columns, every location is new.
+    empty_columns = get_location_columns([])
+    empty_features, _ = get_features(empty_columns, location_importances)
+    assert find_changed_locations(
+        empty_columns, empty_features, location_columns, features
+    ).all()
+
+def test_run(directory, monkeypatch):
+    models = _models()
+    location_importances = {1: .7, 2: .8}
+    state_dir = os.path.join(directory, 'state')
+    save_state(state_dir, models, get_location_columns(_locations()), location_importances)
+    importance_filepath = os.path.join(directory, 'estimated_importance.json')
+    with open(importance_filepath, 'w') as importance_file:
+        json.dump({'1': .7, '2': .8, '10': .5, '11': .5, '20': .5, '21': .5}, importance_file)
+
+    # Lyon grows, Sevilla is removed, and Nice and a small village are new.
+    locations = _locations()
+    france = locations[0]
+    locations[3]['population'] = 30000
+    del locations[5]
+    locations.extend([
+        city(12, u'Nice', france, population=10000), city(13, u'Village', france, population=100),
+    ])
+    monkeypatch.setattr(update_importances.geonames, 'iter_locations', lambda: iter(locations))
+    run(state_dir, importance_filepath)
+
+    with open(importance_filepath) as importance_file:
+        importances = json.load(importance_file)
+    predict = models[ResolutionTypes.CITY].predict
+    assert importances == {
+        # Unchanged locations keep their importances.
+        '1': .7, '2': .8, '10': .5, '20': .5,
+        '11': predict(np.log([[.7, .3]]))[0],
+        '12': predict(np.log([[.7, .1]]))[0],
+        '13': .4,
+    }
+
+    loaded_models, columns, features, loaded_importances = load_state(state_dir)
+    assert sorted(loaded_models) == sorted(models)
+    assert loaded_importances == location_importances
+    location_columns = get_location_columns(locations)
+    assert sorted(columns) == sorted(location_columns)
+    for name, values in location_columns.iteritems():
+        np.testing.assert_array_equal(columns[name], values)
+    np.testing.assert_array_equal(
+        features, get_features(location_columns, location_importances)[0]
+    )